@@ -0,0 +1,141 @@
+"""
+Amazon Bedrock (AWS環境) の呼び出し。
+
+- make_client: コネクションプール・タイムアウト・再試行を調整した bedrock-runtime クライアントを作る
+  (resource_manager がプロセス内で保持し、Lambdaのウォームスタート時は使い回す)。
+- BedrockEmbeddingModel: Titan Text Embeddings でテキストをベクトル化する。Titan v1 は1回の呼び出しで
+  1件しかベクトル化できないため、複数のテキストはスレッドで並行して呼び出す。SentenceTransformer と同じ
+  encode(texts) のインターフェースを持つため、Embeddingキャッシュ・スケジューラー・インポートをそのまま使える。
+- stream_text: Claude の応答を InvokeModelWithResponseStream で届いた順に返す。
+
+boto3 は adaptive モードで再試行し (スロットリングを受けると送信のペースを落とす)、それでも解消しない
+スロットリングは with_backoff が指数バックオフ (フルジッター) で再試行する。
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+import tracing
+
+# スロットリング・一時的な過負荷を表すエラーコード (ストリーミング中のイベントは先頭が小文字になる)
+THROTTLING_ERROR_CODES = {
+    'throttlingexception', 'toomanyrequestsexception', 'serviceunavailableexception', 'modelnotreadyexception',
+}
+_ANTHROPIC_VERSION = 'bedrock-2023-05-31'
+
+
+def make_client():
+    """bedrock-runtime のクライアントを作る。クライアントはスレッドセーフで、複数スレッドから共有できる。"""
+    import boto3
+    from botocore.config import Config
+    return boto3.client('bedrock-runtime', region_name=config.AWS_REGION, config=Config(
+        max_pool_connections=config.BEDROCK_MAX_POOL_CONNECTIONS,
+        connect_timeout=config.BEDROCK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=config.BEDROCK_READ_TIMEOUT_SECONDS,
+        retries={'mode': 'adaptive', 'total_max_attempts': config.BEDROCK_SDK_MAX_ATTEMPTS},
+    ))
+
+
+def is_throttling(error: Exception) -> bool:
+    """スロットリング (再試行すれば成功しうるエラー) かどうか。"""
+    response = getattr(error, 'response', None) or {}
+    return str(response.get('Error', {}).get('Code', '')).lower() in THROTTLING_ERROR_CODES
+
+
+def backoff_delay(attempt: int) -> float:
+    """attempt 回目 (0始まり) の再試行までの待ち時間 (指数バックオフ + フルジッター)。"""
+    return random.uniform(0, min(config.BEDROCK_BACKOFF_MAX_SECONDS, config.BEDROCK_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def with_backoff(call, *args, **kwargs):
+    """call を呼び出し、スロットリングされた場合は BEDROCK_THROTTLE_RETRIES 回まで待って再試行する。"""
+    for attempt in range(config.BEDROCK_THROTTLE_RETRIES + 1):
+        try:
+            return call(*args, **kwargs)
+        except Exception as e:
+            if not is_throttling(e) or attempt == config.BEDROCK_THROTTLE_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            tracing.warn(f"[WARN] Bedrock throttled the request. Retrying in {delay:.2f}s ({attempt + 1}/{config.BEDROCK_THROTTLE_RETRIES})")
+            time.sleep(delay)
+
+
+class BedrockEmbeddingModel:
+    """
+    Titan Text Embeddings によるEmbeddingモデル。
+
+    Args:
+        client: bedrock-runtime のクライアント。
+        model_id (str): 省略時は config.AWS_BEDROCK_EMBEDDING_MODEL_ID。
+        max_workers (int): 並行して呼び出す最大数。省略時は config.BEDROCK_EMBEDDING_CONCURRENCY。
+    """
+
+    def __init__(self, client, model_id: str = None, max_workers: int = None):
+        self.client = client
+        self.model_id = model_id or config.AWS_BEDROCK_EMBEDDING_MODEL_ID
+        self.max_workers = max_workers or config.BEDROCK_EMBEDDING_CONCURRENCY
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def embed_one(self, text: str) -> list:
+        response = with_backoff(
+            self.client.invoke_model, modelId=self.model_id, body=json.dumps({"inputText": text}),
+            contentType='application/json', accept='application/json',
+        )
+        return json.loads(response['body'].read())['embedding']
+
+    def encode(self, texts, **kwargs):
+        """テキスト (またはテキストのリスト) をベクトル (のリスト) に変換する。"""
+        if isinstance(texts, str):
+            return self.embed_one(texts)
+        if len(texts) <= 1:
+            return [self.embed_one(text) for text in texts]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bedrock-embedding')
+        return list(self._executor.map(self.embed_one, texts))
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def _claude_request(prompt_string: str, max_tokens: int) -> str:
+    return json.dumps({
+        "anthropic_version": _ANTHROPIC_VERSION,
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt_string}],
+    })
+
+
+def stream_text(client, prompt_string: str, model_id: str = None, max_tokens: int = None):
+    """
+    Claude を InvokeModelWithResponseStream で呼び出し、生成されたテキストを届いた順に返す。
+    最初のテキストが届く前にスロットリングされた場合は、待ってから呼び出し直す
+    (届き始めた後の失敗は、出力が重複しないよう再試行せずに送出する)。
+    """
+    model_id = model_id or config.AWS_BEDROCK_LLM_MODEL_ID
+    body = _claude_request(prompt_string, max_tokens or config.PROMPT_RESERVED_OUTPUT_TOKENS)
+    for attempt in range(config.BEDROCK_THROTTLE_RETRIES + 1):
+        started = False
+        try:
+            response = client.invoke_model_with_response_stream(
+                modelId=model_id, body=body, contentType='application/json', accept='application/json',
+            )
+            for event in response['body']:
+                chunk = json.loads(event['chunk']['bytes']) if 'chunk' in event else {}
+                if chunk.get('type') == 'content_block_delta' and chunk['delta'].get('type') == 'text_delta':
+                    started = True
+                    yield chunk['delta']['text']
+            return
+        except Exception as e:
+            if started or not is_throttling(e) or attempt == config.BEDROCK_THROTTLE_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            tracing.warn(f"[WARN] Bedrock throttled the stream. Retrying in {delay:.2f}s ({attempt + 1}/{config.BEDROCK_THROTTLE_RETRIES})")
+            time.sleep(delay)
+
@@ -0,0 +1,111 @@
+"""
+ベンチマーク用の合成コーパス (dummy_data.json と同じ形式のチケットデータ) を作る。
+
+同じシードからは常に同じデータを作る。レコードは1件ずつ生成するため、100万アイテム規模でもメモリを使わない。
+レビューコメントの一部は、実際のレビューと同じく定型の指摘を少しだけ言い換えたものにする (近似重複のまとめの対象)。
+
+    python benchmarks/corpus.py --items 100000 --output benchmark_output/corpus.jsonl
+"""
+import argparse
+import json
+import os
+import random
+
+FEATURES = ["ユーザーログイン", "CSVダウンロード", "画像アップロード", "通知設定", "検索", "パスワード再設定",
+            "請求書の発行", "ダッシュボード", "権限管理", "二段階認証", "ファイル共有", "コメント機能",
+            "タグ付け", "一括編集", "監査ログ", "APIキーの発行", "メール配信", "カレンダー連携"]
+TARGETS = ["管理画面", "スマートフォン版", "一覧画面", "詳細画面", "設定画面", "外部連携", "バッチ処理", "帳票出力"]
+BENEFITS = ["作業時間を短縮できます", "操作ミスを防げます", "セキュリティが向上します", "状況をすぐに把握できます",
+            "他のサービスと連携しやすくなります", "大量のデータも扱えるようになります"]
+CONDITIONS = ["ユーザー名に特殊文字を含む場合", "1000件以上のデータを扱う場合", "タイムゾーンが日本以外の場合",
+              "ブラウザの言語設定が英語の場合", "同時に複数のタブで操作した場合", "ファイル名に空白を含む場合"]
+FIXES = ["エスケープ処理を追加し", "ページングを見直し", "日時の変換処理を修正し", "排他制御を追加し",
+         "入力チェックを追加し", "キャッシュの更新処理を修正し"]
+# 多くのPRで繰り返される定型の指摘
+COMMON_REMARKS = [
+    "「メリット」の表現が少し弱いかもしれません。具体的に書くとどうでしょうか？",
+    "「効率化」の内容をもう少しだけ具体的に書けますか？",
+    "発生条件をもう少し詳しく書いてください。",
+    "用語を「ユーザー」に統一してください。",
+    "改善の効果を数値で示せると分かりやすいです。",
+    "影響範囲（対象の画面）を明記してください。",
+    "修正内容がユーザーに分かる言葉になっているか確認してください。",
+    "箇条書きの末尾の句点を統一してください。",
+]
+REMARK_SUFFIXES = ["", "", "", "（他のチケットも同様）", " お願いします。", "！"]
+
+
+def _release_note(rng: random.Random) -> str:
+    feature, target = rng.choice(FEATURES), rng.choice(TARGETS)
+    kind = rng.choice(("機能系", "改善系", "不具合系"))
+    if kind == "機能系":
+        return (f"■ 機能系\n【機能概要】{target}に{feature}機能を追加しました。\n"
+                f"【メリット】{rng.choice(BENEFITS)}。")
+    if kind == "改善系":
+        return (f"■ 改善系\n【概要】{target}の{feature}の処理を改善しました。\n"
+                f"【変更内容】処理を見直し、待機時間を平均{rng.randint(10, 90)}%削減しました。")
+    return (f"■ 不具合系\n【不具合概要】{target}で{feature}が正しく動作しない不具合がありました。\n"
+            f"【発生条件】{rng.choice(CONDITIONS)}。\n"
+            f"【修正内容】{rng.choice(FIXES)}、正しく動作するように修正しました。")
+
+
+def _comment(rng: random.Random, note: str, repeat_ratio: float) -> dict:
+    lines = [line for line in note.split("\n") if line.startswith("【")]
+    context_line = rng.choice(lines)
+    if rng.random() < repeat_ratio:
+        text = rng.choice(COMMON_REMARKS) + rng.choice(REMARK_SUFFIXES)
+    else:
+        text = f"「{context_line.split('】', 1)[-1][:20]}」について、{rng.choice(BENEFITS)}という点を補足してください。"
+    return {"comment_text": text, "context_line": context_line}
+
+
+def generate_records(items: int, seed: int = 0, max_comments: int = 4, repeat_ratio: float = 0.4):
+    """
+    アイテム (リリースノート + レビューコメント) の合計が items 件以上になるまで、チケットデータを順に返す。
+
+    Args:
+        seed (int): 乱数のシード。
+        max_comments (int): 1チケットあたりのレビューコメントの最大数 (0 から一様に選ぶ)。
+        repeat_ratio (float): 定型の指摘を言い換えたコメントの割合。
+    """
+    rng = random.Random(seed)
+    produced = 0
+    number = 0
+    while produced < items:
+        number += 1
+        note = _release_note(rng)
+        comments = [_comment(rng, note, repeat_ratio) for _ in range(rng.randint(0, max_comments))]
+        produced += 1 + len(comments)
+        yield {"ticket_id": f"BENCH-{number:07d}", "final_release_note": note, "review_comments": comments}
+
+
+def query_texts(count: int, seed: int = 1) -> list:
+    """検索・生成のベンチマークに使う仕様書風の入力を返す。"""
+    rng = random.Random(seed)
+    return [
+        f"# {rng.choice(FEATURES)}の仕様\n{rng.choice(TARGETS)}で{rng.choice(FEATURES)}を使えるようにする。"
+        f"{rng.choice(CONDITIONS)}も考慮する。"
+        for _ in range(count)
+    ]
+
+
+def write_jsonl(path: str, records) -> int:
+    """レコードをJSONLファイルに書き出し、件数を返す。"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic ticket corpus for benchmarks.")
+    parser.add_argument('--items', type=int, default=10000, help='アイテム (リリースノート + コメント) の件数。')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat-ratio', type=float, default=0.4, help='定型の指摘を言い換えたコメントの割合。')
+    parser.add_argument('--output', type=str, default='./benchmark_output/corpus.jsonl')
+    args = parser.parse_args()
+    tickets = write_jsonl(args.output, generate_records(args.items, args.seed, repeat_ratio=args.repeat_ratio))
+    print(f"Wrote {tickets} tickets (>= {args.items} items) to {args.output}")
@@ -0,0 +1,130 @@
+"""
+ローカルのEmbeddingの推論方法 (EMBEDDING_BACKEND) を比較するベンチマーク。
+
+推論方法ごとに新しいプロセスを起動し、ライブラリのimportとモデルの読み込みにかかる時間 (コールドスタート)、
+インポート時のスループット (件/秒, バッチ推論)、1件のクエリのレイテンシ (p50/p99)、
+SentenceTransformer の出力とのコサイン類似度 (最小値) を比較する。
+
+    python benchmarks/embedding_backends.py
+    python benchmarks/embedding_backends.py --backends onnx onnx-int8 --threads 4
+    python benchmarks/embedding_backends.py --texts dummy_data.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 名前 -> (EMBEDDING_BACKEND, ONNX_QUANTIZATION)
+BACKENDS = {
+    'sentence_transformers': ('sentence_transformers', 'none'),
+    'onnx': ('onnx', 'none'),
+    'onnx-int8': ('onnx', 'int8'),
+}
+
+
+def load_texts(path: str, count: int) -> list:
+    """dummy_data.json 形式のファイルからリリースノートとレビューコメントを集める。ない場合は合成する。"""
+    texts = []
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            for ticket in json.load(f):
+                texts.append(ticket.get('final_release_note') or '')
+                texts.extend(comment.get('comment_text') or '' for comment in ticket.get('review_comments', []))
+    texts = [text for text in texts if text.strip()]
+    if not texts:
+        texts = [f"■ 機能系\n【機能概要】チケット{i}の仕様変更。" + "画面の表示を改善しました。" * (i % 8 + 1)
+                 for i in range(64)]
+    return [texts[i % len(texts)] for i in range(count)]
+
+
+def worker(name: str, args) -> dict:
+    """指定した推論方法でモデルを読み込んで測定する (ベンチマークの子プロセスで実行する)。"""
+    import numpy as np
+    import resource_manager
+
+    texts = load_texts(args.texts, args.count)
+    started_at = time.perf_counter()
+    model = resource_manager.get_embedding_model()
+    model.encode(texts[:1])  # 初回の推論 (グラフの最適化など) も読み込みに含める
+    load_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    vectors = np.asarray(model.encode(texts, batch_size=args.batch_size))
+    throughput = len(texts) / (time.perf_counter() - started_at)
+
+    latencies = []
+    for text in texts[:args.queries]:
+        started_at = time.perf_counter()
+        model.encode([text])
+        latencies.append(time.perf_counter() - started_at)
+    latencies.sort()
+    np.save(args.output + '.npy', vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+    return {
+        "backend": name,
+        "load_seconds": round(load_seconds, 2),
+        "texts_per_second": round(throughput, 1),
+        "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "query_p99_ms": round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 2),
+    }
+
+
+def run_backend(name: str, args) -> dict:
+    backend, quantization = BACKENDS[name]
+    output = os.path.join(args.work_dir, name)
+    env = dict(os.environ, EMBEDDING_BACKEND=backend, ONNX_QUANTIZATION=quantization,
+               ONNX_INTRA_OP_THREADS=str(args.threads), EMBEDDING_CACHE_ENABLED='false')
+    command = [sys.executable, os.path.abspath(__file__), '--worker', name, '--output', output,
+               '--count', str(args.count), '--queries', str(args.queries), '--batch-size', str(args.batch_size)]
+    if args.texts:
+        command += ['--texts', args.texts]
+    started_at = time.perf_counter()
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"[WARN] {name} failed:\n{result.stderr.strip()}")
+        return None
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats["process_seconds"] = round(time.perf_counter() - started_at, 2)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare local embedding backends.")
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument('--texts', type=str, default=None, help='dummy_data.json 形式の入力。省略時は合成テキスト。')
+    parser.add_argument('--count', type=int, default=512, help='スループットの測定に使う件数。')
+    parser.add_argument('--queries', type=int, default=100, help='レイテンシの測定に使うクエリ数。')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=0, help='ONNX_INTRA_OP_THREADS (0で既定値)。')
+    parser.add_argument('--work-dir', type=str, default='./benchmark_output')
+    parser.add_argument('--json', type=str, default=None, help='結果をJSONで書き出すパス。')
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--output', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args)))
+        sys.exit(0)
+
+    import numpy as np
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = [stats for stats in (run_backend(name, args) for name in args.backends) if stats]
+    reference_path = os.path.join(args.work_dir, 'sentence_transformers.npy')
+    reference = np.load(reference_path) if os.path.exists(reference_path) else None
+    for stats in results:
+        if reference is not None:
+            vectors = np.load(os.path.join(args.work_dir, stats["backend"] + '.npy'))
+            stats["min_cosine_vs_st"] = round(float((vectors * reference).sum(axis=1).min()), 4)
+
+    print(f"texts: {args.count}, batch size: {args.batch_size}, queries: {args.queries}, threads: {args.threads or 'default'}")
+    print(f"{'backend':<22}{'load s':>8}{'process s':>11}{'texts/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'min cos':>9}")
+    for stats in results:
+        print(f"{stats['backend']:<22}{stats['load_seconds']:>8.2f}{stats['process_seconds']:>11.2f}"
+              f"{stats['texts_per_second']:>10.1f}{stats['query_p50_ms']:>9.2f}{stats['query_p99_ms']:>9.2f}"
+              f"{stats.get('min_cosine_vs_st', float('nan')):>9.4f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
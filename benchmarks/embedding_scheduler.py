@@ -0,0 +1,143 @@
+"""
+EmbeddingScheduler (マイクロバッチ) の効果を測定するベンチマーク。
+
+同時に利用するユーザー数ごとに、各ユーザーが1件ずつベクトル化を要求した場合のスループットとレイテンシを、
+要求ごとに encode を呼ぶ方式 (direct) とスケジューラーでまとめる方式 (scheduler) で比較する。
+
+    python benchmarks/embedding_scheduler.py                 # NumPyで推論コストを模した合成モデル
+    python benchmarks/embedding_scheduler.py --model sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from embedding_scheduler import EmbeddingScheduler  # noqa: E402
+
+
+class SyntheticModel:
+    """
+    MiniLM (6層, 384次元) 程度の計算量を模した合成モデル。
+
+    SentenceTransformer と同じく、入力を sub_batch_size 件ずつの小バッチに分け、小バッチ内の最長の入力に
+    パディングして全結合層を重ねる (入力順に分けるため、長さの違う入力が混ざるとパディングが増える)。
+    フレームワークの演算の呼び出しなど、件数によらない1回の推論あたりのコストを call_overhead_ms で模す
+    (PyTorchのCPU推論では数ミリ秒程度)。
+    """
+
+    def __init__(self, dim: int = 384, hidden: int = 1536, layers: int = 6, sub_batch_size: int = 32,
+                 call_overhead_ms: float = 3.0, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.layers = [(rng.normal(size=(dim, hidden)).astype(np.float32) / np.sqrt(dim),
+                        rng.normal(size=(hidden, dim)).astype(np.float32) / np.sqrt(hidden)) for _ in range(layers)]
+        self.embedding = rng.normal(size=(65536, dim)).astype(np.float32)
+        self.sub_batch_size = sub_batch_size
+        self.call_overhead_ms = call_overhead_ms
+
+    def _forward(self, texts):
+        deadline = time.perf_counter() + self.call_overhead_ms / 1000
+        while time.perf_counter() < deadline:  # GILを保持したまま消費する (Pythonでの前処理・演算の呼び出し)
+            pass
+        length = max(len(text) for text in texts)
+        ids = np.zeros((len(texts), length), dtype=np.int64)
+        for i, text in enumerate(texts):
+            ids[i, :len(text)] = [ord(ch) % 65536 for ch in text]
+        hidden = self.embedding[ids]
+        for up, down in self.layers:
+            hidden = hidden + np.maximum(hidden @ up, 0) @ down
+        return hidden.mean(axis=1)
+
+    def encode(self, texts):
+        return np.concatenate([self._forward(texts[i:i + self.sub_batch_size])
+                               for i in range(0, len(texts), self.sub_batch_size)])
+
+
+def make_texts(count: int, min_chars: int, max_chars: int, seed: int) -> list:
+    """長さが min_chars〜max_chars 文字でばらつくテキストを作る。"""
+    rng = np.random.default_rng(seed)
+    return ["仕" * int(length) for length in rng.integers(min_chars, max_chars + 1, size=count)]
+
+
+def run(encode, users: int, requests_per_user: int, texts: list, scheduler: EmbeddingScheduler = None) -> dict:
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(users)
+
+    def user(index):
+        barrier.wait()
+        for i in range(requests_per_user):
+            text = texts[(index * requests_per_user + i) % len(texts)]
+            started_at = time.perf_counter()
+            if scheduler is not None:
+                scheduler.embed(text)
+            else:
+                encode([text])
+            with lock:
+                latencies.append(time.perf_counter() - started_at)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched embedding under concurrent users.")
+    parser.add_argument('--model', type=str, default=None,
+                        help='SentenceTransformerのモデル名。省略時はNumPyの合成モデル。')
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 16, 64], help='同時に利用するユーザー数。')
+    parser.add_argument('--requests', type=int, default=8, help='ユーザーごとの要求数。')
+    parser.add_argument('--min-chars', type=int, default=20, help='入力の最小文字数。')
+    parser.add_argument('--max-chars', type=int, default=200, help='入力の最大文字数 (既定はCHUNK_MAX_CHARS)。')
+    parser.add_argument('--call-overhead-ms', type=float, default=3.0,
+                        help='合成モデルの、件数によらない1回の推論あたりのコスト。')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--length-ratio', type=float, default=2.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='結果をJSONで書き出すパス。')
+    args = parser.parse_args()
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model, device='cpu')
+    else:
+        model = SyntheticModel(call_overhead_ms=args.call_overhead_ms, seed=args.seed)
+    texts = make_texts(256, args.min_chars, args.max_chars, args.seed)
+    model.encode(texts[:4])  # ウォームアップ
+
+    results = []
+    for users in args.users:
+        direct = run(model.encode, users, args.requests, texts)
+        scheduler = EmbeddingScheduler(model.encode, args.max_batch_size, args.max_wait_ms, args.length_ratio)
+        batched = run(model.encode, users, args.requests, texts, scheduler)
+        scheduler.close()
+        results.append({"users": users, "direct": direct, "scheduler": batched,
+                        "mean_batch": round(scheduler.items / max(scheduler.batches, 1), 1)})
+
+    print(f"model: {args.model or 'synthetic'}, chars: {args.min_chars}-{args.max_chars}, requests/user: {args.requests}, "
+          f"max batch: {args.max_batch_size}, max wait: {args.max_wait_ms}ms")
+    print(f"{'users':>6}{'direct req/s':>14}{'p99 ms':>9}{'batched req/s':>15}{'p99 ms':>9}{'speedup':>9}{'batch':>7}")
+    for result in results:
+        direct, batched = result["direct"], result["scheduler"]
+        print(f"{result['users']:>6}{direct['requests_per_second']:>14.1f}{direct['p99_ms']:>9.1f}"
+              f"{batched['requests_per_second']:>15.1f}{batched['p99_ms']:>9.1f}"
+              f"{batched['requests_per_second'] / direct['requests_per_second']:>8.1f}x{result['mean_batch']:>7.1f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
@@ -0,0 +1,173 @@
+"""
+ベンチマーク用の、ネットワークやモデルを使わない決定的な代替 (遅延は設定できる)。
+
+- HashingEncoder: 文字2-gramのハッシュでベクトルを作るEmbeddingモデル (モデルのダウンロードが不要)。
+- FakeOllamaServer: Ollamaの /api/chat をストリーミングで返すローカルのHTTPサーバー (ollama.Client から使う)。
+- FakeBedrockClient: bedrock-runtime クライアントの代わり (Titanのベクトル化とClaudeのストリーミング)。
+- fake_bitbucket: Bitbucket APIのローカルのHTTPサーバー (tests/fake_bitbucket.py の FakeBitbucket を使う)。
+"""
+import io
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tests')))
+
+import config  # noqa: E402
+from fake_bitbucket import FakeBitbucket  # noqa: E402
+
+FAKE_RESPONSE = ("■ 機能系\n【機能概要】(benchmark) 管理画面に検索機能を追加しました。\n"
+                 "【メリット】(benchmark) 目的のデータをすぐに見つけられます。")
+
+
+class HashingEncoder:
+    """
+    テキストの文字2-gramを crc32 でハッシュして次元に割り当て、正規化したベクトルを返すEmbeddingモデル。
+    似た文字列ほど近いベクトルになり、同じ入力からは常に同じベクトルになる。
+
+    Args:
+        dim (int): 次元数。省略時は config.EMBEDDING_DIM。
+        item_ms (float): 1件あたりに模す推論時間 (ミリ秒)。
+    """
+
+    def __init__(self, dim: int = None, item_ms: float = 0.0):
+        self.dim = dim or config.EMBEDDING_DIM
+        self.item_ms = item_ms
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(max(len(text) - 1, 1)):
+            code = zlib.crc32(text[i:i + 2].encode('utf-8'))
+            vector[code % self.dim] += 1.0 if code & 0x80000000 else -1.0
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        if self.item_ms:
+            time.sleep(self.item_ms * len(texts) / 1000)
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+def _chunks(text: str, count: int) -> list:
+    size = max(-(-len(text) // max(count, 1)), 1)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeOllamaServer:
+    """
+    Ollamaの /api/chat を模すHTTPサーバー。最初のチャンクまで first_token_ms、以降はチャンクごとに token_ms 待つ。
+    OLLAMA_HOST に host を設定すると、ollama.Client() がこのサーバーに接続する。
+
+    Args:
+        chunks (int): 応答を分割するチャンク数。
+    """
+
+    def __init__(self, first_token_ms: float = 200.0, token_ms: float = 10.0, chunks: int = 20,
+                 response: str = FAKE_RESPONSE):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.chunks = _chunks(response, chunks)
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.host = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with fake._lock:
+                    fake.calls += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                time.sleep(fake.first_token_ms / 1000)
+                for i, chunk in enumerate(fake.chunks + [""]):
+                    if i:
+                        time.sleep(fake.token_ms / 1000)
+                    line = json.dumps({
+                        "model": request.get('model'), "created_at": "2024-01-01T00:00:00Z",
+                        "message": {"role": "assistant", "content": chunk}, "done": i == len(fake.chunks),
+                    }, ensure_ascii=False).encode('utf-8') + b"\n"
+                    self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+class FakeBedrockClient:
+    """
+    bedrock-runtime クライアントの代わり。Titanの呼び出しには HashingEncoder のベクトルを embedding_ms 後に返し、
+    Claudeのストリーミングは FakeOllamaServer と同じ遅延でチャンクを返す。
+    """
+
+    def __init__(self, first_token_ms: float = 200.0, token_ms: float = 10.0, chunks: int = 20,
+                 embedding_ms: float = 20.0, response: str = FAKE_RESPONSE):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.chunks = _chunks(response, chunks)
+        self.embedding_ms = embedding_ms
+        self.encoder = HashingEncoder(config.AWS_EMBEDDING_DIM)
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None):
+        time.sleep(self.embedding_ms / 1000)
+        vector = self.encoder.encode(json.loads(body)['inputText'])
+        return {'body': io.BytesIO(json.dumps({'embedding': vector.tolist()}).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+        def events():
+            time.sleep(self.first_token_ms / 1000)
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    time.sleep(self.token_ms / 1000)
+                delta = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': chunk}}
+                yield {'chunk': {'bytes': json.dumps(delta).encode()}}
+            yield {'chunk': {'bytes': json.dumps({'type': 'message_stop'}).encode()}}
+        return {'body': events()}
+
+
+def fake_pull_requests(records) -> list:
+    """チケットデータから、FakeBitbucket が返すPRのデータを作る。"""
+    return [
+        {
+            "id": i,
+            "title": record['ticket_id'],
+            "hash": f"{i:040x}",
+            "updated_on": f"2024-01-01T00:00:{i % 60:02d}+00:00",
+            "files": {"10-release.txt": record['final_release_note'], "20-design.md": record['final_release_note']},
+            "comments": [comment['comment_text'] for comment in record['review_comments']],
+        }
+        for i, record in enumerate(records, start=1)
+    ]
+
+
+def fake_bitbucket(pull_requests: list, latency_ms: float = 50.0, page_size: int = 50) -> FakeBitbucket:
+    """リクエストごとに latency_ms 待って応答するBitbucket APIのフェイクを返す (with文で起動・停止する)。"""
+    return FakeBitbucket(pull_requests, page_size=page_size, latency=latency_ms / 1000)
@@ -0,0 +1,112 @@
+"""
+量子化 (int8 / binary) の効果を測定するベンチマーク。
+
+NumpyVectorStore に同じコーパスを各モードで格納し、量子化しないfloat32の検索結果に対する
+再現率 (recall@k)、一次選別で走査するデータのサイズ、検索の所要時間を比較する。
+
+    python benchmarks/quantization.py                       # 合成データ (クラスタ状の正規分布)
+    python benchmarks/quantization.py --vectors numpy_index/gen-000001/vectors.npy   # 実際のEmbedding
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from numpy_store import NumpyVectorStore  # noqa: E402
+
+MODES = [
+    ('float32', 'none'),
+    ('float16', 'none'),
+    ('float32', 'int8'),
+    ('float32', 'binary'),
+]
+
+
+def make_corpus(count: int, dim: int, clusters: int, seed: int):
+    """Embeddingに似せた、クラスタ状に分布する単位ベクトルを作る。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, size=count)] + rng.normal(scale=0.6, size=(count, dim))
+    return vectors.astype(np.float32)
+
+
+def make_queries(vectors, count: int, seed: int):
+    """コーパスのベクトルに少しノイズを加えたものをクエリにする (似た仕様書での検索を想定)。"""
+    rng = np.random.default_rng(seed + 1)
+    base = vectors[rng.integers(0, len(vectors), size=count)]
+    return (base + rng.normal(scale=0.3 * np.abs(base).mean(), size=base.shape)).astype(np.float32)
+
+
+def run(vectors, queries, k: int, rerank_factor: int, repeat: int) -> list:
+    ids = [f"item-{i}" for i in range(len(vectors))]
+    documents = [""] * len(vectors)
+    metadatas = [{"content_type": "review_comment"}] * len(vectors)
+    results = []
+    baseline = None
+    for dtype, quantization in MODES:
+        with tempfile.TemporaryDirectory() as directory:
+            store = NumpyVectorStore(directory, dtype=dtype, quantization=quantization)
+            store.upsert(ids, vectors, documents, metadatas)
+            store.flush()
+            # 実運用と同じく、メモリマップで開き直して測定する
+            snapshot = NumpyVectorStore(directory)._current()
+
+            snapshot.search(queries[:1], k, rerank_factor=rerank_factor)
+            timings = []
+            for _ in range(repeat):
+                started_at = time.perf_counter()
+                found = snapshot.search(queries, k, rerank_factor=rerank_factor)
+                timings.append(time.perf_counter() - started_at)
+            found_ids = [{row for row, _ in hits} for hits in found]
+            if baseline is None:
+                baseline = found_ids
+            recall = float(np.mean([len(a & b) / k for a, b in zip(found_ids, baseline)]))
+            results.append({
+                "mode": quantization if quantization != 'none' else dtype,
+                "recall_at_k": round(recall, 4),
+                "index_bytes": snapshot.index_nbytes(),
+                "query_batch_ms": round(min(timings) * 1000, 2),
+                "per_query_ms": round(min(timings) * 1000 / len(queries), 4),
+            })
+    full_size = results[0]["index_bytes"]
+    for result in results:
+        result["memory_reduction"] = round(full_size / result["index_bytes"], 1)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector search (recall vs. memory vs. latency).")
+    parser.add_argument('--vectors', type=str, default=None, help='使用するEmbeddingの .npy ファイル。省略時は合成データ。')
+    parser.add_argument('--count', type=int, default=20000, help='合成データの件数。')
+    parser.add_argument('--dim', type=int, default=384, help='合成データの次元数。')
+    parser.add_argument('--clusters', type=int, default=200, help='合成データのクラスタ数。')
+    parser.add_argument('--queries', type=int, default=200, help='クエリ数。')
+    parser.add_argument('--k', type=int, default=5, help='取得件数。')
+    parser.add_argument('--rerank-factor', type=int, default=10, help='一次選別で残す候補の倍率。')
+    parser.add_argument('--repeat', type=int, default=3, help='測定の繰り返し回数 (最小値を採用)。')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='結果をJSONで書き出すパス。')
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = make_corpus(args.count, args.dim, args.clusters, args.seed)
+    queries = make_queries(vectors, args.queries, args.seed)
+    results = run(vectors, queries, args.k, args.rerank_factor, args.repeat)
+
+    print(f"corpus: {vectors.shape[0]} x {vectors.shape[1]}, queries: {len(queries)}, "
+          f"k: {args.k}, rerank factor: {args.rerank_factor}")
+    print(f"{'mode':<10}{'recall@k':>10}{'index MB':>12}{'reduction':>11}{'batch ms':>11}{'ms/query':>11}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['recall_at_k']:>10.4f}{result['index_bytes'] / 1e6:>12.2f}"
+              f"{result['memory_reduction']:>10.1f}x{result['query_batch_ms']:>11.2f}{result['per_query_ms']:>11.4f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
@@ -0,0 +1,268 @@
+"""
+インポート・検索・生成/レビュー・Bitbucketからの取得の性能を、外部のサービスやモデルなしで再現可能に測定する
+ベンチマークスイート。main_logic / db_importer / bitbucket_data_loader の変更の前後で結果を比較するために使う。
+
+シナリオ:
+- import: 合成コーパス (benchmarks/corpus.py) の初回インポートと、変更のない差分インポートのスループット
+- query: 生成用・レビュー用の検索 (ベクトル化を含む) のレイテンシ (p50/p95/p99)
+- e2e: generate / review / generate-review の全体と最初のトークンまでのレイテンシ (LLMはフェイク)
+- harvest: ローカルのフェイクのBitbucket APIからの取得時間
+
+結果はJSONで書き出し、--compare で以前の結果との差を表示する。
+
+    python benchmarks/suite.py --items 10000 --json benchmark_output/base.json
+    python benchmarks/suite.py --items 10000 --compare benchmark_output/base.json
+    python benchmarks/suite.py --scenarios e2e --llm bedrock --llm-first-token-ms 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config  # noqa: E402
+import resource_manager  # noqa: E402
+from corpus import generate_records, query_texts  # noqa: E402
+from fakes import (FakeBedrockClient, FakeOllamaServer, HashingEncoder, fake_bitbucket,  # noqa: E402
+                   fake_pull_requests)
+
+SCENARIOS = ('import', 'query', 'e2e', 'harvest')
+
+
+def summarize(seconds: list) -> dict:
+    """レイテンシ (秒) のリストを、ミリ秒の平均・パーセンタイルにまとめる。"""
+    from server import percentile
+    values = sorted(seconds)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        **{f"p{q}_ms": round(percentile(values, q) * 1000, 2) for q in (50, 95, 99)},
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    """測定中の print の出力を捨てる (端末への出力の時間を測定に含めないため)。"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def configure(args, work_dir: str):
+    """作業ディレクトリにインデックスを作り、フェイクのモデル・クライアントを使うように設定する。"""
+    config.VECTOR_STORE_BACKEND = args.store
+    config.NUMPY_INDEX_PATH = os.path.join(work_dir, 'numpy_index')
+    config.LOCAL_DB_PATH = os.path.join(work_dir, 'chroma_db')
+    config.LEXICAL_INDEX_ENABLED = args.lexical
+    config.LEXICAL_INDEX_PATH = os.path.join(work_dir, 'lexical_index', 'index.sqlite3')
+    config.EMBEDDING_CACHE_ENABLED = False
+    config.RESPONSE_CACHE_ENABLED = False
+    config.REVIEW_COMMENT_INDEX_ENABLED = True
+    config.LLM_STUB = False
+    if args.llm == 'bedrock':
+        config.ENVIRONMENT = 'aws'
+    resource_manager.shutdown()
+
+    latency = dict(first_token_ms=args.llm_first_token_ms, token_ms=args.llm_token_ms, chunks=args.llm_chunks)
+    if args.llm == 'bedrock' or args.embedding == 'bedrock':
+        # resource_manager が保持するクライアントを差し替える (Embedding と LLM で共有される)
+        resource_manager._resources['bedrock_client'] = FakeBedrockClient(
+            embedding_ms=args.embedding_ms, **latency)
+    if args.embedding == 'bedrock':
+        config.EMBEDDING_BACKEND = 'bedrock'
+    elif args.embedding == 'hashing':
+        resource_manager._resources[('embedding_model', config.EMBEDDING_BACKEND)] = HashingEncoder(
+            item_ms=args.embedding_ms)
+    ollama = None
+    if args.llm == 'ollama':
+        ollama = FakeOllamaServer(**latency).__enter__()
+        os.environ['OLLAMA_HOST'] = ollama.host
+    return ollama
+
+
+def run_import(args) -> dict:
+    import db_importer
+    store = resource_manager.get_vector_store(create=True)
+    comment_store = resource_manager.get_review_comment_store(create=True)
+    model = resource_manager.get_embedding_model()
+    results = {}
+    for name in ('initial', 'unchanged'):
+        started_at = time.perf_counter()
+        with quiet(not args.verbose):
+            stats = db_importer.import_documents(
+                generate_records(args.items, args.seed), store, model, incremental=True,
+                comment_store=comment_store)
+        seconds = time.perf_counter() - started_at
+        items = stats['upserted'] + stats['unchanged']
+        results[name] = {"tickets": stats['tickets'], "items": items, "seconds": round(seconds, 3),
+                         "items_per_second": round(items / seconds, 1)}
+    results["review_comment_index_items"] = comment_store.count()
+    return results
+
+
+def run_query(args) -> dict:
+    import main_logic
+    store = resource_manager.get_vector_store()
+    model = resource_manager.get_embedding_model()
+    generate, review = [], []
+    with quiet(not args.verbose):
+        resource_manager.get_review_comment_store()
+        for i, text in enumerate(query_texts(args.queries + 1, args.seed + 1)):
+            started_at = time.perf_counter()
+            chunk_vectors = main_logic.get_chunk_embeddings_local([text], model)[0]
+            main_logic.query_db_local(chunk_vectors, store, text=text)
+            generated_at = time.perf_counter()
+            chunk_vectors = main_logic.get_chunk_embeddings_local([text], model)[0]
+            main_logic.query_review_comments_batch([chunk_vectors], store, texts=[text])
+            if i:  # 1件目は読み込みを含むため除く
+                generate.append(generated_at - started_at)
+                review.append(time.perf_counter() - generated_at)
+    return {"generate_retrieval": summarize(generate), "review_retrieval": summarize(review)}
+
+
+def run_e2e(args) -> dict:
+    import main_logic
+    timings = {name: [] for name in ('generate_total', 'generate_ttft', 'review_total', 'review_ttft',
+                                     'pipeline_total')}
+    with quiet(not args.verbose):
+        for i, text in enumerate(query_texts(args.requests + 1, args.seed + 2)):
+            stream = main_logic.generate_release_note_draft_stream(text, use_cache=False)
+            draft = stream.text()
+            review = main_logic.review_release_note_stream(draft, use_cache=False)
+            review.text()
+            started_at = time.perf_counter()
+            for _, stage in main_logic.generate_then_review_stream(text, use_cache=False):
+                stage.text()
+            if not i:
+                continue
+            timings['generate_total'].append(stream.total_time)
+            timings['generate_ttft'].append(stream.time_to_first_token)
+            timings['review_total'].append(review.total_time)
+            timings['review_ttft'].append(review.time_to_first_token)
+            timings['pipeline_total'].append(time.perf_counter() - started_at)
+    return {name: summarize(values) for name, values in timings.items()}
+
+
+def run_harvest(args) -> dict:
+    from bitbucket_data_loader import BitbucketClient, load_bitbucket_data
+    records = []
+    for record in generate_records(args.items, args.seed):
+        records.append(record)
+        if len(records) >= args.prs:
+            break
+    with fake_bitbucket(fake_pull_requests(records), latency_ms=args.bitbucket_latency_ms) as fake:
+        client = BitbucketClient(('benchmark', 'benchmark'), base_url=fake.base_url,
+                                 max_workers=args.bitbucket_workers, requests_per_second=args.bitbucket_rps)
+        started_at = time.perf_counter()
+        with quiet(not args.verbose):
+            data = load_bitbucket_data(client=client)
+        seconds = time.perf_counter() - started_at
+    return {"pull_requests": len(records), "records": len(data), "requests": len(fake.requests),
+            "seconds": round(seconds, 3), "pull_requests_per_second": round(len(records) / seconds, 1)}
+
+
+def environment() -> dict:
+    """結果を比較するときに確認する、実行環境の情報。"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def _flatten(value, prefix: str = "") -> dict:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    return {prefix: value} if isinstance(value, (int, float)) else {}
+
+
+def compare(previous: dict, current: dict):
+    """以前の結果と今回の結果の数値を並べ、変化率を表示する。"""
+    before, after = _flatten(previous['results']), _flatten(current['results'])
+    print(f"\nComparison with {previous['environment'].get('commit')} ({previous['environment'].get('timestamp')})")
+    print(f"{'metric':<44}{'before':>12}{'after':>12}{'change':>10}")
+    for key in after:
+        if key not in before:
+            continue
+        change = f"{(after[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else "-"
+        print(f"{key:<44}{before[key]:>12}{after[key]:>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the doc-sage benchmark suite with offline fakes.")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--items', type=int, default=10000, help='コーパスのアイテム数 (1万〜100万を想定)。')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--store', choices=['numpy', 'chroma', 'pgvector'], default='numpy',
+                        help='ベクトルストア。pgvector は PG_DSN の空のデータベースを使う。')
+    parser.add_argument('--lexical', action=argparse.BooleanOptionalAction, default=True,
+                        help='ハイブリッド検索の転置インデックスを使う。')
+    parser.add_argument('--embedding', choices=['hashing', 'bedrock', 'model'], default='hashing',
+                        help='hashing: 文字n-gramのハッシュ、bedrock: フェイクのTitan、model: 設定どおりの実際のモデル。')
+    parser.add_argument('--embedding-ms', type=float, default=0.0, help='1件のベクトル化に模す時間 (ミリ秒)。')
+    parser.add_argument('--queries', type=int, default=200, help='query シナリオの検索回数。')
+    parser.add_argument('--requests', type=int, default=20, help='e2e シナリオのリクエスト数。')
+    parser.add_argument('--llm', choices=['ollama', 'bedrock'], default='ollama',
+                        help='e2e シナリオで呼び出すLLMのフェイク。')
+    parser.add_argument('--llm-first-token-ms', type=float, default=200.0)
+    parser.add_argument('--llm-token-ms', type=float, default=10.0)
+    parser.add_argument('--llm-chunks', type=int, default=20)
+    parser.add_argument('--prs', type=int, default=500, help='harvest シナリオのPR数。')
+    parser.add_argument('--bitbucket-latency-ms', type=float, default=50.0)
+    parser.add_argument('--bitbucket-workers', type=int, default=8)
+    parser.add_argument('--bitbucket-rps', type=float, default=1000.0, help='Bitbucketへのリクエストの上限 (件/秒)。')
+    parser.add_argument('--work-dir', type=str, default=None, help='インデックスを作るディレクトリ。省略時は一時ディレクトリ。')
+    parser.add_argument('--json', type=str, default=None, help='結果をJSONで書き出すパス。')
+    parser.add_argument('--compare', type=str, default=None, help='比較する以前の結果 (JSON)。')
+    parser.add_argument('--verbose', action='store_true', help='測定中の出力を表示する。')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='doc-sage-bench-') as temporary_dir:
+        work_dir = args.work_dir or temporary_dir
+        ollama = configure(args, work_dir)
+        runners = {'import': run_import, 'query': run_query, 'e2e': run_e2e, 'harvest': run_harvest}
+        results = {}
+        try:
+            if {'query', 'e2e'} & set(args.scenarios) and 'import' not in args.scenarios:
+                print("[INFO] Importing the corpus for the query/e2e scenarios (not measured)...")
+                run_import(args)
+            for name in args.scenarios:
+                print(f"[INFO] Running scenario: {name}")
+                results[name] = runners[name](args)
+                print(json.dumps(results[name], ensure_ascii=False, indent=2))
+        finally:
+            with quiet(not args.verbose):
+                resource_manager.shutdown()
+            if ollama is not None:
+                ollama.__exit__(None, None, None)
+
+    report = {"environment": environment(), "args": vars(args), "results": results}
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[INFO] Wrote results to {args.json}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 import os
+import random
+import threading
 import requests
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+import tracing
 
 # --- 設定項目 (環境変数から取得) ---
 BITBUCKET_USERNAME = os.getenv('BITBUCKET_USERNAME')
@@ -10,32 +16,169 @@ BITBUCKET_WORKSPACE = os.getenv('BITBUCKET_WORKSPACE') # 例: 'your-company-work
 BITBUCKET_PROJECT_KEY = os.getenv('BITBUCKET_PROJECT_KEY') # 例: 'PROJ'
 BITBUCKET_REPO_SLUG = os.getenv('BITBUCKET_REPO_SLUG') # 例: 'your-repo-name'
 
-# Bitbucket APIのベースURL
-BITBUCKET_API_BASE_URL = f"https://api.bitbucket.org/2.0/repositories/{BITBUCKET_WORKSPACE}/{BITBUCKET_REPO_SLUG}"
+# Bitbucket APIのベースURL (テスト用のローカルサーバーを使う場合は環境変数で上書きする)
+BITBUCKET_API_BASE_URL = os.getenv(
+    'BITBUCKET_API_BASE_URL',
+    f"https://api.bitbucket.org/2.0/repositories/{BITBUCKET_WORKSPACE}/{BITBUCKET_REPO_SLUG}"
+)
 
-def get_paginated_response(url, auth):
+# PRごとの取得を並列に行うワーカー数
+BITBUCKET_MAX_WORKERS = int(os.getenv('BITBUCKET_MAX_WORKERS', '8'))
+# 1秒あたりの最大リクエスト数 (429を受けた場合は自動的に下げる)
+BITBUCKET_REQUESTS_PER_SECOND = float(os.getenv('BITBUCKET_REQUESTS_PER_SECOND', '10'))
+# 429/5xx/通信エラー時の最大リトライ回数
+BITBUCKET_MAX_RETRIES = int(os.getenv('BITBUCKET_MAX_RETRIES', '5'))
+BITBUCKET_REQUEST_TIMEOUT = 30
+
+# リトライ対象とするHTTPステータス
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    トークンバケット方式のレートリミッタ。複数スレッドで共有する。
+    429を受けた場合はレートを半分に下げ (Retry-Afterの間は全スレッドを停止)、
+    成功が続くと少しずつ元のレートまで戻す。
+
+    Args:
+        rate (float): 1秒あたりの最大リクエスト数。
+        burst (int): 連続して発行できるリクエスト数の上限。
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する。取得できるまで待機する。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_throttled(self, retry_after: float):
+        """429を受けたときに呼ぶ。retry_after秒間すべてのリクエストを止め、レートを下げる。"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = 0.0
+
+    def on_success(self):
+        """成功したときに呼ぶ。下げたレートを少しずつ戻す。"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class BitbucketClient:
+    """
+    Bitbucket APIクライアント。コネクションプール付きのセッションとレートリミッタを全スレッドで共有し、
+    429/5xx/通信エラーは指数バックオフでリトライする (429のRetry-Afterヘッダを優先する)。
+    """
+
+    def __init__(self, auth, base_url: str = None, max_workers: int = None,
+                 requests_per_second: float = None, max_retries: int = None):
+        self.base_url = base_url or BITBUCKET_API_BASE_URL
+        self.max_workers = max_workers or BITBUCKET_MAX_WORKERS
+        self.max_retries = BITBUCKET_MAX_RETRIES if max_retries is None else max_retries
+        self.limiter = RateLimiter(requests_per_second or BITBUCKET_REQUESTS_PER_SECOND)
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url: str, allowed_statuses=()):
+        """
+        GETリクエストを送る。リトライ後も失敗した場合はHTTPErrorを送出する。
+        allowed_statusesに含まれるステータス (404など) はエラーにせずそのまま返す。
+        """
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        with tracing.span('http_fetch', path=path) as span:
+            for attempt in range(self.max_retries + 1):
+                self.limiter.acquire()
+                try:
+                    response = self.session.get(url, timeout=BITBUCKET_REQUEST_TIMEOUT)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self._backoff(attempt)
+                    tracing.warn(f"[WARN] Request failed ({e}). Retrying in {delay:.1f}s: {url}")
+                    time.sleep(delay)
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    delay = self._retry_after(response) if response.status_code == 429 else None
+                    if delay is None:
+                        delay = self._backoff(attempt)
+                    if response.status_code == 429:
+                        self.limiter.on_throttled(delay)
+                        tracing.warn(f"[WARN] Rate limited. Waiting {delay:.1f}s: {url}")
+                    else:
+                        tracing.warn(f"[WARN] HTTP {response.status_code}. Retrying in {delay:.1f}s: {url}")
+                        time.sleep(delay)
+                    continue
+
+                if response.status_code not in allowed_statuses:
+                    response.raise_for_status() # HTTPエラーがあれば例外を発生させる
+                self.limiter.on_success()
+                span.set(status=response.status_code, attempts=attempt + 1, bytes=len(response.content))
+                return response
+        raise RuntimeError("unreachable")
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get('Retry-After')
+        try:
+            return max(0.0, float(value)) if value is not None else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # 指数バックオフ (ジッター付き)
+        return min(30.0, 0.5 * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+    def close(self):
+        self.session.close()
+
+
+def get_paginated_response(url, client: BitbucketClient):
     """
     Bitbucket APIのページネーションを処理し、全データを取得する。
     """
     all_data = []
     while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url, auth=auth)
-        response.raise_for_status() # HTTPエラーがあれば例外を発生させる
-        data = response.json()
+        tracing.debug(f"Fetching: {url}")
+        data = client.get(url).json()
         all_data.extend(data['values'])
         url = data.get('next')
-        if url: # レートリミット回避のため、ページ間に遅延を入れる
-            time.sleep(0.5)
     return all_data
 
-def get_pull_request_comments(pr_id, auth):
+def get_pull_request_comments(pr_id, client: BitbucketClient, cache=None, updated_on: str = None):
     """
     指定されたプルリクエストのコメントを取得する。
+    cacheとPRの更新日時 (updated_on) が指定された場合、同じ更新日時のPRのコメントはキャッシュから返す。
     """
-    comments_url = f"{BITBUCKET_API_BASE_URL}/pullrequests/{pr_id}/comments"
-    comments = get_paginated_response(comments_url, auth)
-    
+    if cache is not None and updated_on:
+        cached = cache.get_comments(pr_id, updated_on)
+        if cached is not None:
+            return cached
+
+    comments_url = f"{client.base_url}/pullrequests/{pr_id}/comments?pagelen=100"
+    comments = get_paginated_response(comments_url, client)
+
     extracted_comments = []
     for comment in comments:
         # コメント本文と、もしあればコメント対象の行情報を抽出
@@ -51,73 +194,123 @@ def get_pull_request_comments(pr_id, auth):
             "comment_text": comment_text,
             "context_line": context_line
         })
+
+    if cache is not None and updated_on:
+        cache.put_comments(pr_id, updated_on, extracted_comments)
     return extracted_comments
 
-def get_file_content_from_pr(pr_id, file_path, auth):
+def get_file_content_from_pr(pr_id, file_path, client: BitbucketClient, source_commit_hash: str, cache=None):
     """
-    プルリクエストのソースブランチから特定のファイルの内容を取得する。
+    プルリクエストのソースコミットから特定のファイルの内容を取得する。
     Bitbucket APIはPRの特定のファイル内容を直接取得するエンドポイントがないため、
-    PRのソースコミットのファイル内容を取得する。
-    """
-    # PRの詳細を取得して、ソースコミットのハッシュを取得
-    pr_detail_url = f"{BITBUCKET_API_BASE_URL}/pullrequests/{pr_id}"
-    response = requests.get(pr_detail_url, auth=auth)
-    response.raise_for_status()
-    pr_data = response.json()
-    source_commit_hash = pr_data['source']['commit']['hash']
-
-    # コミットからファイルの内容を取得
-    file_content_url = f"{BITBUCKET_API_BASE_URL}/src/{source_commit_hash}/{file_path}"
-    response = requests.get(file_content_url, auth=auth)
-    if response.status_code == 200:
-        return response.text
-    elif response.status_code == 404:
-        print(f"[WARN] File {file_path} not found in PR {pr_id} source commit {source_commit_hash}")
+    PR一覧の取得時に得たソースコミットのハッシュを使ってファイル内容を取得する。
+    コミット時点のファイル内容は変わらないため、cacheが指定された場合は (コミット, パス) 単位でキャッシュする。
+    """
+    if cache is not None:
+        found, content = cache.get_file(source_commit_hash, file_path)
+        if found:
+            return content
+
+    file_content_url = f"{client.base_url}/src/{source_commit_hash}/{file_path}"
+    response = client.get(file_content_url, allowed_statuses=(404,))
+    content = None if response.status_code == 404 else response.text
+    if content is None:
+        tracing.warn(f"[WARN] File {file_path} not found in PR {pr_id} source commit {source_commit_hash}")
+    if cache is not None:
+        cache.put_file(source_commit_hash, file_path, content)
+    return content
+
+def harvest_pull_request(pr, client: BitbucketClient, release_note_file, design_file, cache=None):
+    """
+    1件のプルリクエストからリリースノート・仕様書・コメントを取得して整形する。
+    どちらかのファイルが存在しない場合はNoneを返す。
+    """
+    pr_id = pr['id']
+    source_commit_hash = pr['source']['commit']['hash']
+    tracing.debug(f"Processing PR #{pr_id}: {pr['title']}")
+
+    # リリースノートと仕様書の内容を取得
+    release_note_content = get_file_content_from_pr(pr_id, release_note_file, client, source_commit_hash, cache)
+    if not release_note_content:
+        tracing.warn(f"[WARN] Skipping PR #{pr_id} as {release_note_file} not found.")
         return None
-    else:
-        response.raise_for_status()
+    design_content = get_file_content_from_pr(pr_id, design_file, client, source_commit_hash, cache)
+    if not design_content:
+        tracing.warn(f"[WARN] Skipping PR #{pr_id} as {design_file} not found.")
+        return None
+
+    # コメントを取得
+    comments = get_pull_request_comments(pr_id, client, cache, pr.get('updated_on'))
+
+    return {
+        "ticket_id": f"PR-{pr_id}", # PR IDをチケットIDとして利用
+        "final_release_note": release_note_content,
+        "design_document": design_content, # 仕様書も保存
+        "review_comments": comments
+    }
+
+def list_merged_pull_requests(client: BitbucketClient, updated_since: str = None):
+    """
+    マージ済みのプルリクエスト一覧を、更新日時 (updated_on) の昇順で取得する。
+    updated_sinceが指定された場合は、その日時以降に更新されたPRのみを取得する。
+    """
+    # Bitbucket APIはプロジェクトキーでPRをフィルタリングできないため、リポジトリ単位で取得
+    # ソースコミットのハッシュも一覧で取得し、PRごとの詳細取得を省く
+    query = 'state="MERGED"'
+    if updated_since:
+        query += f' AND updated_on >= "{updated_since}"'
+    pull_requests_url = (
+        f"{client.base_url}/pullrequests?state=MERGED&pagelen=50&sort=updated_on&q={quote(query)}"
+        "&fields=next,values.id,values.title,values.updated_on,values.source.commit.hash"
+    )
+    pull_requests = get_paginated_response(pull_requests_url, client)
 
-def load_bitbucket_data(release_note_file='10-release.txt', design_file='20-design.md'):
+    # ページ取得中にPRが更新されると、同じPRが2回現れることがあるため除外する
+    unique = {}
+    for pr in pull_requests:
+        unique[pr['id']] = pr
+    return sorted(unique.values(), key=lambda pr: (pr.get('updated_on') or '', pr['id']))
+
+def load_bitbucket_data(release_note_file='10-release.txt', design_file='20-design.md', client: BitbucketClient = None,
+                        pull_requests=None, cache=None):
     """
     Bitbucketからプルリクエストのデータとコメントを取得し、整形して返す。
+    PRごとの取得はワーカースレッドで並列に行い、結果はPR一覧の順序で返す。
+
+    Args:
+        pull_requests (list): 対象のPR一覧。省略時はマージ済みの全PRを取得する。
+        cache: ファイル内容・コメントのキャッシュ (bitbucket_sync.ResponseCache)。
     """
-    if not all([BITBUCKET_USERNAME, BITBUCKET_APP_PASSWORD, BITBUCKET_WORKSPACE, BITBUCKET_PROJECT_KEY, BITBUCKET_REPO_SLUG]):
-        print("[ERROR] Bitbucket API credentials or repository details are not set as environment variables.")
-        print("Please set BITBUCKET_USERNAME, BITBUCKET_APP_PASSWORD, BITBUCKET_WORKSPACE, BITBUCKET_PROJECT_KEY, BITBUCKET_REPO_SLUG.")
-        return []
+    if client is None:
+        client = create_client_from_env()
+        if client is None:
+            return []
 
-    auth = (BITBUCKET_USERNAME, BITBUCKET_APP_PASSWORD)
-    
-    # プロジェクト内の全プルリクエストを取得
-    # Bitbucket APIはプロジェクトキーでPRをフィルタリングできないため、リポジトリ単位で取得
-    pull_requests_url = f"{BITBUCKET_API_BASE_URL}/pullrequests?state=MERGED&fields=values.id,values.title,values.source.commit.hash"
-    all_pull_requests = get_paginated_response(pull_requests_url, auth)
-
-    processed_data = []
-    for pr in all_pull_requests:
-        pr_id = pr['id']
-        pr_title = pr['title']
-        print(f"Processing PR #{pr_id}: {pr_title}")
-
-        # リリースノートと仕様書の内容を取得
-        release_note_content = get_file_content_from_pr(pr_id, release_note_file, auth)
-        design_content = get_file_content_from_pr(pr_id, design_file, auth)
-
-        if release_note_content and design_content: # 両方のファイルが存在する場合のみ処理
-            # コメントを取得
-            comments = get_pull_request_comments(pr_id, auth)
-
-            processed_data.append({
-                "ticket_id": f"PR-{pr_id}", # PR IDをチケットIDとして利用
-                "final_release_note": release_note_content,
-                "design_document": design_content, # 仕様書も保存
-                "review_comments": comments
-            })
-        else:
-            print(f"[WARN] Skipping PR #{pr_id} as {release_note_file} or {design_file} not found.")
+    with tracing.trace('bitbucket_harvest') as trace:
+        if pull_requests is None:
+            with tracing.span('list_pull_requests'):
+                pull_requests = list_merged_pull_requests(client)
+
+        # ワーカースレッドにも実行中のトレースを引き継ぐ
+        def harvest(pr):
+            with tracing.span('harvest_pull_request', pr_id=pr['id']):
+                return harvest_pull_request(pr, client, release_note_file, design_file, cache)
+
+        with ThreadPoolExecutor(max_workers=client.max_workers) as executor:
+            results = executor.map(tracing.bind(harvest), pull_requests)
+            processed_data = [result for result in results if result is not None]
+        trace.set(pull_requests=len(pull_requests), harvested=len(processed_data))
 
     return processed_data
 
+def create_client_from_env():
+    """環境変数の認証情報からクライアントを作る。設定が不足している場合はNoneを返す。"""
+    if not all([BITBUCKET_USERNAME, BITBUCKET_APP_PASSWORD, BITBUCKET_WORKSPACE, BITBUCKET_PROJECT_KEY, BITBUCKET_REPO_SLUG]):
+        tracing.error("[ERROR] Bitbucket API credentials or repository details are not set as environment variables.")
+        tracing.error("Please set BITBUCKET_USERNAME, BITBUCKET_APP_PASSWORD, BITBUCKET_WORKSPACE, BITBUCKET_PROJECT_KEY, BITBUCKET_REPO_SLUG.")
+        return None
+    return BitbucketClient((BITBUCKET_USERNAME, BITBUCKET_APP_PASSWORD))
+
 if __name__ == '__main__':
     # 環境変数を設定して実行してください
     # export BITBUCKET_USERNAME="your_username"
@@ -0,0 +1,178 @@
+"""
+Bitbucketからの差分同期。
+
+前回の同期で処理したPRの更新日時 (updated_on) とIDをカーソルとしてファイルに保存し、
+次回はそれ以降に更新されたPRだけを取得する。ファイル内容 (コミット+パス単位。内容は変わらない) と
+コメント (PR+更新日時単位) はディスクにキャッシュし、取得したデータはそのまま db_importer に渡す。
+"""
+import argparse
+import hashlib
+import json
+import os
+import bitbucket_data_loader
+import tracing
+
+SYNC_CACHE_DIR = os.getenv('BITBUCKET_SYNC_CACHE_DIR', './bitbucket_cache')
+
+
+def _key(*parts) -> str:
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _write_atomic(path: str, text: str):
+    """書き込み途中で中断されても壊れたファイルが残らないよう、一時ファイル経由で書き込む。"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """
+    Bitbucket APIの応答のディスクキャッシュ。
+
+    - ファイル内容: (コミットハッシュ, パス) がキー。コミット時点の内容は変わらないため期限はない。
+      ファイルが存在しなかった (404) ことも記録する。
+    - コメント: (PR ID, PRの更新日時) がキー。PRが更新されると別のキーになるため、再取得される。
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or SYNC_CACHE_DIR
+        self.files_dir = os.path.join(self.cache_dir, 'files')
+        self.comments_dir = os.path.join(self.cache_dir, 'comments')
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.comments_dir, exist_ok=True)
+
+    def get_file(self, commit_hash: str, file_path: str):
+        """
+        Returns:
+            tuple: (キャッシュにあったか, ファイル内容。存在しないファイルの場合はNone)
+        """
+        path = os.path.join(self.files_dir, _key(commit_hash, file_path) + '.json')
+        if not os.path.exists(path):
+            return False, None
+        with open(path, 'r', encoding='utf-8') as f:
+            return True, json.load(f)['content']
+
+    def put_file(self, commit_hash: str, file_path: str, content):
+        path = os.path.join(self.files_dir, _key(commit_hash, file_path) + '.json')
+        _write_atomic(path, json.dumps({"content": content}, ensure_ascii=False))
+
+    def get_comments(self, pr_id, updated_on: str):
+        path = os.path.join(self.comments_dir, f"{pr_id}_{_key(updated_on)[:16]}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def put_comments(self, pr_id, updated_on: str, comments: list):
+        path = os.path.join(self.comments_dir, f"{pr_id}_{_key(updated_on)[:16]}.json")
+        _write_atomic(path, json.dumps(comments, ensure_ascii=False))
+
+
+class SyncState:
+    """
+    差分同期のカーソル (処理済みの最新PRの updated_on と id) をファイルに保存する。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(SYNC_CACHE_DIR, 'sync_state.json')
+        self.updated_on = None
+        self.pr_id = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.updated_on = state.get('updated_on')
+            self.pr_id = state.get('pr_id')
+
+    def is_new(self, pr: dict) -> bool:
+        """PRがカーソルより後に更新されたものかどうか。"""
+        if self.updated_on is None:
+            return True
+        return (pr.get('updated_on') or '', pr['id']) > (self.updated_on, self.pr_id or 0)
+
+    def advance(self, pull_requests: list):
+        """処理したPRのうち最新のものまでカーソルを進める。"""
+        for pr in pull_requests:
+            if self.is_new(pr) and pr.get('updated_on'):
+                self.updated_on = pr['updated_on']
+                self.pr_id = pr['id']
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _write_atomic(self.path, json.dumps({"updated_on": self.updated_on, "pr_id": self.pr_id}))
+
+
+def sync(client, state: SyncState, cache: ResponseCache, release_note_file='10-release.txt',
+         design_file='20-design.md', on_records=None) -> list:
+    """
+    前回の同期以降に更新されたPRだけを取得する。
+
+    Args:
+        client (BitbucketClient): Bitbucket APIクライアント。
+        state (SyncState): カーソル。取得・on_recordsの処理が成功した場合のみ進めて保存する。
+        cache (ResponseCache): ファイル内容・コメントのキャッシュ。
+        on_records (callable): 取得したレコードのリストを受け取る関数 (DBへの取り込みなど)。
+
+    Returns:
+        list: 取得したレコードのリスト。
+    """
+    # 取得と取り込み (on_records) を1つのトレースに記録する
+    with tracing.trace('bitbucket_sync') as trace:
+        # カーソルと同じ日時のPRも取りこぼさないよう ">=" で取得し、処理済みのものはここで除く
+        with tracing.span('list_pull_requests'):
+            pull_requests = [
+                pr for pr in bitbucket_data_loader.list_merged_pull_requests(client, updated_since=state.updated_on)
+                if state.is_new(pr)
+            ]
+        tracing.info(f"[INFO] {len(pull_requests)} pull requests updated since {state.updated_on or 'the beginning'}.")
+        records = bitbucket_data_loader.load_bitbucket_data(
+            release_note_file, design_file, client=client, pull_requests=pull_requests, cache=cache
+        )
+        if records and on_records is not None:
+            on_records(records)
+        trace.set(pull_requests=len(pull_requests), records=len(records))
+    state.advance(pull_requests)
+    state.save()
+    return records
+
+
+def import_records(records: list):
+    """取得したレコードを差分モードでDBに取り込む。全件ではないため、他のチケットは削除しない。"""
+    import db_importer
+    import resource_manager
+    stats = db_importer.import_documents(
+        records,
+        resource_manager.get_vector_store(create=True),
+        resource_manager.get_embedding_model(),
+        incremental=True,
+        prune=False,
+        comment_store=resource_manager.get_review_comment_store(create=True)
+    )
+    tracing.info(f"[INFO] Upserted: {stats['upserted']}, Unchanged: {stats['unchanged']}, Deleted: {stats['deleted']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Incrementally sync merged pull requests from Bitbucket.")
+    parser.add_argument('--full', action='store_true', help='カーソルを無視して全PRを取得し直します。')
+    parser.add_argument('--no-import', action='store_true', help='DBへの取り込みを行わず、JSONLファイルに出力します。')
+    parser.add_argument('--output', type=str, default='bitbucket_data.jsonl', help='--no-import 時の出力先。')
+    args = parser.parse_args()
+
+    client = bitbucket_data_loader.create_client_from_env()
+    if client is not None:
+        state = SyncState()
+        if args.full:
+            state.updated_on = state.pr_id = None
+
+        def write_records(records):
+            with open(args.output, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            print(f"[INFO] Appended {len(records)} records to {args.output}")
+
+        records = sync(client, state, ResponseCache(),
+                       on_records=write_records if args.no_import else import_records)
+        print(f"[SUCCESS] Synced {len(records)} pull requests.")
@@ -63,7 +63,7 @@ class CdkInfraStack(Stack):
         )
         # Bedrockへのアクセス権限を追加
         lambda_role.add_to_policy(iam.PolicyStatement(
-            actions=["bedrock:InvokeModel", "bedrock:ListFoundationModels"],
+            actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream", "bedrock:ListFoundationModels"],
             resources=["*"] # 特定のモデルに絞ることも可能
         ))
         # RDSの認証情報へのアクセス権限を追加
@@ -76,7 +76,7 @@ class CdkInfraStack(Stack):
         # コードは後で配置する 'lambda_code' ディレクトリから読み込む
         release_note_lambda = lambda_.Function(self, "ReleaseNoteGenerator",
             runtime=lambda_.Runtime.PYTHON_3_12,
-            handler="main_logic.generate_release_note_draft", # main_logic.pyの関数名
+            handler="main_logic.lambda_handler", # main_logic.pyの関数名 (/generate と /review を処理する)
             code=lambda_.Code.from_asset("../lambda_code"), # プロジェクトルートからの相対パス
             memory_size=512,
             timeout=Duration.seconds(60),
@@ -88,7 +88,7 @@ class CdkInfraStack(Stack):
                 "ENV": "aws",
                 "DB_SECRET_ARN": db_instance.secret.secret_arn,
                 "AWS_BEDROCK_EMBEDDING_MODEL_ID": "amazon.titan-embed-text-v1",
-                "AWS_BEDROCK_LLM_MODEL_ID": "anthropic.claude-3-sonnet-20240229-v1_0",
+                "AWS_BEDROCK_LLM_MODEL_ID": "anthropic.claude-3-sonnet-20240229-v1:0",
             }
         )
 
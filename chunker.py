@@ -0,0 +1,119 @@
+"""
+長い仕様書・リリースノートを、見出しの構造を保ったままEmbedding用のチャンクに分割する。
+
+Embeddingモデルには入力長の上限があり (all-MiniLM-L6-v2 は256トークン)、
+それを超えた部分は黙って切り捨てられる。長い文書は見出し単位 (Markdownの「#」、リリースノートの「■」と
+「【...】」の項目) で区切り、上限を超える節は段落・行・文の境界でさらに分割する。
+各チャンクの先頭には、属する見出しの階層を付ける (例: "# 概要 > ## 認証")。
+"""
+import re
+import config
+
+_MARKDOWN_HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+_NOTE_CATEGORY = re.compile(r'^■\s*\S')
+_NOTE_FIELD = re.compile(r'^【[^】]+】')
+_SENTENCE_END = re.compile(r'(?<=[。！？!?])')
+
+
+def _split_sections(text: str) -> list:
+    """
+    テキストを見出し単位の節に分ける。
+
+    Returns:
+        list: (見出しの階層を表す文字列, 本文) のリスト。
+    """
+    sections = []
+    headings = []  # (レベル, 見出し行)
+    body = []
+
+    def close_section():
+        content = "\n".join(body).strip()
+        if content:
+            sections.append((" > ".join(line for _, line in headings), content))
+        body.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        match = _MARKDOWN_HEADING.match(stripped)
+        if match:
+            close_section()
+            level = len(match.group(1))
+            headings[:] = [heading for heading in headings if heading[0] < level]
+            headings.append((level, stripped))
+        elif _NOTE_CATEGORY.match(stripped):
+            # リリースノートの「■ 機能系」などは、最上位の見出しとして扱う
+            close_section()
+            headings[:] = [(0, stripped)]
+        elif _NOTE_FIELD.match(stripped):
+            # 「【機能概要】...」などの項目は、項目名を含めて新しい節にする
+            close_section()
+            body.append(line)
+        else:
+            body.append(line)
+    close_section()
+    return sections
+
+
+def _split_long(text: str, limit: int) -> list:
+    """limit文字を超えるテキストを、段落・行・文の境界の順に区切って limit 文字以下の断片に詰め直す。"""
+    if len(text) <= limit:
+        return [text]
+    for separator in ("\n\n", "\n", None):
+        pieces = _SENTENCE_END.split(text) if separator is None else text.split(separator)
+        pieces = [piece for piece in pieces if piece.strip()]
+        if len(pieces) > 1:
+            break
+    else:
+        # 区切りがない場合は文字数で切る
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+
+    joiner = separator or ""
+    chunks = []
+    current = ""
+    for piece in pieces:
+        for part in _split_long(piece.strip() if separator else piece, limit):
+            candidate = f"{current}{joiner}{part}" if current else part
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_text(text: str, max_chars: int = None) -> list:
+    """
+    テキストを見出しを考慮したチャンクのリストに分割する。
+    max_chars 以下のテキストは分割せず、そのまま1つのチャンクとして返す
+    (短い文書のEmbedding・キャッシュキー・格納時のidは分割前と変わらない)。
+
+    Args:
+        text (str): 仕様書 (Markdown) またはリリースノート。
+        max_chars (int): 1チャンクの最大文字数。省略時は config.CHUNK_MAX_CHARS。
+    """
+    max_chars = max_chars or config.CHUNK_MAX_CHARS
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    pending_heading, pending_prefix, pending = None, "", ""
+    for heading, content in _split_sections(text):
+        prefix = f"{heading}\n" if heading else ""
+        # 同じ見出しの下の短い節 (【】の項目など) は、上限まで1つのチャンクにまとめる
+        if pending and heading == pending_heading and len(prefix) + len(pending) + 1 + len(content) <= max_chars:
+            pending = f"{pending}\n{content}"
+            continue
+        if pending:
+            chunks.append(f"{pending_prefix}{pending}")
+        # 長い項目を分割した場合、続きの断片にも項目名 (【...】) を付ける
+        field = _NOTE_FIELD.match(content)
+        label = field.group(0) if field else ""
+        pieces = _split_long(content, max(max_chars - len(prefix) - len(label), max_chars // 2))
+        pieces = pieces[:1] + [f"{label}{piece}" for piece in pieces[1:]]
+        chunks.extend(f"{prefix}{piece}" for piece in pieces[:-1])
+        pending_heading, pending_prefix, pending = heading, prefix, pieces[-1]
+    if pending:
+        chunks.append(f"{pending_prefix}{pending}")
+    return chunks or [text]
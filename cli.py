@@ -1,5 +1,137 @@
 import argparse
-from main_logic import generate_release_note_draft, review_release_note
+import glob
+import json
+import os
+import re
+import time
+from collections import Counter
+import config
+
+# batch コマンドでディレクトリを指定した場合に対象とするファイルの拡張子
+BATCH_FILE_EXTENSIONS = ('.md', '.txt')
+
+def print_stream(stream):
+    """LLMの出力をチャンクが届くたびに表示する。"""
+    for chunk in stream:
+        print(chunk, end='', flush=True)
+    print()
+
+def open_stream(kind: str, text: str, args):
+    """
+    generate / review の出力のストリームを返す。デーモンを使う設定の場合はデーモンに処理を依頼し、
+    デーモンを使えない場合はこのプロセス内で処理する。
+    """
+    use_daemon = config.DAEMON_ENABLED if args.daemon is None else args.daemon
+    if use_daemon:
+        import cli_daemon
+        stream = cli_daemon.request_stream(kind, text, use_cache=not args.no_cache)
+        if stream is not None:
+            return stream
+    if kind == 'generate':
+        from main_logic import generate_release_note_draft_stream
+        return generate_release_note_draft_stream(text, use_cache=not args.no_cache)
+    from main_logic import review_release_note_stream
+    return review_release_note_stream(text, use_cache=not args.no_cache)
+
+def resolve_batch_inputs(input_spec: str) -> list:
+    """
+    batch コマンドの入力を (名前, テキスト) のリストに解決する。
+    - ディレクトリ: 直下の .md/.txt ファイル
+    - .jsonl ファイル: 1行1件のマニフェスト。{"file": パス} または {"id": 名前, "text": テキスト}
+    - それ以外: globパターン
+    """
+    if os.path.isdir(input_spec):
+        paths = sorted(
+            os.path.join(input_spec, name) for name in os.listdir(input_spec)
+            if name.endswith(BATCH_FILE_EXTENSIONS)
+        )
+    elif input_spec.endswith('.jsonl'):
+        inputs = []
+        base_dir = os.path.dirname(input_spec)
+        with open(input_spec, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'text' in entry:
+                    inputs.append((entry.get('id') or f"item-{len(inputs) + 1}", entry['text']))
+                else:
+                    path = os.path.join(base_dir, entry['file'])
+                    with open(path, 'r', encoding='utf-8') as doc:
+                        inputs.append((entry.get('id') or path, doc.read()))
+        return inputs
+    else:
+        paths = sorted(glob.glob(input_spec))
+
+    inputs = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            inputs.append((path, f.read()))
+    return inputs
+
+def _path_parts(name: str) -> list:
+    """パスまたはマニフェストのidを、拡張子を除いたディレクトリ・ファイル名の要素に分ける。"""
+    return [part for part in re.split(r'[\\/]+', os.path.splitext(name)[0]) if part not in ('', '.', '..')]
+
+def batch_output_names(names: list, kind: str) -> list:
+    """
+    batch コマンドの入力の名前 (パスまたはid) から、互いに重ならない出力ファイル名を作る。
+    通常は "{ファイル名}.{kind}.md" とし、ファイル名が他の入力と重なる場合は、共通の親ディレクトリより下の
+    パスを '_' でつないだ名前にする (docs/a/spec.md と docs/b/spec.md -> a_spec, b_spec)。
+    それでも重なる場合は入力の番号を付ける。
+    """
+    parts = [_path_parts(name) or [f"item-{i + 1}"] for i, name in enumerate(names)]
+    counts = Counter(part[-1] for part in parts)
+    duplicated = [part for part in parts if counts[part[-1]] > 1]
+    common = 0
+    while duplicated and all(len(part) > common + 1 and part[common] == duplicated[0][common] for part in duplicated):
+        common += 1
+
+    output_names = []
+    for i, part in enumerate(parts):
+        stem = "_".join(part[common:]) if counts[part[-1]] > 1 else part[-1]
+        output_name = f"{stem}.{kind}.md"
+        if output_name in output_names:
+            output_name = f"{stem}-{i + 1}.{kind}.md"
+        output_names.append(output_name)
+    return output_names
+
+def run_batch_command(args):
+    """batch コマンドを実行し、ファイルごとの出力とJSONLのレポートを書き出す。"""
+    from main_logic import run_batch
+    inputs = resolve_batch_inputs(args.input)
+    if not inputs:
+        print(f"エラー: 入力が見つかりません: {args.input}")
+        return
+
+    print(f"{len(inputs)}件の入力を読み込み、一括処理 ({args.kind}) を開始します...")
+    started_at = time.perf_counter()
+    results = run_batch(args.kind, [text for _, text in inputs],
+                        max_workers=args.concurrency, use_cache=not args.no_cache)
+    elapsed = time.perf_counter() - started_at
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+    output_names = batch_output_names([name for name, _ in inputs], args.kind)
+    try:
+        for (name, _), output_name, result in zip(inputs, output_names, results):
+            output_file = None
+            if args.output_dir and result['output'] is not None:
+                output_file = os.path.join(args.output_dir, output_name)
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    f.write(result['output'])
+            if report:
+                report.write(json.dumps({"input": name, "output_file": output_file, **result}, ensure_ascii=False) + "\n")
+            elif not args.output_dir:
+                print(f"\n--- {name} ---")
+                print(result['output'] if result['output'] is not None else result['error'])
+    finally:
+        if report:
+            report.close()
+
+    failed = sum(1 for result in results if result['error'] is not None)
+    print(f"{len(results)}件を{elapsed:.1f}秒で処理しました (失敗: {failed}件)。")
 
 def main():
     """
@@ -21,6 +153,17 @@ def main():
         required=True, 
         help='インプットとなる仕様書ファイルのパス。'
     )
+    parser_generate.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='LLMの応答キャッシュを使わずに、必ずLLMを呼び出します。'
+    )
+    parser_generate.add_argument(
+        '--daemon',
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help='モデルを読み込んだまま常駐するデーモンで処理します (未起動の場合は起動します)。省略時は DAEMON_ENABLED。'
+    )
 
     # 'review' コマンドのパーサー
     parser_review = subparsers.add_parser(
@@ -33,8 +176,121 @@ def main():
         required=True, 
         help='レビュー対象となるリリースノートファイルのパス。'
     )
+    parser_review.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='LLMの応答キャッシュを使わずに、必ずLLMを呼び出します。'
+    )
+    parser_review.add_argument(
+        '--daemon',
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help='モデルを読み込んだまま常駐するデーモンで処理します (未起動の場合は起動します)。省略時は DAEMON_ENABLED。'
+    )
+
+    # 'generate-review' コマンドのパーサー
+    parser_pipeline = subparsers.add_parser(
+        'generate-review',
+        help='仕様書ファイルからリリースノートの雛形を生成し、続けてその雛形をAIレビューします。'
+    )
+    parser_pipeline.add_argument(
+        '--file',
+        type=str,
+        required=True,
+        help='インプットとなる仕様書ファイルのパス。'
+    )
+    parser_pipeline.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='LLMの応答キャッシュを使わずに、必ずLLMを呼び出します。'
+    )
+
+    # 'batch' コマンドのパーサー
+    parser_batch = subparsers.add_parser(
+        'batch',
+        help='複数の仕様書・リリースノートをまとめて処理します。'
+    )
+    parser_batch.add_argument(
+        'kind',
+        choices=['generate', 'review'],
+        help='実行する処理。'
+    )
+    parser_batch.add_argument(
+        '--input',
+        type=str,
+        required=True,
+        help='入力のディレクトリ、globパターン、またはJSONLマニフェストのパス。'
+    )
+    parser_batch.add_argument(
+        '--output-dir',
+        type=str,
+        help='結果をファイルごとに書き出すディレクトリ。'
+    )
+    parser_batch.add_argument(
+        '--report',
+        type=str,
+        help='結果と所要時間を1行1件で書き出すJSONLファイルのパス。'
+    )
+    parser_batch.add_argument(
+        '--concurrency',
+        type=int,
+        default=None,
+        help='LLMを並行して呼び出す最大数。'
+    )
+    parser_batch.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='LLMの応答キャッシュを使わずに、必ずLLMを呼び出します。'
+    )
+
+    # 'serve' コマンドのパーサー
+    parser_serve = subparsers.add_parser(
+        'serve',
+        help='モデルとインデックスを読み込んだまま、HTTPサーバー (/generate, /review) として常駐します。'
+    )
+    parser_serve.add_argument(
+        '--host',
+        type=str,
+        default=None,
+        help='待ち受けるホスト。省略時は SERVER_HOST (127.0.0.1)。'
+    )
+    parser_serve.add_argument(
+        '--port',
+        type=int,
+        default=None,
+        help='待ち受けるポート。省略時は SERVER_PORT (8080)。'
+    )
+    parser_serve.add_argument(
+        '--llm-concurrency',
+        type=int,
+        default=None,
+        help='LLMを同時に呼び出す最大数。'
+    )
+    parser_serve.add_argument(
+        '--max-queue',
+        type=int,
+        default=None,
+        help='LLMの順番待ちを許す最大のリクエスト数。超えた場合は503を返します。'
+    )
+    parser_serve.add_argument(
+        '--stub-llm',
+        action='store_true',
+        help='LLMを呼び出さず、固定の応答を返すスタブを使います (動作確認・負荷試験用)。'
+    )
+
+    # 'daemon' コマンドのパーサー
+    parser_daemon = subparsers.add_parser(
+        'daemon',
+        help='generate / review を処理する常駐デーモンを操作します。'
+    )
+    parser_daemon.add_argument(
+        'action',
+        choices=['status', 'stop', 'run'],
+        help='status: 状態を表示、stop: 停止、run: このプロセスでデーモンを起動 (フォアグラウンド)。'
+    )
 
     args = parser.parse_args()
+    # main_logic (とモデル・ストアの読み込み) は、引数の解析が済んでから読み込む (--help などを速く返すため)
 
     if args.command == 'generate':
         try:
@@ -42,11 +298,13 @@ def main():
                 design_document = f.read()
             
             print(f"'{args.file}' を読み込み、リリースノートの生成を開始します...")
-            draft = generate_release_note_draft(design_document)
-            
+            draft_stream = open_stream('generate', design_document, args)
+
+            # 生成されたテキストを届いた順に表示する
             print("\n--- 生成されたリリースノートの雛形 ---")
-            print(draft)
+            print_stream(draft_stream)
             print("-------------------------------------")
+            print(draft_stream.timing_summary())
 
         except FileNotFoundError:
             print(f"エラー: ファイルが見つかりません: {args.file}")
@@ -59,16 +317,64 @@ def main():
                 edited_release_note = f.read()
             
             print(f"'{args.file}' を読み込み、AIレビューを開始します...")
-            review_result = review_release_note(edited_release_note)
-            
+            review_stream = open_stream('review', edited_release_note, args)
+
             print("\n--- AIレビュー結果 ---")
-            print(review_result)
+            print_stream(review_stream)
             print("----------------------")
+            print(review_stream.timing_summary())
+
+        except FileNotFoundError:
+            print(f"エラー: ファイルが見つかりません: {args.file}")
+        except Exception as e:
+            print(f"予期せぬエラーが発生しました: {e}")
+
+    elif args.command == 'generate-review':
+        try:
+            with open(args.file, 'r', encoding='utf-8') as f:
+                design_document = f.read()
+
+            print(f"'{args.file}' を読み込み、リリースノートの生成とAIレビューを開始します...")
+            from main_logic import generate_then_review_stream
+            titles = {'generate': "生成されたリリースノートの雛形", 'review': "雛形のAIレビュー結果"}
+            for kind, stream in generate_then_review_stream(design_document, use_cache=not args.no_cache):
+                print(f"\n--- {titles[kind]} ---")
+                print_stream(stream)
+                print("-------------------------------------")
+                print(stream.timing_summary())
 
         except FileNotFoundError:
             print(f"エラー: ファイルが見つかりません: {args.file}")
         except Exception as e:
             print(f"予期せぬエラーが発生しました: {e}")
 
+    elif args.command == 'batch':
+        try:
+            run_batch_command(args)
+        except FileNotFoundError as e:
+            print(f"エラー: ファイルが見つかりません: {e.filename}")
+        except Exception as e:
+            print(f"予期せぬエラーが発生しました: {e}")
+
+    elif args.command == 'serve':
+        from server import run_server
+        if args.stub_llm:
+            config.LLM_STUB = True
+        try:
+            run_server(args.host, args.port, args.llm_concurrency, args.max_queue)
+        except Exception as e:
+            print(f"予期せぬエラーが発生しました: {e}")
+
+    elif args.command == 'daemon':
+        import cli_daemon
+        if args.action == 'run':
+            cli_daemon.run_daemon()
+            return
+        response = cli_daemon.send_command(args.action)
+        if response is None:
+            print("デーモンは起動していません。")
+        else:
+            print(json.dumps(response, ensure_ascii=False, indent=2))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,381 @@
+"""
+CLI (cli.py generate / review) のリクエストを、モデルとインデックスを読み込んだまま常駐するプロセスで処理するデーモン。
+
+DAEMON_ENABLED=true (または --daemon) の場合、最初のCLIの呼び出しがバックグラウンドでデーモンを起動し、
+以降の呼び出しはUnixドメインソケット (DAEMON_SOCKET_PATH) 経由でリクエストを送って、LLMの出力を
+届いた順に受け取る。Embeddingモデルの読み込みやベクトルストアの接続は、デーモンの起動時に一度だけ行われる。
+
+- ソースコード (*.py) ・設定 (config の値)・作業ディレクトリから求めたフィンガープリントが一致しない
+  デーモンは使わず、停止させて起動し直す (古いコード・設定のデーモンが使われないように)。
+- 最後のリクエストから DAEMON_IDLE_TIMEOUT_SECONDS 秒経つと自動で終了する。
+- デーモンを使えない場合 (起動に失敗した、Unixドメインソケットに対応していない環境など) は、
+  request_stream が None を返し、呼び出し元はプロセス内で処理する。
+
+通信は1行1メッセージのJSON。
+    リクエスト: {"command": "generate" | "review" | "status" | "stop", "fingerprint": ..., "text": ..., "use_cache": ...}
+    応答: {"accepted": true} の後、{"chunk": ...} を繰り返し、最後に {"done": true, "summary": ...}
+          または {"error": ...}。フィンガープリントが一致しない場合は {"stale": true}。
+"""
+import glob
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import config
+
+# 通信の形式を変更した場合は値を変えて、古いデーモンが使われないようにする
+PROTOCOL_VERSION = 1
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+_STREAM_COMMANDS = ('generate', 'review')
+
+
+def is_supported() -> bool:
+    """Unixドメインソケットを使えるかどうか。"""
+    return hasattr(socket, 'AF_UNIX')
+
+
+def fingerprint() -> str:
+    """ソースコード・設定・作業ディレクトリから、デーモンを使い回してよいかを判定するための値を求める。"""
+    digest = hashlib.sha256(f"{PROTOCOL_VERSION}|{sys.version}|{os.getcwd()}".encode('utf-8'))
+    for path in sorted(glob.glob(os.path.join(_REPO_DIR, '*.py'))):
+        stat = os.stat(path)
+        digest.update(f"|{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size}".encode('utf-8'))
+    settings = sorted((name, repr(getattr(config, name))) for name in dir(config) if name.isupper())
+    digest.update(repr(settings).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _send(wfile, message: dict):
+    wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+    wfile.flush()
+
+
+# --- デーモン側 ---
+
+class WarmDaemon:
+    """
+    Unixドメインソケットでリクエストを待ち受け、接続ごとにスレッドで処理するデーモン。
+
+    Args:
+        socket_path (str): 待ち受けるソケットのパス。省略時は config.DAEMON_SOCKET_PATH。
+        idle_timeout (float): 最後のリクエストから、自動で終了するまでの秒数。0の場合は終了しない。
+    """
+
+    def __init__(self, socket_path: str = None, idle_timeout: float = None):
+        self.socket_path = socket_path or config.DAEMON_SOCKET_PATH
+        self.idle_timeout = config.DAEMON_IDLE_TIMEOUT_SECONDS if idle_timeout is None else idle_timeout
+        self.fingerprint = fingerprint()
+        self.started_at = time.time()
+        self.requests = 0
+        self._active = 0
+        self._last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+
+    def bind(self) -> bool:
+        """ソケットを作成する。同じパスで別のデーモンが動いている場合はFalseを返す。"""
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            connection = _connect(self.socket_path)
+            if connection is not None:
+                connection.close()
+                return False
+            os.unlink(self.socket_path)  # 異常終了したデーモンが残したソケット
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self._server.listen()
+        self._server.settimeout(0.5)
+        return True
+
+    def serve(self):
+        """stop() が呼ばれるか、アイドル時間が上限に達するまでリクエストを処理する。"""
+        print(f"[INFO] Daemon listening on {self.socket_path} (pid: {os.getpid()}, fingerprint: {self.fingerprint})")
+        try:
+            while not self._stopped.is_set():
+                try:
+                    connection, _ = self._server.accept()
+                except socket.timeout:
+                    if self._is_idle():
+                        print(f"[INFO] Daemon has been idle for {self.idle_timeout:.0f}s. Shutting down.")
+                        break
+                    continue
+                except OSError:
+                    break  # stop() でソケットが閉じられた
+                with self._lock:
+                    self._active += 1
+                    self._last_activity = time.monotonic()
+                threading.Thread(target=self._handle_connection, args=(connection,), daemon=True).start()
+        finally:
+            self.stop()
+            # 処理中のリクエストが終わるまで待つ
+            while self._active_count():
+                time.sleep(0.05)
+
+    def stop(self):
+        """新しい接続の受け付けを止め、ソケットを削除する (処理中のリクエストはそのまま完了する)。"""
+        with self._lock:
+            if self._stopped.is_set():
+                return
+            self._stopped.set()
+        if self._server is not None:
+            self._server.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    def _active_count(self) -> int:
+        with self._lock:
+            return self._active
+
+    def _is_idle(self) -> bool:
+        with self._lock:
+            return (self.idle_timeout > 0 and self._active == 0
+                    and time.monotonic() - self._last_activity >= self.idle_timeout)
+
+    def _handle_connection(self, connection):
+        try:
+            with connection, connection.makefile('rb') as rfile, connection.makefile('wb') as wfile:
+                line = rfile.readline()
+                if line:
+                    self._handle_request(json.loads(line), wfile)
+        except (ConnectionError, ValueError) as e:
+            print(f"[WARN] Daemon connection failed: {e}")
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_activity = time.monotonic()
+
+    def _handle_request(self, request: dict, wfile):
+        command = request.get('command')
+        if command == 'status':
+            _send(wfile, self.status(request.get('fingerprint')))
+            return
+        if command == 'stop':
+            _send(wfile, {"stopped": True})
+            self.stop()
+            return
+        if command not in _STREAM_COMMANDS:
+            _send(wfile, {"error": f"Unknown command: {command}"})
+            return
+        if request.get('fingerprint') != self.fingerprint:
+            # コードまたは設定が変わったため、このデーモンは使わせずに終了する
+            print("[INFO] Fingerprint mismatch (code or config changed). Shutting down the stale daemon.")
+            self.stop()
+            _send(wfile, {"stale": True})
+            return
+
+        import main_logic
+        with self._lock:
+            self.requests += 1
+        _send(wfile, {"accepted": True})
+        try:
+            use_cache = request.get('use_cache', True) is not False
+            if command == 'generate':
+                stream = main_logic.generate_release_note_draft_stream(request['text'], use_cache=use_cache)
+            else:
+                stream = main_logic.review_release_note_stream(request['text'], use_cache=use_cache)
+            for chunk in stream:
+                _send(wfile, {"chunk": chunk})
+            _send(wfile, {"done": True, "summary": stream.timing_summary()})
+        except (ConnectionError, BrokenPipeError):
+            print(f"[WARN] Client disconnected during {command} request.")
+        except Exception as e:
+            print(f"[ERROR] Failed to process {command} request: {e}")
+            _send(wfile, {"error": str(e)})
+
+    def status(self, client_fingerprint: str = None) -> dict:
+        """status コマンドで返す情報。"""
+        with self._lock:
+            active = self._active - 1  # status の接続自身を除く
+        return {
+            "pid": os.getpid(),
+            "fingerprint": self.fingerprint,
+            "stale": client_fingerprint is not None and client_fingerprint != self.fingerprint,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "active_requests": active,
+            "idle_timeout_seconds": self.idle_timeout,
+        }
+
+
+def run_daemon(socket_path: str = None, idle_timeout: float = None):
+    """デーモンを起動し、リソースを事前にロードして、終了するまでリクエストを処理する。"""
+    import resource_manager
+    daemon = WarmDaemon(socket_path, idle_timeout)
+    if not daemon.bind():
+        print(f"[INFO] Another daemon is already listening on {daemon.socket_path}.")
+        return
+
+    def warmup():
+        try:
+            resource_manager.warmup()
+        except Exception as e:
+            print(f"[WARN] Failed to warm up resources: {e}")
+
+    # ソケットを先に作成し、モデルのロード中に届いたリクエストはロードの完了を待って処理する
+    threading.Thread(target=warmup, daemon=True).start()
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        resource_manager.shutdown()
+        print("[INFO] Daemon stopped.")
+
+
+# --- クライアント側 ---
+
+def _connect(socket_path: str, timeout: float = None):
+    """ソケットに接続する。デーモンが動いていない場合はNoneを返す。"""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def _spawn(socket_path: str):
+    """デーモンをバックグラウンドのプロセスとして起動する。出力は DAEMON_LOG_PATH に書き出す。"""
+    log_directory = os.path.dirname(config.DAEMON_LOG_PATH)
+    if log_directory:
+        os.makedirs(log_directory, exist_ok=True)
+    print(f"[INFO] Starting daemon (log: {config.DAEMON_LOG_PATH})")
+    with open(config.DAEMON_LOG_PATH, 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--socket', socket_path],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+            env={**os.environ, 'PYTHONUNBUFFERED': '1'},
+        )
+
+
+def _wait_for_daemon(socket_path: str, timeout: float):
+    """デーモンがソケットで待ち受けを始めるまで待つ。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        connection = _connect(socket_path)
+        if connection is not None:
+            return connection
+        time.sleep(0.05)
+    return None
+
+
+class DaemonStream:
+    """デーモンから届くLLMの出力を順に返すイテレータ (main_logic.TokenStream と同じように使える)。"""
+
+    def __init__(self, connection, rfile):
+        self._connection = connection
+        self._rfile = rfile
+        self._summary = None
+
+    def __iter__(self):
+        try:
+            for line in self._rfile:
+                message = json.loads(line)
+                if 'chunk' in message:
+                    yield message['chunk']
+                elif message.get('done'):
+                    self._summary = message.get('summary')
+                    return
+                elif 'error' in message:
+                    raise RuntimeError(f"Daemon failed to process the request: {message['error']}")
+            raise ConnectionError("Daemon closed the connection before the response was complete.")
+        finally:
+            self.close()
+
+    def text(self) -> str:
+        return "".join(self)
+
+    def timing_summary(self) -> str:
+        return self._summary or "--- [INFO] LLM produced no output. ---"
+
+    def close(self):
+        self._rfile.close()
+        self._connection.close()
+
+
+def _open(request: dict, socket_path: str):
+    """リクエストを送り、最初の応答を返す。接続できない場合は (None, None, None) を返す。"""
+    connection = _connect(socket_path)
+    if connection is None:
+        return None, None, None
+    try:
+        connection.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode('utf-8'))
+        rfile = connection.makefile('rb')
+        line = rfile.readline()
+    except OSError:
+        connection.close()
+        return None, None, None
+    if not line:
+        rfile.close()
+        connection.close()
+        return None, None, None
+    return connection, rfile, json.loads(line)
+
+
+def request_stream(command: str, text: str, use_cache: bool = True, socket_path: str = None):
+    """
+    デーモンに generate / review のリクエストを送り、出力を順に返す DaemonStream を返す。
+    デーモンが動いていない場合は起動し、古いデーモンの場合は起動し直す。
+    デーモンを使えない場合はNoneを返す (呼び出し元はプロセス内で処理する)。
+    """
+    if not is_supported():
+        return None
+    socket_path = socket_path or config.DAEMON_SOCKET_PATH
+    request = {"command": command, "fingerprint": fingerprint(), "text": text, "use_cache": use_cache}
+    for attempt in range(2):
+        connection, rfile, message = _open(request, socket_path)
+        if message is not None and message.get('accepted'):
+            return DaemonStream(connection, rfile)
+        if connection is not None:
+            rfile.close()
+            connection.close()
+        if attempt == 0:
+            if message is not None and message.get('stale'):
+                print("[INFO] Daemon was started with different code or config. Restarting it.")
+            elif message is not None:
+                print(f"[WARN] Daemon rejected the request: {message}")
+                return None
+            try:
+                _spawn(socket_path)
+            except OSError as e:
+                print(f"[WARN] Failed to start daemon: {e}")
+                return None
+            connection = _wait_for_daemon(socket_path, config.DAEMON_START_TIMEOUT_SECONDS)
+            if connection is None:
+                print("[WARN] Daemon did not start in time. Running in-process.")
+                return None
+            connection.close()
+    return None
+
+
+def send_command(command: str, socket_path: str = None) -> dict:
+    """デーモンに status / stop を送り、応答を返す。デーモンが動いていない場合はNoneを返す。"""
+    if not is_supported():
+        return None
+    connection, rfile, message = _open({"command": command, "fingerprint": fingerprint()},
+                                       socket_path or config.DAEMON_SOCKET_PATH)
+    if connection is not None:
+        rfile.close()
+        connection.close()
+    return message
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Warm daemon for cli.py generate / review.")
+    parser.add_argument('--socket', type=str, default=None, help='待ち受けるソケットのパス。')
+    parser.add_argument('--idle-timeout', type=float, default=None, help='自動で終了するまでのアイドル秒数。')
+    args = parser.parse_args()
+    run_daemon(args.socket, args.idle_timeout)
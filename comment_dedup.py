@@ -0,0 +1,97 @@
+"""
+レビューコメントの近似重複をまとめる (レビューコメント専用のインデックスを作るときに使う)。
+
+ベクトルをランダムな超平面で符号化した SimHash をバンドに分けてバケットに入れ (LSH)、新しいベクトルは
+同じバケットに入っている代表とだけコサイン類似度を比較する。全ペアの比較を行わないため、
+処理時間はコメントの件数にほぼ比例する。
+"""
+import numpy as np
+import config
+
+
+class NearDuplicateIndex:
+    """
+    ベクトルを順に追加し、類似度が threshold 以上の代表があればその代表に、なければ新しい代表にまとめる。
+
+    Args:
+        threshold (float): 同じものとみなすコサイン類似度。省略時は config.REVIEW_COMMENT_DEDUP_THRESHOLD。
+        bands (int): LSHのバンド数。多いほど見落としが減り、比較する候補が増える。
+        bits (int): 1バンドあたりのビット数。多いほど候補が絞られ、見落としが増える。
+        seed (int): 超平面の乱数のシード (同じ入力から同じ結果を得るため固定する)。
+    """
+
+    def __init__(self, threshold: float = None, bands: int = None, bits: int = None, seed: int = 0):
+        self.threshold = config.REVIEW_COMMENT_DEDUP_THRESHOLD if threshold is None else threshold
+        self.bands = bands or config.REVIEW_COMMENT_LSH_BANDS
+        self.bits = bits or config.REVIEW_COMMENT_LSH_BITS
+        self.seed = seed
+        self.comparisons = 0
+        self._planes = None
+        self._weights = 1 << np.arange(self.bits, dtype=np.int64)
+        self._buckets = {}
+        # 代表のベクトル (先頭 _count 行が有効。足りなくなったら倍に広げる)
+        self._matrix = None
+        self._count = 0
+
+    def _band_keys(self, vector: np.ndarray) -> list:
+        if self._planes is None:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal((self.bands * self.bits, len(vector))).astype(np.float32)
+        signs = (self._planes @ vector > 0).reshape(self.bands, self.bits)
+        return [(band, int(code)) for band, code in enumerate(signs @ self._weights)]
+
+    def add(self, vector) -> int:
+        """ベクトルを追加し、まとめた先の代表の番号を返す (新しい代表になった場合は新しい番号)。"""
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) + 1e-12)
+        keys = self._band_keys(vector)
+        if self.threshold <= 1:
+            candidates = np.unique(np.concatenate([self._buckets[key] for key in keys if key in self._buckets]
+                                                  or [np.zeros(0, dtype=np.int64)]))
+            if len(candidates):
+                self.comparisons += len(candidates)
+                similarities = self._matrix[candidates] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    return int(candidates[best])
+        number = self._count
+        if self._matrix is None or number == len(self._matrix):
+            matrix = np.zeros((max(number * 2, 1024), len(vector)), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:number] = self._matrix
+            self._matrix = matrix
+        self._matrix[number] = vector
+        self._count += 1
+        for key in keys:
+            self._buckets.setdefault(key, []).append(number)
+        return number
+
+    def __len__(self):
+        return self._count
+
+
+def collapse_review_comments(items, index: NearDuplicateIndex = None) -> list:
+    """
+    レビューコメントのアイテムの近似重複をまとめ、まとまりごとに最初に現れたアイテムを代表として返す。
+    代表のmetadataには、まとめた件数 (frequency) と元のチケットのid (ticket_ids, カンマ区切り) を加える。
+
+    Args:
+        items (iterable): (id, ベクトル, 本文, metadata) のイテラブル (VectorStore.iter_items の結果)。
+
+    Returns:
+        list: 代表の (id, ベクトル, 本文, metadata) のリスト。
+    """
+    index = index or NearDuplicateIndex()
+    representatives = []
+    ticket_ids = []
+    for item_id, embedding, document, metadata in items:
+        number = index.add(embedding)
+        if number == len(representatives):
+            representatives.append((item_id, embedding, document, dict(metadata, frequency=0)))
+            ticket_ids.append([])
+        representatives[number][3]['frequency'] += 1
+        if metadata.get('ticket_id') not in ticket_ids[number]:
+            ticket_ids[number].append(metadata.get('ticket_id'))
+    for (_, _, _, metadata), ids in zip(representatives, ticket_ids):
+        metadata['ticket_ids'] = ",".join(str(ticket_id) for ticket_id in ids)
+    return representatives
@@ -8,23 +8,191 @@ ENVIRONMENT = os.getenv('ENV', 'local')
 LOCAL_DB_PATH = "./chroma_db"
 LOCAL_DB_COLLECTION_NAME = "documents"
 
-# --- ローカル環境設定 (PostgreSQL) --- コメントアウト
-# LOCAL_DB_HOST = "localhost"
-# LOCAL_DB_PORT = 5432
-# LOCAL_DB_NAME = "doc_sage_db"
-# LOCAL_DB_USER = "user"
-# LOCAL_DB_PASSWORD = "password"
+# --- ベクトルストア設定 ---
+# 'chroma' (ChromaDB)、'numpy' (NumPyのメモリマップ) または 'pgvector' (PostgreSQL + pgvector)。
+# 省略時はローカルでchroma、AWSでpgvector。
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'chroma' if ENVIRONMENT == 'local' else 'pgvector')
+
+# --- NumPyインデックス設定 (VECTOR_STORE_BACKEND=numpy) ---
+NUMPY_INDEX_PATH = os.getenv('NUMPY_INDEX_PATH', "./numpy_index")
+# ベクトルの型。'float16' にするとメモリ使用量が半分になる (類似度の精度はわずかに下がる)
+NUMPY_INDEX_DTYPE = os.getenv('NUMPY_INDEX_DTYPE', 'float32')
+
+# ベクトルの量子化 ('none'、'int8' または 'binary')。量子化したベクトルで候補を選び、
+# 上位 (取得件数 x QUANTIZATION_RERANK_FACTOR) 件だけを元の精度のベクトルで並べ替える。
+# numpyは 'int8' と 'binary'、pgvectorは 'binary' (インデックスのみ量子化) に対応する。
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')
+QUANTIZATION_RERANK_FACTOR = int(os.getenv('QUANTIZATION_RERANK_FACTOR', '10'))
+
+# --- ハイブリッド検索設定 (文字n-gramのBM25 + ベクトル検索) ---
+# インデックスはローカルのファイルに保存するため、既定ではローカル環境でのみ有効
+LEXICAL_INDEX_ENABLED = os.getenv('LEXICAL_INDEX_ENABLED', 'true' if ENVIRONMENT == 'local' else 'false').lower() == 'true'
+LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', "./lexical_index/index.sqlite3")
+LEXICAL_NGRAM_SIZE = int(os.getenv('LEXICAL_NGRAM_SIZE', '2'))
+# 統合前にそれぞれの検索で取得する件数の倍率 (最終的な取得件数 x この値)
+HYBRID_CANDIDATE_FACTOR = int(os.getenv('HYBRID_CANDIDATE_FACTOR', '4'))
+# Reciprocal Rank Fusion の定数k (大きいほど下位の順位も重視する)
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+
+# --- PostgreSQL (pgvector) 設定 ---
+# 接続文字列。未設定の場合は DB_SECRET_ARN のシークレット (CDKで作成したRDSの認証情報) から組み立てる。
+# ローカルの例: PG_DSN="host=localhost port=5432 dbname=doc_sage_db user=user password=password"
+PG_DSN = os.getenv('PG_DSN')
+DB_SECRET_ARN = os.getenv('DB_SECRET_ARN')
+PG_TABLE_NAME = os.getenv('PG_TABLE_NAME', 'documents')
+PG_POOL_MIN_SIZE = int(os.getenv('PG_POOL_MIN_SIZE', '1'))
+PG_POOL_MAX_SIZE = int(os.getenv('PG_POOL_MAX_SIZE', '4'))
+# HNSWインデックスのパラメータ (m, ef_construction は作成時、ef_search は検索時に使用)
+PG_HNSW_M = int(os.getenv('PG_HNSW_M', '16'))
+PG_HNSW_EF_CONSTRUCTION = int(os.getenv('PG_HNSW_EF_CONSTRUCTION', '64'))
+PG_HNSW_EF_SEARCH = int(os.getenv('PG_HNSW_EF_SEARCH', '40'))
+
+# --- レビューコメント専用インデックス設定 ---
+# db_importer がインポート後に、格納済みのレビューコメントから専用のインデックスを作り直し、
+# レビュー時は content_type で絞り込まずに検索する。
+# インデックスの名前は、各ベクトルストアのコレクション名・ディレクトリ・テーブル名にこの接尾辞を付けたもの。
+# インデックスが空の場合 (作成前) は、これまでどおり全アイテムのインデックスを絞り込んで検索する。
+REVIEW_COMMENT_INDEX_ENABLED = os.getenv('REVIEW_COMMENT_INDEX_ENABLED', 'true').lower() == 'true'
+REVIEW_COMMENT_INDEX_SUFFIX = os.getenv('REVIEW_COMMENT_INDEX_SUFFIX', '_review_comments')
+# インデックスには近似重複のコメントを1件にまとめて格納する (metadataに件数 frequency と元の ticket_ids を持たせる)。
+# コサイン類似度がこの値以上のコメントを同じものとみなす (1より大きくするとまとめない)
+REVIEW_COMMENT_DEDUP_THRESHOLD = float(os.getenv('REVIEW_COMMENT_DEDUP_THRESHOLD', '0.95'))
+# 近似重複の候補を探すLSH (SimHash) のバンド数と、1バンドあたりのビット数
+REVIEW_COMMENT_LSH_BANDS = int(os.getenv('REVIEW_COMMENT_LSH_BANDS', '20'))
+REVIEW_COMMENT_LSH_BITS = int(os.getenv('REVIEW_COMMENT_LSH_BITS', '16'))
+# レビュー時のコメントの並べ方。'relevance' (類似度順) または 'frequency' (類似するコメントのうち、指摘された回数の多い順)
+REVIEW_COMMENT_RANK_BY = os.getenv('REVIEW_COMMENT_RANK_BY', 'relevance')
+
+# db_importer が一度にベクトル化・格納するアイテム数 (メモリ使用量の上限を決める)
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '256'))
 
 # ローカルで使用するEmbeddingモデル (Hugging Faceのモデル名)
 # all-MiniLM-L6-v2 は高速で軽量。次元数は384。
 LOCAL_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
 EMBEDDING_DIM = 384 # all-MiniLM-L6-v2の次元数
 
+# Embeddingの推論方法。'sentence_transformers' (PyTorch)、'onnx' (ONNX Runtime) または 'bedrock' (Titan)。
+# 省略時はローカルで sentence_transformers、AWSで bedrock。
+# 'onnx' はPyTorchを使わないため、読み込みが速く、パッケージ (Lambdaなど) も小さくなる。
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'sentence_transformers' if ENVIRONMENT == 'local' else 'bedrock')
+# 1件の入力の最大トークン数。これを超える部分は切り捨てる (all-MiniLM-L6-v2 の学習時の上限は256)。
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv('EMBEDDING_MAX_SEQ_LENGTH', '256'))
+# ONNXモデル (model.onnx) と tokenizer.json を置いたディレクトリ。未設定の場合はHugging Face Hubから取得する。
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR')
+# 'int8' を指定すると、重みをint8に動的量子化したモデルを使う (要 onnx パッケージ)。量子化したモデルは ONNX_CACHE_DIR に保存する。
+ONNX_QUANTIZATION = os.getenv('ONNX_QUANTIZATION', 'none')
+ONNX_CACHE_DIR = os.getenv('ONNX_CACHE_DIR', "./onnx_models")
+# ONNX Runtimeが1回の推論で使うスレッド数 (0の場合はONNX Runtimeの既定値 = 物理コア数)
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))
+# ローカルのモデルのID (EMBEDDING_MODEL_ID を参照)。量子化したモデルはベクトルがわずかに変わるため区別する。
+LOCAL_EMBEDDING_MODEL_ID = LOCAL_EMBEDDING_MODEL + (
+    '#onnx-int8' if EMBEDDING_BACKEND == 'onnx' and ONNX_QUANTIZATION == 'int8' else ''
+)
+
+# Embeddingのディスクキャッシュ (同じテキストの再ベクトル化を避ける)
+# キャッシュはローカルのファイルに保存するため、既定ではローカル環境でのみ有効 (Lambdaのファイルシステムは読み取り専用)
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true' if ENVIRONMENT == 'local' else 'false').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', "./embedding_cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+# 空白の違いがベクトルに影響しないモデル。これらのモデルではキャッシュキーの計算時に空白を正規化する。
+EMBEDDING_CACHE_NORMALIZE_MODELS = (LOCAL_EMBEDDING_MODEL, LOCAL_EMBEDDING_MODEL_ID)
+
+# 同時に届いたベクトル化の要求を1回の推論にまとめる最大件数と、まとめるために待つ最大時間 (ミリ秒)。
+# 待ち時間を長くするとバッチが大きくなりスループットが上がるが、1件あたりのレイテンシが増える。
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '64'))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv('EMBEDDING_BATCH_MAX_WAIT_MS', '2'))
+# 1回の推論に混ぜる入力の、最長と最短の文字数の比の上限 (短い入力が長い入力に合わせてパディングされるのを防ぐ)。0で無効。
+EMBEDDING_BATCH_LENGTH_RATIO = float(os.getenv('EMBEDDING_BATCH_LENGTH_RATIO', '2'))
+
+# 長い仕様書・リリースノートを分割する1チャンクの最大文字数 (Embeddingモデルの入力長の上限に収まるように設定する)
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', '200'))
+
 # ローカルで使用するLLM (Ollamaでpullしたモデル名)
 LOCAL_LLM_MODEL = 'llama3'
 
-# --- AWS環境設定 (将来的に入力) ---
-AWS_REGION = "us-east-1"
-AWS_BEDROCK_EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
-AWS_BEDROCK_LLM_MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1_0"
+# --- プロンプトのトークン予算 ---
+# モデルごとのコンテキスト長 (トークン数)。プロンプトはここから出力用の分を引いた予算に収める。
+PROMPT_CONTEXT_LENGTHS = {
+    'llama3': 8192,
+    'anthropic.claude-3-sonnet-20240229-v1:0': 200000,
+}
+PROMPT_DEFAULT_CONTEXT_LENGTH = 4096
+PROMPT_RESERVED_OUTPUT_TOKENS = int(os.getenv('PROMPT_RESERVED_OUTPUT_TOKENS', '1024'))
+# 0より大きい値を指定すると、モデルに関係なくこのトークン数をプロンプトの予算にする
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '0'))
+
+# true の場合、LLMの代わりに固定の応答を返すスタブ (stub_llm.py) を使う (サーバーの動作確認・負荷試験用)
+LLM_STUB = os.getenv('LLM_STUB', 'false').lower() == 'true'
+# スタブが1回の応答にかける秒数
+LLM_STUB_DELAY_SECONDS = float(os.getenv('LLM_STUB_DELAY_SECONDS', '0.5'))
+
+# --- HTTPサーバー設定 (cli.py serve) ---
+SERVER_HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8080'))
+# LLMを同時に呼び出す最大数と、LLMの順番待ちを許す最大のリクエスト数 (超えた場合は503を返す)
+SERVER_LLM_CONCURRENCY = int(os.getenv('SERVER_LLM_CONCURRENCY', '2'))
+SERVER_MAX_QUEUE = int(os.getenv('SERVER_MAX_QUEUE', '32'))
+# リクエストボディの最大バイト数
+SERVER_MAX_BODY_BYTES = int(os.getenv('SERVER_MAX_BODY_BYTES', str(1024 * 1024)))
+# レイテンシのパーセンタイルを計算するために保持する直近のリクエスト数
+SERVER_LATENCY_WINDOW = int(os.getenv('SERVER_LATENCY_WINDOW', '1000'))
+
+# --- 常駐デーモン設定 (cli.py generate / review をモデルを読み込んだままのプロセスで処理する) ---
+# true の場合、cli.py generate / review はデーモン (cli_daemon.py) に処理を依頼する (--daemon / --no-daemon で上書きできる)
+DAEMON_ENABLED = os.getenv('DAEMON_ENABLED', 'false').lower() == 'true'
+DAEMON_SOCKET_PATH = os.getenv('DAEMON_SOCKET_PATH', "./daemon/doc-sage.sock")
+DAEMON_LOG_PATH = os.getenv('DAEMON_LOG_PATH', "./daemon/daemon.log")
+# 最後のリクエストから、デーモンが自動で終了するまでの秒数 (0で終了しない)
+DAEMON_IDLE_TIMEOUT_SECONDS = float(os.getenv('DAEMON_IDLE_TIMEOUT_SECONDS', '1800'))
+# デーモンを起動してから待ち受けを始めるまで待つ最大秒数 (超えた場合はプロセス内で処理する)
+DAEMON_START_TIMEOUT_SECONDS = float(os.getenv('DAEMON_START_TIMEOUT_SECONDS', '10'))
+
+# cli.py batch でLLMを並行して呼び出す最大数 (Ollamaの場合は OLLAMA_NUM_PARALLEL も合わせて設定する)
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', '2'))
+
+# LLMの応答キャッシュ (同じ・ほぼ同じ入力に対するLLM呼び出しを省く)
+# 既定ではローカル環境でのみ有効 (EMBEDDING_CACHE_ENABLED と同じ理由)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true' if ENVIRONMENT == 'local' else 'false').lower() == 'true'
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', "./response_cache/responses.sqlite3")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+# 入力のEmbeddingのコサイン類似度がこの値以上であれば、同じ入力とみなしてキャッシュを返す (1より大きい値で無効)
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('RESPONSE_CACHE_SIMILARITY_THRESHOLD', '0.98'))
+# プロンプトのテンプレートなどを変更した場合は値を変えて、古いキャッシュを使わないようにする
+RESPONSE_CACHE_VERSION = "2"
+
+# --- ログ・トレース設定 (tracing.py) ---
+# 表示するメッセージのレベル ('debug'、'info'、'warn'、'error' または 'quiet')。
+# 既定では警告とエラーだけを表示する ('info' にすると処理の進捗も表示する)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'warn').lower()
+# リクエスト (generate, review, import など) ごとに、段階ごとの所要時間・件数を書き出す先 (カンマ区切り)。
+# 'jsonl' (TRACE_LOG_PATH に1リクエスト1行のJSON) と 'otel' (OpenTelemetryのスパン)。空の場合は計測しない
+TRACE_EXPORTERS = [name.strip() for name in os.getenv('TRACE_EXPORTERS', '').split(',') if name.strip()]
+# '-' の場合は標準エラー出力に書き出す
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', "./traces/traces.jsonl")
+
+# --- AWS環境設定 ---
+# Lambdaでは AWS_REGION が自動で設定される
+AWS_REGION = os.getenv('AWS_REGION', "us-east-1")
+AWS_BEDROCK_EMBEDDING_MODEL_ID = os.getenv('AWS_BEDROCK_EMBEDDING_MODEL_ID', "amazon.titan-embed-text-v1")
+AWS_EMBEDDING_DIM = 1536 # amazon.titan-embed-text-v1の次元数
+AWS_BEDROCK_LLM_MODEL_ID = os.getenv('AWS_BEDROCK_LLM_MODEL_ID', "anthropic.claude-3-sonnet-20240229-v1:0")
 # AWS_DB_HOST, etc...
+
+# --- Bedrockクライアント設定 ---
+# Titan v1 は1回の呼び出しで1件しかベクトル化できないため、複数のテキストは並行して呼び出す
+BEDROCK_EMBEDDING_CONCURRENCY = int(os.getenv('BEDROCK_EMBEDDING_CONCURRENCY', '8'))
+# HTTPコネクションプールの大きさ (Embeddingの並行数 + LLMの並行数以上にする)
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '16'))
+BEDROCK_CONNECT_TIMEOUT_SECONDS = float(os.getenv('BEDROCK_CONNECT_TIMEOUT_SECONDS', '5'))
+# LLMの応答をストリーミングで受け取るため、読み込みのタイムアウトは長めにする
+BEDROCK_READ_TIMEOUT_SECONDS = float(os.getenv('BEDROCK_READ_TIMEOUT_SECONDS', '120'))
+# boto3 (adaptiveモード: スロットリングを受けると送信のペースを落とす) の1回の呼び出しあたりの最大試行回数
+BEDROCK_SDK_MAX_ATTEMPTS = int(os.getenv('BEDROCK_SDK_MAX_ATTEMPTS', '3'))
+# boto3 の再試行でも解消しないスロットリングに対し、指数バックオフ (ジッター付き) で再試行する回数と待ち時間
+BEDROCK_THROTTLE_RETRIES = int(os.getenv('BEDROCK_THROTTLE_RETRIES', '4'))
+BEDROCK_BACKOFF_BASE_SECONDS = float(os.getenv('BEDROCK_BACKOFF_BASE_SECONDS', '0.5'))
+BEDROCK_BACKOFF_MAX_SECONDS = float(os.getenv('BEDROCK_BACKOFF_MAX_SECONDS', '20'))
+
+# Embeddingキャッシュのキーと変更検知に使うモデルID
+EMBEDDING_MODEL_ID = AWS_BEDROCK_EMBEDDING_MODEL_ID if EMBEDDING_BACKEND == 'bedrock' else LOCAL_EMBEDDING_MODEL_ID
@@ -1,5 +1,10 @@
 import json
 
+# ストリーミング読み込み時に一度に読み込む文字数
+READ_CHUNK_SIZE = 1 << 16
+# JSONの空白文字
+_JSON_WHITESPACE = ' \t\r\n'
+
 def load_dummy_data(file_path: str = 'dummy_data.json'):
     """
     ダミーのデータファイルを読み込み、内容を返す。
@@ -21,6 +26,104 @@ def load_dummy_data(file_path: str = 'dummy_data.json'):
         print(f"エラー: {file_path} は有効なJSONファイルではありません。")
         return []
 
+def iter_records(file_path: str):
+    """
+    JSON配列またはJSONL形式のファイルから、チケットデータを1件ずつ読み込んで返す。
+    ファイル全体をメモリに読み込まないため、大きなファイルでもメモリ使用量は1件分程度に収まる。
+    ファイルの先頭が '[' であればJSON配列、それ以外はJSONL (1行1件) として扱う。
+
+    Args:
+        file_path (str): 読み込むファイルのパス。
+
+    Yields:
+        dict: チケットデータ。
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        head = f.read(READ_CHUNK_SIZE)
+        stripped = head.lstrip()
+        if stripped.startswith('['):
+            yield from _iter_json_array(f, stripped[1:])
+        else:
+            f.seek(0)
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise json.JSONDecodeError(f"{file_path}:{line_no}: {e.msg}", e.doc, e.pos)
+
+def _iter_json_array(f, buffer: str):
+    """
+    JSON配列の要素を、チャンク単位で読み込みながら1件ずつデコードして返す。
+    要素の区切りは json.load と同様に厳密に検査し、カンマの欠落や連続したカンマは JSONDecodeError とする。
+    1件のデコードに失敗した (要素が途中で途切れている) 場合は読み込みサイズを倍にして追加で読み込むため、
+    大きな要素でも再デコードの合計コストは要素サイズに比例する程度に収まる。
+    """
+    decoder = json.JSONDecoder()
+    eof = False
+    pos = 0
+    expect_value = True  # 次に来るべきものが要素か (Falseならカンマか ']')
+    first = True  # まだ1件も要素を読んでいないか
+    read_size = READ_CHUNK_SIZE
+    while True:
+        while pos < len(buffer) and buffer[pos] in _JSON_WHITESPACE:
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise json.JSONDecodeError("Unterminated JSON array", buffer, pos)
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = chunk
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if not expect_value:
+            if char == ',':
+                expect_value = True
+                pos += 1
+                continue
+            if char == ']':
+                _ensure_only_whitespace(f, buffer[pos + 1:])
+                return
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+        if char == ']' and first:
+            _ensure_only_whitespace(f, buffer[pos + 1:])
+            return
+        if char in ',]':
+            raise json.JSONDecodeError("Expecting value", buffer, pos)
+
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+            # 数値などはバッファの末尾で途切れていても成功してしまうため、後続データがあることを確認する
+            if end < len(buffer) or eof:
+                yield record
+                buffer = buffer[end:]
+                pos = 0
+                expect_value = False
+                first = False
+                read_size = READ_CHUNK_SIZE
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                raise
+        chunk = f.read(read_size)
+        eof = not chunk
+        read_size *= 2
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def _ensure_only_whitespace(f, rest: str):
+    """配列の終わり以降に空白以外のデータがないことを確認する。"""
+    while True:
+        if rest.strip(_JSON_WHITESPACE):
+            raise json.JSONDecodeError("Extra data", rest, 0)
+        rest = f.read(READ_CHUNK_SIZE)
+        if not rest:
+            return
+
 if __name__ == '__main__':
     # このスクリプトが直接実行された場合のテスト
     dummy_data = load_dummy_data()
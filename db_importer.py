@@ -1,76 +1,380 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
-from data_loader import load_dummy_data
+import argparse
+import hashlib
+import json
+import time
+from chunker import chunk_text
+from data_loader import iter_records
 import config
+import resource_manager
+import tracing
+from embedding_cache import encode_with_cache
 
-def main():
+# 削除対象の走査・削除を一度に実行する件数
+DB_BATCH_SIZE = 1000
+
+
+def build_items(doc: dict) -> list:
     """
-    データを読み込み、ベクトル化してChromaDBに保存する。
+    1件のチケットデータから、DBに格納するアイテム (id, document, metadata) のリストを作る。
+    長いリリースノート・コメントは見出し単位のチャンクに分割し、チャンクごとに1アイテムとする。
+    metadataには内容のハッシュ (content_hash) を含める。
     """
-    print("[INFO] Data import process started.")
+    items = []
+    # リリースノートの処理
+    items.extend(_chunk_items(
+        f"{doc['ticket_id']}_note",
+        doc['final_release_note'],
+        {
+            "ticket_id": doc['ticket_id'],
+            "content_type": "release_note"
+        }
+    ))
 
-    # 1. データの読み込み
-    documents = load_dummy_data()
-    if not documents:
-        print("[ERROR] No documents to load. Exiting.")
-        return
-    print(f"[INFO] Loaded {len(documents)} documents.")
+    # レビューコメントの処理
+    for j, comment in enumerate(doc['review_comments']):
+        items.extend(_chunk_items(
+            f"{doc['ticket_id']}_comment_{j}",
+            comment['comment_text'],
+            {
+                "ticket_id": doc['ticket_id'],
+                "content_type": "review_comment",
+                "context_line": comment['context_line']
+            }
+        ))
+
+    for _, document, metadata in items:
+        metadata['content_hash'] = content_hash(document, metadata)
+    return items
+
+
+def _chunk_items(item_id: str, text: str, metadata: dict) -> list:
+    """
+    テキストをチャンクに分割してアイテムのリストにする。分割されない場合は、元のidのアイテム1件を返す。
+    分割した場合、先頭のチャンクは元のid、以降は "{id}_chunk_{k}" とし、metadataに元のid (parent_id) を持たせる
+    (検索結果を元のアイテム単位にまとめるため)。全文 (full_text) は先頭のチャンクのmetadataにだけ持たせ、
+    プロンプトに使うときは parent_id で引く (main_logic._fetch_full_texts)。
+    """
+    chunks = chunk_text(text)
+    if len(chunks) == 1:
+        return [(item_id, text, metadata)]
+    items = [
+        (
+            item_id if k == 0 else f"{item_id}_chunk_{k}",
+            chunk,
+            dict(metadata, parent_id=item_id, chunk_index=k, chunk_count=len(chunks))
+        ) for k, chunk in enumerate(chunks)
+    ]
+    items[0][2]['full_text'] = text
+    return items
+
+
+def content_hash(document: str, metadata: dict) -> str:
+    """ドキュメント本文とメタデータから、変更検知用のハッシュを計算する。"""
+    digest = hashlib.sha256()
+    digest.update(config.EMBEDDING_MODEL_ID.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(document.encode('utf-8'))
+    for key in sorted(metadata):
+        if key == 'content_hash':
+            continue
+        digest.update(b'\0')
+        digest.update(f"{key}={metadata[key]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _fetch_existing_hashes(store, ticket_ids) -> dict:
+    """指定したチケットに属する格納済みアイテムの id -> (content_hash, content_type) を取得する。"""
+    return {
+        item_id: (metadata.get('content_hash'), metadata.get('content_type'))
+        for item_id, metadata in store.iter_metadata(
+            where={"ticket_id": {"$in": sorted(ticket_ids)}}, batch_size=DB_BATCH_SIZE
+        )
+    }
+
+
+def _find_orphaned_ids(store, seen_ticket_ids: set) -> dict:
+    """
+    入力に一度も現れなかったチケットに属するアイテムの id -> content_type を、ベクトルストアをページ単位で走査して集める。
+    """
+    return {
+        item_id: metadata.get('content_type')
+        for item_id, metadata in store.iter_metadata(batch_size=DB_BATCH_SIZE)
+        if metadata.get('ticket_id') not in seen_ticket_ids
+    }
+
+
+def _import_batch(items: list, store, embedding_model, incremental: bool, stats: dict) -> int:
+    """
+    1バッチ分のアイテムをベクトル化してベクトルストアに格納する。ハイブリッド検索用の転置インデックスも更新する。
+
+    Returns:
+        int: 追加・変更・削除したレビューコメントのアイテム数。
+    """
+    lexical_index = resource_manager.get_lexical_index()
+    lexical_items = []
+    stale_ids = []
+    if incremental:
+        with tracing.span('fetch_existing_hashes', items=len(items)):
+            existing = _fetch_existing_hashes(store, {metadata['ticket_id'] for _, _, metadata in items})
+        incoming_ids = {item_id for item_id, _, _ in items}
+        changed_items = [
+            item for item in items
+            if existing.get(item[0], (None,))[0] != item[2]['content_hash']
+        ]
+        stats['unchanged'] += len(items) - len(changed_items)
+        # バッチ内のチケットに属していたが、今回の入力に含まれないアイテム (消えたコメントなど)
+        stale_ids = [item_id for item_id in existing if item_id not in incoming_ids]
+        if lexical_index is not None and len(changed_items) < len(items):
+            # 転置インデックスを後から有効にした場合に備え、変更のないアイテムでも未登録であれば追加する
+            changed_ids = {item[0] for item in changed_items}
+            missing = set(lexical_index.missing_ids([item[0] for item in items if item[0] not in changed_ids]))
+            lexical_items = [item for item in items if item[0] in missing]
+        items = changed_items
+
+    if items:
+        ids_to_add = [item_id for item_id, _, _ in items]
+        documents_to_add = [document for _, document, _ in items]
+        metadatas_to_add = [metadata for _, _, metadata in items]
+
+        # 前回のインポートでベクトル化済みのテキストはキャッシュから取得する
+        with tracing.span('embed', items=len(items)):
+            embeddings_to_add = encode_with_cache(
+                documents_to_add,
+                embedding_model.encode,
+                config.EMBEDDING_MODEL_ID,
+                resource_manager.get_embedding_cache()
+            )
+        with tracing.span('store_upsert', items=len(items)):
+            store.upsert(ids_to_add, embeddings_to_add, documents_to_add, metadatas_to_add)
+        stats['upserted'] += len(items)
+        lexical_items.extend(items)
+
+    if lexical_index is not None and lexical_items:
+        with tracing.span('lexical_upsert', items=len(lexical_items)):
+            lexical_index.upsert(
+                [item_id for item_id, _, _ in lexical_items],
+                [document for _, document, _ in lexical_items],
+                [metadata for _, _, metadata in lexical_items]
+            )
+
+    if stale_ids:
+        with tracing.span('store_delete', items=len(stale_ids)):
+            store.delete(stale_ids)
+        if lexical_index is not None:
+            lexical_index.delete(stale_ids)
+        stats['deleted'] += len(stale_ids)
+    return (sum(1 for _, _, metadata in items if metadata['content_type'] == 'review_comment')
+            + sum(1 for item_id in stale_ids if existing[item_id][1] == 'review_comment'))
+
+
+def _comment_index_outdated(comment_store, changed_comments: int) -> bool:
+    """
+    レビューコメント専用のインデックスを作り直す必要があるかどうかを返す。
+    レビューコメントが追加・変更・削除された場合と、インデックス (または対応する転置インデックス) が作られていない場合に作り直す。
+    """
+    if changed_comments:
+        return True
+    count = comment_store.count()
+    if not count:
+        return True
+    lexical_index = resource_manager.get_review_comment_lexical_index()
+    return lexical_index is not None and len(lexical_index) != count
+
+
+def rebuild_review_comment_index(store, comment_store, index=None) -> dict:
+    """
+    ベクトルストアに格納済みのレビューコメントから、近似重複をまとめたレビューコメント専用のインデックスを作り直す。
+    格納済みのベクトルを使うためベクトル化は行わず、変更のあった代表だけを書き込み、代表でなくなったアイテムは削除する。
+    転置インデックスが有効な場合は、代表だけを格納した転置インデックス (resource_manager.get_review_comment_lexical_index) も更新する。
 
-    # 2. ローカルEmbeddingモデルの準備
-    print(f"[INFO] Loading embedding model: {config.LOCAL_EMBEDDING_MODEL}")
+    Args:
+        index (NearDuplicateIndex): 近似重複の判定に使うインデックス。省略時は config の設定で作る。
+
+    Returns:
+        dict: 'comments' (レビューコメントの件数) と 'clusters' (まとめた後の件数)。
+    """
+    from comment_dedup import NearDuplicateIndex, collapse_review_comments
+    index = index or NearDuplicateIndex()
+    comments = store.iter_items(where={"content_type": "review_comment"}, batch_size=DB_BATCH_SIZE)
+    representatives = collapse_review_comments(comments, index)
+    existing = dict(comment_store.iter_metadata(batch_size=DB_BATCH_SIZE))
+    changed = [item for item in representatives if existing.get(item[0]) != item[3]]
+    for start in range(0, len(changed), DB_BATCH_SIZE):
+        batch = changed[start:start + DB_BATCH_SIZE]
+        comment_store.upsert(*(list(column) for column in zip(*batch)))
+    representative_ids = {item[0] for item in representatives}
+    removed_ids = [item_id for item_id in existing if item_id not in representative_ids]
+    for start in range(0, len(removed_ids), DB_BATCH_SIZE):
+        comment_store.delete(removed_ids[start:start + DB_BATCH_SIZE])
+    comment_store.flush()
+    lexical_index = resource_manager.get_review_comment_lexical_index()
+    if lexical_index is not None:
+        # 転置インデックスも代表だけを持つ (まとめたコメントが語句の一致で再び現れないようにする)
+        changed_ids = {item[0] for item in changed}
+        missing = set(lexical_index.missing_ids([item_id for item_id in representative_ids if item_id not in changed_ids]))
+        lexical_items = [item for item in representatives if item[0] in changed_ids or item[0] in missing]
+        for start in range(0, len(lexical_items), DB_BATCH_SIZE):
+            batch = lexical_items[start:start + DB_BATCH_SIZE]
+            lexical_index.upsert([item[0] for item in batch], [item[2] for item in batch], [item[3] for item in batch])
+        lexical_index.delete(removed_ids)
+    stats = {"comments": sum(item[3]['frequency'] for item in representatives), "clusters": len(representatives)}
+    tracing.info(f"[INFO] Collapsed {stats['comments']} review comments into {stats['clusters']} "
+                 f"(updated: {len(changed)}, removed: {len(removed_ids)}, compared: {index.comparisons})")
+    return stats
+
+
+def import_documents(documents, store, embedding_model, incremental: bool = False, prune: bool = True,
+                     batch_size: int = None, comment_store=None) -> dict:
+    """
+    チケットデータをベクトル化してベクトルストアに格納する。
+    同じidのアイテムは上書き (upsert) するため、何度実行しても結果は同じになる。
+    documentsはイテレータでもよく、batch_size件ずつベクトル化・格納するため、
+    メモリ使用量はコーパス全体の大きさによらず一定に保たれる。
+
+    Args:
+        documents (iterable): チケットデータのイテラブル。
+        store (VectorStore): 格納先のベクトルストア。
+        embedding_model: Embeddingモデル。
+        incremental (bool): Trueの場合、格納済みのcontent_hashと比較し、新規・変更されたアイテムだけを
+            ベクトル化して格納する。また、入力に含まれるチケットのうち消えたコメントを削除する。
+        prune (bool): incrementalがTrueの場合に、入力に含まれないチケットのアイテムも削除するかどうか。
+            documentsが全件のスナップショットである場合にTrueを指定する。
+        batch_size (int): 一度にベクトル化・格納するアイテム数。省略時は config.IMPORT_BATCH_SIZE。
+        comment_store (VectorStore): レビューコメント専用のベクトルストア (resource_manager.get_review_comment_store)。
+            渡された場合は、インポートでレビューコメントが変わったときに近似重複をまとめて作り直す
+            (rebuild_review_comment_index)。
+
+    Returns:
+        dict: 'tickets', 'upserted', 'unchanged', 'deleted' の件数。
+
+    Raises:
+        ValueError: 同じticket_idが入力に2回以上現れた場合。
+    """
+    batch_size = batch_size or config.IMPORT_BATCH_SIZE
+    stats = {"tickets": 0, "upserted": 0, "unchanged": 0, "deleted": 0}
+    seen_ticket_ids = set()
+    processed = 0
+    changed_comments = 0
+    started_at = time.perf_counter()
+
+    with tracing.trace('import', incremental=incremental, batch_size=batch_size) as trace:
+        batch = []
+        for doc in documents:
+            # 消えたコメントの検出はチケット単位で行うため、同じチケットが2回現れる入力は受け付けない
+            if doc['ticket_id'] in seen_ticket_ids:
+                raise ValueError(f"Duplicate ticket_id in input: {doc['ticket_id']}")
+            # 1チケット分のアイテムは必ず同じバッチに入れる (消えたコメントの検出に必要)
+            batch.extend(build_items(doc))
+            seen_ticket_ids.add(doc['ticket_id'])
+            stats['tickets'] += 1
+            if len(batch) >= batch_size:
+                changed_comments += _import_batch(batch, store, embedding_model, incremental, stats)
+                processed += len(batch)
+                batch = []
+                elapsed = time.perf_counter() - started_at
+                tracing.info(f"[INFO] Processed {stats['tickets']} tickets / {processed} items "
+                             f"({processed / elapsed:.1f} items/s)")
+        if batch:
+            changed_comments += _import_batch(batch, store, embedding_model, incremental, stats)
+            processed += len(batch)
+
+        if not stats['tickets']:
+            # 空の入力で全件を削除してしまわないよう、削除処理は行わない
+            tracing.error("[ERROR] No documents to load. Skipping import.")
+            return stats
+
+        # 入力を最後まで読み込めた場合のみここに到達する (途中で例外が発生した場合は削除しない)
+        if incremental and prune:
+            with tracing.span('prune') as span:
+                orphaned = _find_orphaned_ids(store, seen_ticket_ids)
+                orphaned_ids = list(orphaned)
+                changed_comments += sum(1 for content_type in orphaned.values() if content_type == 'review_comment')
+                span.set(items=len(orphaned_ids))
+                if orphaned_ids:
+                    tracing.info(f"[INFO] Deleting {len(orphaned_ids)} items that no longer exist in the source data...")
+                    lexical_index = resource_manager.get_lexical_index()
+                    for start in range(0, len(orphaned_ids), DB_BATCH_SIZE):
+                        store.delete(orphaned_ids[start:start + DB_BATCH_SIZE])
+                        if lexical_index is not None:
+                            lexical_index.delete(orphaned_ids[start:start + DB_BATCH_SIZE])
+                    stats['deleted'] += len(orphaned_ids)
+        with tracing.span('store_flush'):
+            store.flush()
+        if comment_store is not None:
+            if _comment_index_outdated(comment_store, changed_comments):
+                with tracing.span('rebuild_review_comment_index', changed_comments=changed_comments) as span:
+                    span.set(**rebuild_review_comment_index(store, comment_store))
+            else:
+                tracing.info("[INFO] No review comments changed. Skipping the review comment index rebuild.")
+
+        trace.set(**stats, items=processed)
+
+    elapsed = time.perf_counter() - started_at
+    tracing.info(f"[INFO] Processed {stats['tickets']} tickets / {processed} items in {elapsed:.1f}s "
+                 f"({processed / elapsed if elapsed else 0:.1f} items/s)")
+    return stats
+
+
+def main(file_path: str = 'dummy_data.json', incremental: bool = False, batch_size: int = None):
+    """
+    データを読み込み、ベクトル化してベクトルストア (config.VECTOR_STORE_BACKEND) に保存する。
+    """
+    print(f"[INFO] Data import process started. (file: {file_path}, incremental: {incremental})")
+
+    # 1. ローカルEmbeddingモデルの準備
     try:
-        embedding_model = SentenceTransformer(config.LOCAL_EMBEDDING_MODEL, device='cpu')
+        embedding_model = resource_manager.get_embedding_model()
     except Exception as e:
         print(f"[ERROR] Failed to load embedding model: {e}")
         print("Hint: Check if you have internet connection and the model name is correct.")
         return
 
-    # 3. ChromaDBクライアントの準備
-    print(f"[INFO] Initializing ChromaDB at: {config.LOCAL_DB_PATH}")
-    client = chromadb.PersistentClient(path=config.LOCAL_DB_PATH)
-    collection = client.get_or_create_collection(name=config.LOCAL_DB_COLLECTION_NAME)
-
-    # 4. ドキュメントの処理とDBへの格納
-    print("[INFO] Processing and storing documents in ChromaDB...")
-    ids_to_add = []
-    embeddings_to_add = []
-    metadatas_to_add = []
-    documents_to_add = []
-
-    for i, doc in enumerate(documents):
-        # リリースノートの処理
-        note_id = f"{doc['ticket_id']}_note"
-        ids_to_add.append(note_id)
-        documents_to_add.append(doc['final_release_note'])
-        metadatas_to_add.append({
-            "ticket_id": doc['ticket_id'],
-            "content_type": "release_note"
-        })
-
-        # レビューコメントの処理
-        for j, comment in enumerate(doc['review_comments']):
-            comment_id = f"{doc['ticket_id']}_comment_{j}"
-            ids_to_add.append(comment_id)
-            documents_to_add.append(comment['comment_text'])
-            metadatas_to_add.append({
-                "ticket_id": doc['ticket_id'],
-                "content_type": "review_comment",
-                "context_line": comment['context_line']
-            })
-    
-    # テキストをまとめてベクトル化 (効率的)
-    print(f"[INFO] Generating {len(documents_to_add)} embeddings...")
-    embeddings_to_add = embedding_model.encode(documents_to_add).tolist()
-
-    # DBにまとめて追加
-    collection.add(
-        ids=ids_to_add,
-        embeddings=embeddings_to_add,
-        documents=documents_to_add,
-        metadatas=metadatas_to_add
-    )
+    # 2. ベクトルストアの準備
+    try:
+        store = resource_manager.get_vector_store(create=True)
+        comment_store = resource_manager.get_review_comment_store(create=True)
+    except Exception as e:
+        print(f"[ERROR] Failed to connect to the vector store ({config.VECTOR_STORE_BACKEND}): {e}")
+        return
 
-    print(f"[SUCCESS] Data import process finished. Total items in DB: {collection.count()}")
+    # 3. データを1件ずつ読み込みながら、バッチ単位でDBへ格納
+    print(f"[INFO] Processing and storing documents in the vector store ({config.VECTOR_STORE_BACKEND})...")
+    try:
+        stats = import_documents(iter_records(file_path), store, embedding_model,
+                                 incremental=incremental, batch_size=batch_size, comment_store=comment_store)
+    except FileNotFoundError:
+        print(f"[ERROR] {file_path} not found. Exiting.")
+        return
+    except json.JSONDecodeError as e:
+        print(f"[ERROR] {file_path} is not a valid JSON/JSONL file: {e}")
+        return
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return
+
+    if not stats['tickets']:
+        return
+    print(f"[INFO] Upserted: {stats['upserted']}, Unchanged: {stats['unchanged']}, Deleted: {stats['deleted']}")
+    print(f"[SUCCESS] Data import process finished. Total items in DB: {store.count()}")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Import ticket data into the vector database.")
+    parser.add_argument(
+        '--file',
+        type=str,
+        default='dummy_data.json',
+        help='インポートするデータファイルのパス (JSON配列またはJSONL)。'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='格納済みのデータと比較し、新規・変更されたアイテムだけをベクトル化して反映します。'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=None,
+        help='一度にベクトル化・格納するアイテム数。'
+    )
+    args = parser.parse_args()
+    main(file_path=args.file, incremental=args.incremental, batch_size=args.batch_size)
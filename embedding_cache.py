@@ -0,0 +1,175 @@
+"""
+Embeddingのディスクキャッシュ。
+
+(モデルID, テキストのハッシュ) をキーとして、計算済みのベクトルをSQLiteに保存する。
+同じ仕様書やリリースノートを再度ベクトル化する場合、モデルの推論を行わずにキャッシュから返す。
+エントリ数には上限があり、超えた場合は最も長く参照されていないものから削除する (LRU)。
+"""
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import config
+import tracing
+
+# SQLiteの1文で扱うプレースホルダ数の上限に収まるよう、一括処理はこの件数ごとに分割する
+_SQL_BATCH_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """連続する空白・改行を1つの空白にまとめる。"""
+    return " ".join(text.split())
+
+
+def cache_text(model_id: str, text: str) -> str:
+    """
+    キャッシュキーの元になるテキストを返す。
+    config.EMBEDDING_CACHE_NORMALIZE_MODELS に含まれるモデルの場合のみ、空白を正規化する。
+    ローカルのall-MiniLM-L6-v2 (BERTのWordPieceトークナイザ) は空白を区切りとしてしか扱わないため、
+    正規化してもベクトルは変わらない。それ以外のモデル (Titanなど) では空白がベクトルに影響しうるため、
+    テキストをそのまま使う。
+    """
+    if model_id in config.EMBEDDING_CACHE_NORMALIZE_MODELS:
+        return normalize_text(text)
+    return text
+
+
+def make_key(model_id: str, text: str) -> str:
+    """モデルIDとテキストからキャッシュキーを作る。"""
+    digest = hashlib.sha256()
+    digest.update(model_id.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(cache_text(model_id, text).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLiteを使ったLRU付きのEmbeddingキャッシュ。複数スレッドから共有できる。
+
+    Args:
+        path (str): キャッシュファイルのパス。
+        max_entries (int): 保持するエントリ数の上限。
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None):
+        self.path = path or config.EMBEDDING_CACHE_PATH
+        self.max_entries = config.EMBEDDING_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model_id TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)"
+        )
+        self._conn.commit()
+
+    def get_many(self, model_id: str, texts: list) -> list:
+        """
+        複数のテキストのベクトルをまとめて取得する。
+
+        Returns:
+            list: textsと同じ順序のリスト。キャッシュにないものはNone。
+        """
+        keys = [make_key(model_id, text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                chunk = list(set(keys[start:start + _SQL_BATCH_SIZE]))
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array.array('f', blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model_id: str, texts: list, vectors: list):
+        """複数のテキストとベクトルの組をまとめて保存する。"""
+        now = time.time()
+        rows = [
+            (make_key(model_id, text), model_id, array.array('f', vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model_id, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """上限を超えた分を、最終参照時刻の古い順に削除する。"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def encode_with_cache(texts: list, encode_fn, model_id: str, cache: EmbeddingCache = None) -> list:
+    """
+    キャッシュを参照しながらテキストをまとめてベクトル化する。
+    キャッシュにないテキストだけを重複を除いて encode_fn に一度で渡し、結果をキャッシュに保存する。
+
+    Args:
+        texts (list): ベクトル化するテキストのリスト。
+        encode_fn (callable): テキストのリストを受け取り、ベクトルのリスト (またはndarray) を返す関数。
+        model_id (str): キャッシュキーに使うモデルID。
+        cache (EmbeddingCache): 使用するキャッシュ。Noneの場合はキャッシュを使わない。
+
+    Returns:
+        list: textsと同じ順序のベクトル (floatのリスト) のリスト。
+    """
+    if cache is None:
+        vectors = encode_fn(texts)
+        return vectors.tolist() if hasattr(vectors, 'tolist') else [list(v) for v in vectors]
+
+    vectors = cache.get_many(model_id, texts)
+    missing = {}
+    for i, (text, vector) in enumerate(zip(texts, vectors)):
+        if vector is None:
+            missing.setdefault(cache_text(model_id, text), []).append(i)
+    if missing:
+        # キャッシュキーが同じになるテキストは1回だけベクトル化する
+        missing_texts = [texts[indexes[0]] for indexes in missing.values()]
+        tracing.info(f"--- [INFO] Embedding cache: {len(texts) - sum(len(v) for v in missing.values())} hits, {len(missing_texts)} to encode ---")
+        encoded = encode_fn(missing_texts)
+        encoded = encoded.tolist() if hasattr(encoded, 'tolist') else [list(v) for v in encoded]
+        for indexes, vector in zip(missing.values(), encoded):
+            for i in indexes:
+                vectors[i] = vector
+        cache.put_many(model_id, missing_texts, encoded)
+    return vectors
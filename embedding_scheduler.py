@@ -0,0 +1,136 @@
+"""
+同時に届いたEmbeddingの要求を、1回のバッチ推論にまとめるスケジューラー。
+
+複数のスレッド (またはasyncioのタスク) が1件ずつ encode を呼ぶと、小さな推論が何度も走り、
+CPUの行列演算をまとめて行う効率を活かせない。スケジューラーは要求を最大 max_wait_ms ミリ秒、
+最大 max_batch_size 件まで待ち合わせ、文字数順に並べて長さの近いものごとに (パディングを減らすため)
+まとめてベクトル化し、結果をそれぞれの呼び出し元に返す。推論は専用のワーカースレッドで1つずつ行い、
+推論中に届いた要求は次のバッチにまとめられる。
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import config
+
+
+class EmbeddingScheduler:
+    """
+    Embeddingのマイクロバッチ・スケジューラー。同期 (embed, embed_many) とasyncio (embed_async,
+    embed_many_async) の両方のインターフェースを持ち、複数スレッド・複数のイベントループから共有できる。
+
+    Args:
+        embed_batch: テキストのリストを受け取り、同じ順序のベクトルのリストを返す関数。
+        max_batch_size (int): 1回の推論にまとめる最大件数。省略時は config.EMBEDDING_BATCH_MAX_SIZE。
+        max_wait_ms (float): 最初の要求から、他の要求を待ち合わせる最大時間。0の場合は待たない。
+            大きくするとバッチが大きくなりスループットが上がるが、1件あたりの待ち時間が増える。
+        length_ratio (float): 1回の推論に混ぜる入力の、最長と最短の文字数の比の上限。0の場合は区切らない。
+    """
+
+    def __init__(self, embed_batch, max_batch_size: int = None, max_wait_ms: float = None,
+                 length_ratio: float = None):
+        self._embed_batch = embed_batch
+        self.max_batch_size = max_batch_size or config.EMBEDDING_BATCH_MAX_SIZE
+        self.max_wait_ms = config.EMBEDDING_BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self.length_ratio = config.EMBEDDING_BATCH_LENGTH_RATIO if length_ratio is None else length_ratio
+        self._pending = deque()  # (テキスト, Future)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = None
+        # 統計情報
+        self.batches = 0
+        self.items = 0
+        self.max_batch = 0
+
+    def submit(self, text: str) -> Future:
+        """テキストをキューに入れ、ベクトルを結果とする concurrent.futures.Future を返す。"""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("EmbeddingScheduler is closed.")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='embedding-scheduler', daemon=True)
+                self._worker.start()
+            self._pending.append((text, future))
+            self._condition.notify()
+        return future
+
+    def embed(self, text: str) -> list:
+        """1件のテキストをベクトル化する (他の呼び出し元の要求とまとめて推論される)。"""
+        return self.submit(text).result()
+
+    def embed_many(self, texts: list) -> list:
+        """複数のテキストをベクトル化し、同じ順序のベクトルのリストを返す。"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def embed_async(self, text: str) -> list:
+        """embed のasyncio版。推論中もイベントループをブロックしない。"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def embed_many_async(self, texts: list) -> list:
+        """embed_many のasyncio版。"""
+        return list(await asyncio.gather(*(asyncio.wrap_future(self.submit(text)) for text in texts)))
+
+    def close(self):
+        """新しい要求の受け付けを止め、キューに残っている要求を処理してからワーカーを終了する。"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join()
+
+    def _next_batch(self) -> list:
+        """最大 max_wait_ms 待ってバッチを取り出す。閉じられてキューが空の場合はNoneを返す。"""
+        with self._condition:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._condition.wait()
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch_size))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # 呼び出し元が待つのをやめた (キャンセルされた) 要求は推論しない
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            # 文字数順に並べ、長さの近いものごとに推論して、結果を元の呼び出し元に返す
+            order = sorted(range(len(batch)), key=lambda i: len(batch[i][0]))
+            for group in self._length_groups([batch[i] for i in order]):
+                try:
+                    vectors = self._embed_batch([text for text, _ in group])
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.items += len(group)
+                self.max_batch = max(self.max_batch, len(group))
+                for (_, future), vector in zip(group, vectors):
+                    future.set_result(vector)
+
+    def _length_groups(self, batch: list) -> list:
+        """
+        文字数順に並んだ要求を、最長が最短の length_ratio 倍を超えない範囲で区切る。
+        バッチ内の入力は最長のものに合わせてパディングされるため、長さの大きく異なる入力を同じ推論に混ぜない。
+        """
+        if not self.length_ratio:
+            return [batch]
+        groups = [[batch[0]]]
+        for item in batch[1:]:
+            if len(item[0]) > max(len(groups[-1][0][0]), 1) * self.length_ratio:
+                groups.append([])
+            groups[-1].append(item)
+        return groups
@@ -0,0 +1,223 @@
+"""
+文字n-gramによる転置インデックス (BM25) と、ベクトル検索とのハイブリッド検索。
+
+リリースノートは日本語で、「■ 機能系」「【不具合概要】」のような定型の見出しや製品固有の用語を多く含む。
+Embeddingの類似度だけでは用語の完全一致を取りこぼすことがあるため、文字n-gramの転置インデックスで
+語句の一致をスコア化し、ベクトル検索の順位と Reciprocal Rank Fusion (RRF) で統合する。
+
+インデックスは db_importer の取り込み時にアイテム単位で更新され、SQLiteに保存される。
+検索時は初回にメモリ上へ展開し、以降はメモリ上の転置リストだけで計算する。
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+import config
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str, n: int = None) -> list:
+    """
+    テキストを文字n-gramに分割する。NFKC正規化と小文字化を行い、空白をまたぐn-gramは作らない。
+    n文字に満たない語はそのまま1つのトークンとする。
+    """
+    n = n or config.LEXICAL_NGRAM_SIZE
+    tokens = []
+    for word in unicodedata.normalize('NFKC', text).lower().split():
+        if len(word) <= n:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + n] for i in range(len(word) - n + 1))
+    return tokens
+
+
+def _matches(metadata: dict, where: dict) -> bool:
+    """ChromaDB形式の条件 ({"key": value} / {"$eq": v} / {"$in": [...]}) に一致するかどうか。"""
+    for key, condition in (where or {}).items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            (operator, expected), = condition.items()
+            if operator == '$eq' and value != expected:
+                return False
+            if operator == '$in' and value not in expected:
+                return False
+            if operator not in ('$eq', '$in'):
+                raise ValueError(f"Unsupported where operator: {operator}")
+        elif value != condition:
+            return False
+    return True
+
+
+class LexicalIndex:
+    """
+    BM25の転置インデックス。複数スレッドから共有できる。
+
+    Args:
+        path (str): インデックスを保存するSQLiteファイルのパス。
+        n (int): n-gramの文字数。
+    """
+
+    def __init__(self, path: str = None, n: int = None):
+        self.path = path or config.LEXICAL_INDEX_PATH
+        self.n = n or config.LEXICAL_NGRAM_SIZE
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " id TEXT PRIMARY KEY,"
+            " document TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " terms TEXT NOT NULL,"
+            " length INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        # メモリ上のインデックス (初回の検索時に読み込む)
+        self._postings = None   # term -> {id: 出現回数}
+        self._docs = None       # id -> (長さ, 本文, メタデータ)
+        self._total_length = 0
+
+    def load(self):
+        """インデックスをメモリ上に展開する。通常は初回の検索時に行われる。"""
+        with self._lock:
+            self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        if self._postings is not None:
+            return
+        postings = {}
+        docs = {}
+        total_length = 0
+        for item_id, document, metadata, terms, length in self._conn.execute(
+            "SELECT id, document, metadata, terms, length FROM documents"
+        ):
+            docs[item_id] = (length, document, json.loads(metadata))
+            total_length += length
+            for term, count in json.loads(terms).items():
+                postings.setdefault(term, {})[item_id] = count
+        self._postings, self._docs, self._total_length = postings, docs, total_length
+
+    def _remove_from_memory(self, item_id: str):
+        entry = self._docs.pop(item_id, None)
+        if entry is None:
+            return
+        self._total_length -= entry[0]
+        for term in Counter(tokenize(entry[1], self.n)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(item_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def upsert(self, ids: list, documents: list, metadatas: list):
+        """アイテムを追加する。同じidのアイテムがあれば置き換える。"""
+        rows = []
+        for item_id, document, metadata in zip(ids, documents, metadatas):
+            tokens = tokenize(document, self.n)
+            rows.append((item_id, document, metadata, Counter(tokens), len(tokens)))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (id, document, metadata, terms, length) VALUES (?, ?, ?, ?, ?)",
+                [(item_id, document, json.dumps(metadata, ensure_ascii=False), json.dumps(terms, ensure_ascii=False), length)
+                 for item_id, document, metadata, terms, length in rows]
+            )
+            self._conn.commit()
+            if self._postings is not None:
+                for item_id, document, metadata, terms, length in rows:
+                    self._remove_from_memory(item_id)
+                    self._docs[item_id] = (length, document, dict(metadata))
+                    self._total_length += length
+                    for term, count in terms.items():
+                        self._postings.setdefault(term, {})[item_id] = count
+
+    def delete(self, ids: list):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM documents WHERE id = ?", [(item_id,) for item_id in ids])
+            self._conn.commit()
+            if self._postings is not None:
+                for item_id in ids:
+                    self._remove_from_memory(item_id)
+
+    def missing_ids(self, ids: list) -> list:
+        """インデックスに登録されていないidを返す。"""
+        with self._lock:
+            found = set()
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(row[0] for row in self._conn.execute(
+                    f"SELECT id FROM documents WHERE id IN ({placeholders})", chunk
+                ))
+        return [item_id for item_id in ids if item_id not in found]
+
+    def search(self, text: str, n_results: int, where: dict = None) -> list:
+        """
+        BM25のスコアが高い順に最大n_results件のアイテムを返す。
+
+        Returns:
+            list: {"id", "document", "metadata", "score"} のdictのリスト。
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if not self._docs:
+                return []
+            doc_count = len(self._docs)
+            average_length = self._total_length / doc_count
+            scores = {}
+            for term, query_count in Counter(tokenize(text, self.n)).items():
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for item_id, count in posting.items():
+                    length = self._docs[item_id][0]
+                    weight = count * (BM25_K1 + 1) / (count + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+                    scores[item_id] = scores.get(item_id, 0.0) + idf * weight * query_count
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+            hits = []
+            for item_id, score in ranked:
+                _, document, metadata = self._docs[item_id]
+                if where and not _matches(metadata, where):
+                    continue
+                hits.append({"id": item_id, "document": document, "metadata": metadata, "score": score})
+                if len(hits) >= n_results:
+                    break
+            return hits
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def reciprocal_rank_fusion(result_lists: list, n_results: int, k: int = None) -> list:
+    """
+    複数の検索結果 (順位順のhitのリスト) を Reciprocal Rank Fusion で統合する。
+    各アイテムのスコアは、それぞれの結果での順位rに対する 1 / (k + r) の合計。
+
+    Returns:
+        list: 統合後のスコアが高い順の上位n_results件のhit (最初に現れたhitのdictに 'rrf_score' を加えたもの)。
+    """
+    k = config.HYBRID_RRF_K if k is None else k
+    fused = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit['id'], [0.0, hit])
+            entry[0] += 1.0 / (k + rank)
+    ranked = sorted(fused.values(), key=lambda entry: -entry[0])[:n_results]
+    return [dict(hit, rrf_score=score) for score, hit in ranked]
@@ -1,110 +1,408 @@
+import base64
 import json
+import time
 import config
+import resource_manager
+import tracing
+from chunker import chunk_text
+from lexical_index import reciprocal_rank_fusion
+from prompt_builder import build_prompt, format_stats
 
-# --- Local Environment Imports ---
-try:
-    import chromadb
-    from sentence_transformers import SentenceTransformer
-    import ollama
-except ImportError as e:
-    print(f"[WARN] A required library is not installed: {e}")
-    print("[WARN] Please run 'pip install -r requirements.txt'")
+# 重いライブラリ (chromadb, psycopg, sentence_transformers, ollama, boto3) は resource_manager が
+# 初回アクセス時に読み込み、プロセス内で使い回す。
+# Embeddingモデルは、ローカルでは SentenceTransformer (またはONNX Runtime)、AWSでは Bedrock (Titan) で、
+# どちらも encode(texts) で呼び出せるため、ベクトル化・検索の処理は環境によらず共通。
 
-# --- Placeholder Functions for AWS (to be implemented later) ---
+# --- AWS Environment Functions ---
 
-def get_embedding_aws(text: str):
-    raise NotImplementedError("AWS Bedrock embedding is not implemented yet.")
+def invoke_llm_aws_stream(prompt_string: str):
+    """AWS BedrockのLLMをストリーミングで呼び出し、生成されたテキストを順に返すイテレータを返す"""
+    tracing.info(f"--- [AWS] Invoking Bedrock model '{config.AWS_BEDROCK_LLM_MODEL_ID}' (streaming) ---")
+    return _stream_bedrock(prompt_string)
 
-def query_db_aws(vector):
-    raise NotImplementedError("AWS RDS query is not implemented yet.")
+def _stream_bedrock(prompt_string: str):
+    import bedrock
+    try:
+        yield from bedrock.stream_text(resource_manager.get_llm_client(), prompt_string)
+    except Exception as e:
+        tracing.error(f"[ERROR] Failed to invoke Bedrock: {e}")
+        yield "[ERROR] Could not generate response from Bedrock LLM."
 
-def invoke_llm_aws(prompt: dict):
-    raise NotImplementedError("AWS Bedrock LLM invocation is not implemented yet.")
+def invoke_llm_aws(prompt_string: str):
+    """AWS BedrockのLLMを呼び出す"""
+    return "".join(invoke_llm_aws_stream(prompt_string))
 
-# --- Local Environment Functions ---
+# --- Embedding and Retrieval Functions ---
 
 def get_embedding_local(text: str, model):
     """ローカルでテキストをベクトル化する"""
-    print(f'--- [LOCAL] Vectorizing text: "{text[:20]}..." ---')
-    return model.encode(text).tolist()
-
-def query_db_local(vector, collection, n_results=2):
-    """ローカルのChromaDBに類似ベクトルを問い合わせる"""
-    print(f"--- [LOCAL] Querying ChromaDB for {n_results} similar documents... ---")
-    results = collection.query(
-        query_embeddings=[vector],
-        n_results=n_results
-    )
-    # ChromaDBの出力形式から、元のドキュメント構造に変換する
-    retrieved_docs = []
-    if results and results['metadatas']:
-        for metadata, document in zip(results['metadatas'][0], results['documents'][0]):
+    tracing.debug(f'--- [LOCAL] Vectorizing text: "{text[:20]}..." ---')
+    return get_embeddings_local([text], model)[0]
+
+def get_embeddings_local(texts: list, model):
+    """
+    ローカルで複数のテキストをまとめてベクトル化する。
+    同時に他のスレッドから届いた要求とあわせて、EmbeddingScheduler がまとめて推論する。
+    """
+    return resource_manager.get_embedding_scheduler(model).embed_many(texts)
+
+def get_chunk_embeddings_local(texts: list, model) -> list:
+    """
+    複数のテキストをそれぞれ見出し単位のチャンクに分割し、全チャンクを1回のencode呼び出しでまとめてベクトル化する。
+
+    Returns:
+        list: textsと同じ順序の、各テキストのチャンクのベクトルのリスト。
+    """
+    chunked = [chunk_text(text) for text in texts]
+    chunk_count = sum(len(chunks) for chunks in chunked)
+    tracing.info(f'--- [LOCAL] Vectorizing {len(texts)} texts ({chunk_count} chunks) ---')
+    with tracing.span('embed', texts=len(texts), chunks=chunk_count):
+        flat = get_embeddings_local([chunk for chunks in chunked for chunk in chunks], model)
+    vectors = []
+    position = 0
+    for chunks in chunked:
+        vectors.append(flat[position:position + len(chunks)])
+        position += len(chunks)
+    return vectors
+
+def mean_vector(chunk_vectors: list) -> list:
+    """チャンクのベクトルの平均を返す (応答キャッシュの意味的な一致の判定に使う)。チャンクが1つならそのベクトル。"""
+    if len(chunk_vectors) == 1:
+        return chunk_vectors[0]
+    return [sum(values) / len(chunk_vectors) for values in zip(*chunk_vectors)]
+
+def query_db_local(vector, store, n_results=2, text=None):
+    """ローカルのベクトルストアに類似ベクトルを問い合わせる (vectorはチャンクのベクトルのリストでもよい)"""
+    return query_db_batch([vector], store, n_results, texts=None if text is None else [text])[0]
+
+def _as_chunk_vectors(vector) -> list:
+    """1つのベクトル、またはチャンクのベクトルのリストを、チャンクのベクトルのリストにそろえる"""
+    return list(vector) if len(vector) and hasattr(vector[0], '__len__') else [vector]
+
+def _group_hits(hits: list, key) -> list:
+    """順位順のhitを、keyが同じもの同士のグループにまとめる (グループの順位は最上位のhitの順位)"""
+    groups = {}
+    for hit in hits:
+        group = groups.setdefault(key(hit), {"id": key(hit), "hits": {}})
+        group["hits"].setdefault(hit["id"], hit)
+    return list(groups.values())
+
+def retrieve_batch(vectors: list, store, n_results: int, where: dict = None, texts: list = None,
+                   group_by: str = 'ticket_id', prefiltered: bool = False, lexical_index=None) -> list:
+    """
+    複数の入力それぞれについて、類似するアイテムをグループ単位で検索する。
+
+    - 全入力の全チャンクのベクトルを1回のqueryで検索する。アイテムの順位は、入力のチャンクのうち
+      最も近いものとの距離で決める (max-sim)。
+    - group_by='ticket_id' の場合はチケット単位、'item' の場合は元のアイテム (分割前のリリースノート・コメント) 単位にまとめる。
+    - textsが渡され、転置インデックスが有効な場合は語句の一致による検索も行い、
+      両方の順位を Reciprocal Rank Fusion で統合する。
+
+    Args:
+        vectors (list): 入力ごとのベクトル、またはチャンクのベクトルのリスト。
+        prefiltered (bool): Trueの場合、storeはwhereに一致するアイテムだけを格納しているものとして、
+            ベクトル検索では絞り込みを行わない (転置インデックスの検索はwhereで絞り込む)。
+        lexical_index (LexicalIndex): storeに対応する転置インデックス。省略時は resource_manager.get_lexical_index()。
+
+    Returns:
+        list: 入力ごとの、上位n_results件のグループのリスト。各グループは 'id' と 'hits' (hitのリスト) を持つ。
+    """
+    if group_by == 'ticket_id':
+        key = lambda hit: hit['metadata'].get('ticket_id', hit['id'])
+    else:
+        key = lambda hit: hit['metadata'].get('parent_id', hit['id'])
+    chunk_vectors = [_as_chunk_vectors(vector) for vector in vectors]
+    candidates = n_results * max(config.HYBRID_CANDIDATE_FACTOR, 1)
+    with tracing.span('vector_query', queries=len(chunk_vectors), candidates=candidates) as span:
+        all_hits = store.query([vector for chunks in chunk_vectors for vector in chunks], candidates,
+                               where=None if prefiltered else where)
+        span.set(chunks=len(all_hits), hits=sum(len(hits) for hits in all_hits))
+    if texts is None:
+        lexical_index = None
+    elif lexical_index is None:
+        lexical_index = resource_manager.get_lexical_index()
+
+    results = []
+    position = 0
+    for i, chunks in enumerate(chunk_vectors):
+        chunk_hits = all_hits[position:position + len(chunks)]
+        position += len(chunks)
+        vector_hits = sorted(
+            (hit for hits in chunk_hits for hit in hits),
+            key=lambda hit: float('inf') if hit['distance'] is None else hit['distance']
+        )
+        ranked_lists = [_group_hits(vector_hits, key)]
+        if lexical_index is not None:
+            with tracing.span('lexical_query', candidates=candidates):
+                ranked_lists.append(_group_hits(lexical_index.search(texts[i], candidates, where), key))
+        # 両方の検索で見つかったアイテムを、グループごとにまとめる
+        merged = {}
+        for groups in ranked_lists:
+            for group in groups:
+                items = merged.setdefault(group['id'], {})
+                for item_id, hit in group['hits'].items():
+                    items.setdefault(item_id, hit)
+        results.append([
+            {"id": group['id'], "hits": list(merged[group['id']].values())}
+            for group in reciprocal_rank_fusion(ranked_lists, n_results)
+        ])
+    return results
+
+def _fetch_full_texts(hits, store) -> dict:
+    """
+    チャンクに分割されたアイテムの全文 (先頭のチャンクのmetadataにだけ格納している) を、
+    全文を持たないhitの parent_id ごとに1回の問い合わせでまとめて取得する。
+
+    Returns:
+        dict: parent_id -> 全文
+    """
+    parent_ids = sorted({
+        hit['metadata']['parent_id'] for hit in hits
+        if 'parent_id' in hit['metadata'] and 'full_text' not in hit['metadata']
+    })
+    if not parent_ids:
+        return {}
+    return {
+        metadata['parent_id']: metadata['full_text']
+        for _, metadata in store.iter_metadata(where={"parent_id": {"$in": parent_ids}})
+        if 'full_text' in metadata
+    }
+
+def _full_text(hit: dict, full_texts: dict) -> str:
+    """チャンクに分割されたアイテムの場合は分割前の全文、それ以外は本文を返す"""
+    if 'full_text' in hit['metadata']:
+        return hit['metadata']['full_text']
+    return full_texts.get(hit['metadata'].get('parent_id'), hit['document'])
+
+def query_db_batch(vectors: list, store, n_results=2, texts: list = None):
+    """
+    ベクトルストアに複数の入力の類似ドキュメントを1回のqueryでまとめて問い合わせる (textsを渡すとハイブリッド検索)。
+    結果はチケット単位にまとめ、同じチケットが重複して含まれないようにする。
+    """
+    tracing.info(f"--- [INFO] Querying vector store for {n_results} similar documents ({len(vectors)} queries)... ---")
+    # 検索結果を、元のドキュメント構造に変換する
+    all_retrieved_docs = []
+    all_groups = retrieve_batch(vectors, store, n_results, texts=texts)
+    full_texts = _fetch_full_texts((hit for groups in all_groups for group in groups for hit in group['hits']), store)
+    for groups in all_groups:
+        retrieved_docs = []
+        for group in groups:
+            notes = [hit for hit in group['hits'] if hit['metadata'].get('content_type') == 'release_note']
+            comments = {}
+            for hit in group['hits']:
+                if hit['metadata'].get('content_type') == 'review_comment':
+                    comments.setdefault(hit['metadata'].get('parent_id', hit['id']), hit)
             retrieved_docs.append({
-                "final_release_note": document if metadata.get('content_type') == 'release_note' else "",
+                "final_release_note": _full_text(notes[0], full_texts) if notes else "",
                 "review_comments": [{
-                    "comment_text": document,
-                    "context_line": metadata.get('context_line', '')
-                }] if metadata.get('content_type') == 'review_comment' else []
+                    "comment_text": _full_text(hit, full_texts),
+                    "context_line": hit['metadata'].get('context_line', '')
+                } for hit in comments.values()]
             })
-    return retrieved_docs
+        all_retrieved_docs.append(retrieved_docs)
+    return all_retrieved_docs
+
+def query_review_comments_batch(vectors: list, store, n_results=5, texts: list = None):
+    """
+    ベクトルストアから、複数の入力それぞれに類似する過去のレビューコメントを取得する (textsを渡すとハイブリッド検索)。
+    レビューコメント専用のインデックスがあればそれを検索し、なければstoreをcontent_typeで絞り込んで検索する。
+    専用のインデックスでは近似重複のコメントが1件にまとめられており、frequency に指摘された回数を持つ。
+    config.REVIEW_COMMENT_RANK_BY が 'frequency' の場合は、類似する上位 (n_results x 2) 件を回数の多い順に並べ替える。
+    """
+    rank_by_frequency = config.REVIEW_COMMENT_RANK_BY == 'frequency'
+    comment_store = resource_manager.get_review_comment_store()
+    # 専用のインデックスを使う場合は、語句の一致による検索も代表だけを格納した転置インデックスで行う
+    lexical_index = resource_manager.get_review_comment_lexical_index() if comment_store is not None else None
+    all_retrieved_comments = []
+    all_groups = retrieve_batch(vectors, comment_store or store, n_results * 2 if rank_by_frequency else n_results,
+                                where={'content_type': 'review_comment'}, texts=texts, group_by='item',
+                                prefiltered=comment_store is not None, lexical_index=lexical_index)
+    # 専用のインデックスには先頭のチャンクが代表として残っていない場合があるため、全文はstoreから引く
+    full_texts = _fetch_full_texts((group['hits'][0] for groups in all_groups for group in groups), store)
+    for groups in all_groups:
+        comments = [
+            {
+                "comment_text": _full_text(group['hits'][0], full_texts),
+                "ticket_id": group['hits'][0]['metadata'].get('ticket_id'),
+                "context_line": group['hits'][0]['metadata'].get('context_line'),
+                "frequency": int(group['hits'][0]['metadata'].get('frequency', 1))
+            } for group in groups
+        ]
+        if rank_by_frequency:
+            # 同じ回数のコメントは類似度順のまま
+            comments = sorted(comments, key=lambda comment: -comment['frequency'])[:n_results]
+        all_retrieved_comments.append(comments)
+    return all_retrieved_comments
+
+class TokenStream:
+    """
+    LLMの出力をトークン (チャンク) 単位で返すイテレータ。
+    最初のトークンが届くまでの時間 (time_to_first_token) と全体の所要時間 (total_time) を記録する。
+    返したチャンクは parts に保持する。
+    prompt_stats には、LLMに渡したプロンプトのサイズの情報 (prompt_builder.build_prompt を参照) を保持する。
+    出力を最後まで返すと、作成時に実行中だったトレースに 'llm' の段階を記録する。
+    trace を渡した場合はそのトレースに記録し、記録後にトレースを終える (リクエストの最後の段階として使う)。
+    """
+
+    def __init__(self, chunks, started_at: float = None, prompt_stats: dict = None, trace=None):
+        self._chunks = chunks
+        self.started_at = started_at or time.perf_counter()
+        self.prompt_stats = prompt_stats
+        self.time_to_first_token = None
+        self.total_time = None
+        self.parts = []
+        self._trace = trace if trace is not None else tracing.current()
+        self._finish_trace = trace is not None
+
+    def __iter__(self):
+        llm_started_at = time.perf_counter()
+        llm_first_token_at = None
+        try:
+            for chunk in self._chunks:
+                if not chunk:
+                    continue
+                if self.time_to_first_token is None:
+                    llm_first_token_at = time.perf_counter()
+                    self.time_to_first_token = llm_first_token_at - self.started_at
+                self.parts.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # 途中で読むのをやめた場合 (クライアントの切断など) は、LLMのストリームも閉じる
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+            raise
+        ended_at = time.perf_counter()
+        self.total_time = ended_at - self.started_at
+        if self.prompt_stats is not None:
+            # LLMを呼び出す前に失敗した場合 (エラーメッセージだけを返す場合) は記録しない
+            self._trace.record('llm', llm_started_at, ended_at, {
+                "time_to_first_token_ms": None if llm_first_token_at is None
+                else round((llm_first_token_at - llm_started_at) * 1000, 3),
+                "prompt_tokens": self.prompt_stats['tokens'],
+                "output_chunks": len(self.parts),
+                "output_chars": sum(len(part) for part in self.parts),
+            })
+        if self._finish_trace:
+            self._trace.finish(
+                time_to_first_token_ms=None if self.time_to_first_token is None
+                else round(self.time_to_first_token * 1000, 3),
+                total_ms=round(self.total_time * 1000, 3),
+            )
+
+    def text(self) -> str:
+        """最後まで読み込んで (読み込み済みの部分も含めた) 全体の文字列を返す。"""
+        if self.total_time is None:
+            for _ in self:
+                pass
+        return "".join(self.parts)
+
+    def timing_summary(self) -> str:
+        """所要時間の表示用の文字列を返す。"""
+        if self.time_to_first_token is None or self.total_time is None:
+            return "--- [INFO] LLM produced no output. ---"
+        return (f"--- [INFO] LLM time to first token: {self.time_to_first_token:.2f}s, "
+                f"total: {self.total_time:.2f}s ---")
 
-def invoke_llm_local(prompt: dict, llm_model_name: str):
-    """ローカルのOllama LLMを呼び出す"""
-    print(f"\n" + "="*50)
-    print(f"--- [LOCAL] Invoking Ollama model '{llm_model_name}' ---")
-    print("="*50 + "\n")
-    
-    # MCPプロンプトをOllamaに渡せるシンプルな文字列に変換
-    prompt_string = f"Instructions: {prompt['context']['instructions']}\n\n"
-    prompt_string += f"User Input: {prompt['context']['user_input']['content']}\n\n"
-    for i, item in enumerate(prompt['context']['retrieved_context']):
-        prompt_string += f"Retrieved Context {i+1}:\n{json.dumps(item['content'], indent=2, ensure_ascii=False)}\n\n"
-    prompt_string += "Please generate the release note based on the above information."
 
+def render_prompt(prompt: dict) -> tuple:
+    """MCPプロンプトを、使用するLLMのトークン予算に収まるコンパクトな文字列に変換し、(文字列, サイズの情報) を返す"""
+    with tracing.span('prompt_build') as span:
+        prompt_string, prompt_stats = build_prompt(prompt, current_llm_model_id())
+        span.set(chars=prompt_stats['chars'], tokens=prompt_stats['tokens'],
+                 context_items=prompt_stats['context_items'], omitted_items=prompt_stats['omitted_items'])
+    return prompt_string, prompt_stats
+
+def invoke_llm_local_stream(prompt_string: str, llm_model_name: str):
+    """ローカルのOllama LLMをストリーミングで呼び出し、生成されたテキストを順に返すイテレータを返す"""
+    tracing.info(f"\n" + "="*50)
+    tracing.info(f"--- [LOCAL] Invoking Ollama model '{llm_model_name}' (streaming) ---")
+    tracing.info("="*50 + "\n")
+    return _stream_ollama(prompt_string, llm_model_name)
+
+def _stream_ollama(prompt_string: str, llm_model_name: str):
     try:
-        response = ollama.chat(
+        client = resource_manager.get_llm_client()
+        for chunk in client.chat(
             model=llm_model_name,
-            messages=[{'role': 'user', 'content': prompt_string}]
-        )
-        return response['message']['content']
+            messages=[{'role': 'user', 'content': prompt_string}],
+            stream=True
+        ):
+            yield chunk['message']['content']
     except Exception as e:
-        print(f"[ERROR] Failed to invoke Ollama: {e}")
-        print("Hint: Is Ollama running? You can start it by running 'ollama serve' in your terminal.")
-        return "[ERROR] Could not generate response from local LLM."
+        tracing.error(f"[ERROR] Failed to invoke Ollama: {e}")
+        tracing.error("Hint: Is Ollama running? You can start it by running 'ollama serve' in your terminal.")
+        yield "[ERROR] Could not generate response from local LLM."
 
-# --- Main Logic ---
+def invoke_llm_local(prompt_string: str, llm_model_name: str):
+    """ローカルのOllama LLMを呼び出す"""
+    return "".join(invoke_llm_local_stream(prompt_string, llm_model_name))
 
-def generate_release_note_draft(design_document: str) -> str:
+def current_llm_model_id() -> str:
+    """環境設定に応じたLLMのモデルIDを返す"""
+    return config.LOCAL_LLM_MODEL if config.ENVIRONMENT == 'local' else config.AWS_BEDROCK_LLM_MODEL_ID
+
+def invoke_llm_stream(prompt_string: str):
+    """環境設定に応じたLLMをストリーミングで呼び出す"""
+    if config.ENVIRONMENT == 'local':
+        return invoke_llm_local_stream(prompt_string, config.LOCAL_LLM_MODEL)
+    return invoke_llm_aws_stream(prompt_string)
+
+def invoke_llm_cached(kind: str, prompt: dict, query_vector, started_at: float, use_cache: bool = True,
+                      trace=None) -> TokenStream:
     """
-    仕様書を受け取り、RAGプロセスを経てリリースノートの雛形を生成する。
-    環境設定に応じて、ローカルまたはAWSの関数を呼び出す。
+    応答キャッシュを確認してからLLMを呼び出す。
+    完全一致 (展開後のプロンプト全体) または意味的に近い入力 (query_vector) の応答がキャッシュにあれば、
+    LLMを呼び出さずにそれを返す。なければLLMの出力を最後まで返し終えた時点でキャッシュに保存する。
+
+    Args:
+        kind (str): 処理の種類 ('generate' または 'review')。
+        use_cache (bool): Falseの場合はキャッシュを参照・保存しない。
+        trace: LLMの出力を返し終えた時点で終えるトレース (TokenStream を参照)。
     """
-    print(f"[START] Release note draft generation process (Environment: {config.ENVIRONMENT})")
+    prompt_string, prompt_stats = render_prompt(prompt)
+    tracing.info(format_stats(prompt_stats))
+    cache = resource_manager.get_response_cache() if use_cache else None
+    if cache is None:
+        return TokenStream(invoke_llm_stream(prompt_string), started_at, prompt_stats, trace)
 
-    if config.ENVIRONMENT == 'local':
-        # --- ローカル環境での処理 ---
-        try:
-            embedding_model = SentenceTransformer(config.LOCAL_EMBEDDING_MODEL, device='cpu')
-            db_client = chromadb.PersistentClient(path=config.LOCAL_DB_PATH)
-            collection = db_client.get_collection(name=config.LOCAL_DB_COLLECTION_NAME)
-        except Exception as e:
-            return f"[ERROR] Failed to initialize local environment: {e}"
-
-        design_vector = get_embedding_local(design_document, embedding_model)
-        retrieved_docs = query_db_local(design_vector, collection)
-        
-    elif config.ENVIRONMENT == 'aws':
-        # --- AWS環境での処理 (未実装) ---
-        design_vector = get_embedding_aws(design_document)
-        retrieved_docs = query_db_aws(design_document)
-    else:
-        raise ValueError(f"Invalid ENVIRONMENT setting: {config.ENVIRONMENT}")
+    model_id = current_llm_model_id()
+    with tracing.span('response_cache_lookup') as span:
+        response, match = cache.get(kind, model_id, prompt_string, query_vector)
+        span.set(hit=match)
+    if response is not None:
+        tracing.info(f"--- [INFO] Response cache hit ({match}). Skipping LLM call. ---")
+        return TokenStream(iter([response]), started_at, prompt_stats, trace)
 
-    print(f"--- [INFO] Retrieved {len(retrieved_docs)} similar documents. ---")
+    def store_on_completion(chunks):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        response = "".join(parts)
+        # エラーメッセージはキャッシュしない
+        if response and not response.startswith("[ERROR]"):
+            cache.put(kind, model_id, prompt_string, response, query_vector)
 
-    # MCPプロンプトの構築 (共通ロジック)
-    print("--- [INFO] Building prompt in MCP format... ---")
-    mcp_prompt = {
+    return TokenStream(store_on_completion(invoke_llm_stream(prompt_string)), started_at, prompt_stats, trace)
+
+# --- Main Logic ---
+
+def _retrieval_resources(purpose: str = "") -> tuple:
+    """
+    環境設定に応じた (Embeddingモデル, ベクトルストア) を返す。
+    モデルとベクトルストアはプロセス内で共有され、2回目以降の呼び出しではロードされない。
+    """
+    if config.ENVIRONMENT not in ('local', 'aws'):
+        raise ValueError(f"Invalid ENVIRONMENT setting: {config.ENVIRONMENT}")
+    try:
+        return resource_manager.get_embedding_model(), resource_manager.get_vector_store()
+    except Exception as e:
+        raise RuntimeError(f"[ERROR] Failed to initialize {config.ENVIRONMENT} environment{purpose}: {e}") from e
+
+def make_generate_prompt(design_document: str, retrieved_docs: list) -> dict:
+    """仕様書と検索結果から、リリースノート生成用のMCPプロンプトを構築する"""
+    return {
         "version": "1.0",
         "context": {
             "instructions": """
@@ -129,63 +427,55 @@ def generate_release_note_draft(design_document: str) -> str:
         }
     }
 
-    # LLMの呼び出し
-    if config.ENVIRONMENT == 'local':
-        generated_draft = invoke_llm_local(mcp_prompt, config.LOCAL_LLM_MODEL)
-    else: # aws
-        generated_draft = invoke_llm_aws(mcp_prompt)
+def build_generate_prompt(design_document: str) -> tuple:
+    """
+    仕様書を受け取り、類似する過去のリリースノートを検索してMCPプロンプトを構築する。
 
-    print("\n[SUCCESS] Generated release note draft.")
-    return generated_draft
+    Returns:
+        tuple: (MCPプロンプト, 仕様書のベクトル)
+    """
+    embedding_model, store = _retrieval_resources()
+
+    # 長い仕様書はチャンクに分割し、全チャンクで検索する
+    chunk_vectors = get_chunk_embeddings_local([design_document], embedding_model)[0]
+    retrieved_docs = query_db_local(chunk_vectors, store, text=design_document)
+    design_vector = mean_vector(chunk_vectors)
+
+    tracing.info(f"--- [INFO] Retrieved {len(retrieved_docs)} similar documents. ---")
 
-def review_release_note(edited_release_note: str) -> str:
+    # MCPプロンプトの構築 (共通ロジック)
+    tracing.info("--- [INFO] Building prompt in MCP format... ---")
+    return make_generate_prompt(design_document, retrieved_docs), design_vector
+
+def generate_release_note_draft_stream(design_document: str, use_cache: bool = True) -> TokenStream:
     """
-    人間が修正したリリースノートを受け取り、AIがレビューコメントを生成する。
+    仕様書を受け取り、RAGプロセスを経てリリースノートの雛形をストリーミングで生成する。
+    検索とプロンプト構築を行った後、LLMの出力をトークン単位で返す TokenStream を返す。
     """
-    print(f"[START] AI Review process (Environment: {config.ENVIRONMENT})")
-
-    if config.ENVIRONMENT == 'local':
+    tracing.info(f"[START] Release note draft generation process (Environment: {config.ENVIRONMENT})")
+    started_at = time.perf_counter()
+    trace = tracing.start('generate', environment=config.ENVIRONMENT)
+    with tracing.activate(trace):
         try:
-            embedding_model = SentenceTransformer(config.LOCAL_EMBEDDING_MODEL, device='cpu')
-            db_client = chromadb.PersistentClient(path=config.LOCAL_DB_PATH)
-            # レビューコメントのみを検索対象とするコレクションを取得
-            collection = db_client.get_collection(name=config.LOCAL_DB_COLLECTION_NAME)
-        except Exception as e:
-            return f"[ERROR] Failed to initialize local environment for review: {e}"
-
-        # 1. 編集されたリリースノートをベクトル化
-        review_target_vector = get_embedding_local(edited_release_note, embedding_model)
-
-        # 2. 類似する過去のレビューコメントをDBから取得
-        # content_typeが'review_comment'のもののみをフィルタリング
-        # n_resultsはレビューコメントの数に応じて調整
-        retrieved_comments_raw = collection.query(
-            query_embeddings=[review_target_vector],
-            n_results=5, # 類似するレビューコメントを5件取得
-            where={'content_type': 'review_comment'}
-        )
-        
-        retrieved_comments = []
-        if retrieved_comments_raw and retrieved_comments_raw['documents']:
-            for doc_list, meta_list in zip(retrieved_comments_raw['documents'], retrieved_comments_raw['metadatas']):
-                for doc, meta in zip(doc_list, meta_list):
-                    retrieved_comments.append({
-                        "comment_text": doc,
-                        "ticket_id": meta.get('ticket_id'),
-                        "context_line": meta.get('context_line')
-                    })
-
-    elif config.ENVIRONMENT == 'aws':
-        # TODO: AWS環境でのレビューコメント検索処理を実装
-        raise NotImplementedError("AWS environment review process is not implemented yet.")
-    else:
-        raise ValueError(f"Invalid ENVIRONMENT setting: {config.ENVIRONMENT}")
+            mcp_prompt, design_vector = build_generate_prompt(design_document)
+        except RuntimeError as e:
+            return TokenStream(iter([str(e)]), started_at, trace=trace)
+        return invoke_llm_cached('generate', mcp_prompt, design_vector, started_at, use_cache, trace)
 
-    print(f"--- [INFO] Retrieved {len(retrieved_comments)} similar review comments. ---")
+def generate_release_note_draft(design_document: str, use_cache: bool = True) -> str:
+    """
+    仕様書を受け取り、RAGプロセスを経てリリースノートの雛形を生成する。
+    環境設定に応じて、ローカルまたはAWSの関数を呼び出す。
+    """
+    stream = generate_release_note_draft_stream(design_document, use_cache)
+    generated_draft = stream.text()
+    tracing.info(stream.timing_summary())
+    tracing.info("\n[SUCCESS] Generated release note draft.")
+    return generated_draft
 
-    # 3. MCP形式でプロンプトを構築
-    print("--- [INFO] Building prompt in MCP format for review... ---")
-    mcp_prompt = {
+def make_review_prompt(edited_release_note: str, retrieved_comments: list) -> dict:
+    """リリースノートと検索結果から、レビュー用のMCPプロンプトを構築する"""
+    return {
         "version": "1.0",
         "context": {
             "instructions": """
@@ -204,22 +494,237 @@ def review_release_note(edited_release_note: str) -> str:
                     "content": {
                         "past_review_comment": comment['comment_text'],
                         "related_ticket_id": comment['ticket_id'],
-                        "comment_context_line": comment['context_line']
+                        "comment_context_line": comment['context_line'],
+                        # 同様の指摘が複数回あった場合のみ含める
+                        "times_pointed_out": comment['frequency'] if comment.get('frequency', 1) > 1 else None
                     }
                 } for comment in retrieved_comments
             ]
         }
     }
 
-    # 4. LLMを呼び出して、レビューコメントを生成
-    if config.ENVIRONMENT == 'local':
-        generated_review = invoke_llm_local(mcp_prompt, config.LOCAL_LLM_MODEL)
-    else: # aws
-        generated_review = invoke_llm_aws(mcp_prompt)
+def build_review_prompt(edited_release_note: str) -> tuple:
+    """
+    人間が修正したリリースノートを受け取り、類似する過去のレビューコメントを検索してMCPプロンプトを構築する。
+
+    Returns:
+        tuple: (MCPプロンプト, リリースノートのベクトル)
+    """
+    embedding_model, store = _retrieval_resources(" for review")
 
-    print("\n[SUCCESS] Generated AI review.")
+    # 1. 編集されたリリースノートをチャンクごとにベクトル化
+    chunk_vectors = get_chunk_embeddings_local([edited_release_note], embedding_model)[0]
+    review_target_vector = mean_vector(chunk_vectors)
+
+    # 2. 類似する過去のレビューコメントをDBから取得 (5件)
+    retrieved_comments = query_review_comments_batch([chunk_vectors], store, texts=[edited_release_note])[0]
+
+    tracing.info(f"--- [INFO] Retrieved {len(retrieved_comments)} similar review comments. ---")
+
+    # 3. MCP形式でプロンプトを構築
+    tracing.info("--- [INFO] Building prompt in MCP format for review... ---")
+    return make_review_prompt(edited_release_note, retrieved_comments), review_target_vector
+
+def review_release_note_stream(edited_release_note: str, use_cache: bool = True) -> TokenStream:
+    """
+    人間が修正したリリースノートを受け取り、AIのレビューコメントをストリーミングで生成する。
+    """
+    tracing.info(f"[START] AI Review process (Environment: {config.ENVIRONMENT})")
+    started_at = time.perf_counter()
+    trace = tracing.start('review', environment=config.ENVIRONMENT)
+    with tracing.activate(trace):
+        try:
+            mcp_prompt, review_target_vector = build_review_prompt(edited_release_note)
+        except RuntimeError as e:
+            return TokenStream(iter([str(e)]), started_at, trace=trace)
+        # 4. LLMを呼び出して、レビューコメントを生成
+        return invoke_llm_cached('review', mcp_prompt, review_target_vector, started_at, use_cache, trace)
+
+def review_release_note(edited_release_note: str, use_cache: bool = True) -> str:
+    """
+    人間が修正したリリースノートを受け取り、AIがレビューコメントを生成する。
+    """
+    stream = review_release_note_stream(edited_release_note, use_cache)
+    generated_review = stream.text()
+    tracing.info(stream.timing_summary())
+    tracing.info("\n[SUCCESS] Generated AI review.")
     return generated_review
 
+def generate_then_review_stream(design_document: str, use_cache: bool = True):
+    """
+    仕様書からリリースノートの雛形を生成し、続けてその雛形をAIレビューする。
+    仕様書のベクトル化は1回だけ行い、レビューに使う過去のレビューコメントの検索は雛形の生成 (LLMの呼び出し) と
+    並行して行うため、雛形の出力が終わるとすぐにレビューのLLM呼び出しを始められる。
+    レビューコメントは雛形ではなく仕様書で検索する (雛形の再ベクトル化・再検索は行わない)。
+
+    Yields:
+        tuple: ('generate', TokenStream)、続けて ('review', TokenStream)。レビューは雛形の出力を
+            最後まで読み込んでから始める。雛形の生成に失敗した場合はレビューを行わない。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    tracing.info(f"[START] Generate-then-review pipeline (Environment: {config.ENVIRONMENT})")
+    started_at = time.perf_counter()
+    # 2つのLLM呼び出しを1つのトレースに記録する (yield の間は呼び出し元に戻るため、実行中のトレースにはしない)
+    trace = tracing.start('generate_review', environment=config.ENVIRONMENT)
+    with tracing.activate(trace):
+        try:
+            embedding_model, store = _retrieval_resources()
+        except RuntimeError as e:
+            error_stream = TokenStream(iter([str(e)]), started_at, trace=trace)
+        else:
+            error_stream = None
+            chunk_vectors = get_chunk_embeddings_local([design_document], embedding_model)[0]
+    if error_stream is not None:
+        yield 'generate', error_stream
+        return
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='review-retrieval') as executor:
+        with tracing.activate(trace):
+            comments_future = executor.submit(tracing.bind(query_review_comments_batch), [chunk_vectors], store,
+                                              texts=[design_document])
+            retrieved_docs = query_db_local(chunk_vectors, store, text=design_document)
+            tracing.info(f"--- [INFO] Retrieved {len(retrieved_docs)} similar documents. ---")
+            draft_stream = invoke_llm_cached('generate', make_generate_prompt(design_document, retrieved_docs),
+                                             mean_vector(chunk_vectors), started_at, use_cache)
+        yield 'generate', draft_stream
+
+        draft = draft_stream.text()
+        if not draft or draft.startswith("[ERROR]"):
+            tracing.warn("[WARN] Skipping review because the draft could not be generated.")
+            trace.finish(review_skipped=True)
+            return
+        retrieved_comments = comments_future.result()[0]
+    tracing.info(f"--- [INFO] Retrieved {len(retrieved_comments)} similar review comments. ---")
+    # 雛形のベクトルはないため、応答キャッシュはプロンプトの完全一致でのみ参照する
+    with tracing.activate(trace):
+        review_stream = invoke_llm_cached('review', make_review_prompt(draft, retrieved_comments), None,
+                                          time.perf_counter(), use_cache, trace)
+    yield 'review', review_stream
+
+def build_prompts(kind: str, texts: list, chunk_vectors: list, store) -> list:
+    """
+    ベクトル化済みの複数の入力について、類似する過去のデータを1回の問い合わせで検索し、MCPプロンプトを構築する。
+
+    Args:
+        kind (str): 'generate' または 'review'。
+        chunk_vectors (list): 入力ごとのチャンクのベクトルのリスト (get_chunk_embeddings_local の結果)。
+    """
+    if kind == 'generate':
+        retrieved = query_db_batch(chunk_vectors, store, texts=texts)
+        return [make_generate_prompt(text, docs) for text, docs in zip(texts, retrieved)]
+    retrieved = query_review_comments_batch(chunk_vectors, store, texts=texts)
+    return [make_review_prompt(text, comments) for text, comments in zip(texts, retrieved)]
+
+def run_batch(kind: str, texts: list, max_workers: int = None, use_cache: bool = True) -> list:
+    """
+    複数の入力をまとめて処理する。
+    全入力のベクトル化は1回のencode呼び出し (Bedrockの場合は並行した呼び出し)、検索は1回の複数クエリで行い、
+    LLMの呼び出しは最大 max_workers 件まで並行して行う。
+
+    Args:
+        kind (str): 'generate' (仕様書からリリースノートを生成) または 'review' (リリースノートをレビュー)。
+        texts (list): 入力テキストのリスト。
+        max_workers (int): LLMを並行して呼び出す最大数。省略時は config.BATCH_LLM_CONCURRENCY。
+
+    Returns:
+        list: textsと同じ順序の結果。各要素は 'output', 'error', 'time_to_first_token', 'llm_time', 'prompt_tokens' を持つdict。
+    """
+    if kind not in ('generate', 'review'):
+        raise ValueError(f"Invalid batch kind: {kind}")
+
+    tracing.info(f"[START] Batch {kind} process for {len(texts)} inputs (Environment: {config.ENVIRONMENT})")
+    with tracing.trace('batch', kind=kind, inputs=len(texts)) as trace:
+        embedding_model, store = _retrieval_resources()
+
+        # 1. 全入力の全チャンクをまとめてベクトル化
+        started_at = time.perf_counter()
+        chunk_vectors = get_chunk_embeddings_local(texts, embedding_model)
+        vectors = [mean_vector(chunks) for chunks in chunk_vectors]
+        embed_time = time.perf_counter() - started_at
+
+        # 2. 全入力の類似ドキュメントを1回の問い合わせで検索し、プロンプトを構築
+        started_at = time.perf_counter()
+        prompts = build_prompts(kind, texts, chunk_vectors, store)
+        query_time = time.perf_counter() - started_at
+        tracing.info(f"--- [INFO] Embedded in {embed_time:.2f}s, retrieved in {query_time:.2f}s. ---")
+
+        # 3. LLMの呼び出しを並行数を制限して実行
+        def invoke(args):
+            prompt, vector = args
+            stream = invoke_llm_cached(kind, prompt, vector, time.perf_counter(), use_cache)
+            try:
+                output = stream.text()
+            except Exception as e:
+                return {"output": None, "error": str(e), "time_to_first_token": None, "llm_time": None,
+                        "prompt_tokens": None}
+            error = output if output.startswith("[ERROR]") else None
+            return {
+                "output": None if error else output,
+                "error": error,
+                "time_to_first_token": stream.time_to_first_token,
+                "llm_time": stream.total_time,
+                "prompt_tokens": stream.prompt_stats['tokens'] if stream.prompt_stats else None,
+            }
+
+        from concurrent.futures import ThreadPoolExecutor  # batch でだけ使うため、起動時には読み込まない
+        with ThreadPoolExecutor(max_workers=max_workers or config.BATCH_LLM_CONCURRENCY) as executor:
+            results = list(executor.map(tracing.bind(invoke), zip(prompts, vectors)))
+
+        trace.set(succeeded=sum(1 for result in results if result['error'] is None))
+    tracing.info(f"\n[SUCCESS] Batch {kind} process finished. "
+                 f"({sum(1 for result in results if result['error'] is None)}/{len(results)} succeeded)")
+    return results
+
+# --- API Gateway (Lambda) ---
+
+# リクエストのJSONで入力テキストを受け取るキー ('text' はどちらの処理でも使える)
+REQUEST_TEXT_KEYS = {'generate': ('text', 'design_doc'), 'review': ('text', 'release_note')}
+
+def request_text(kind: str, payload: dict) -> str:
+    """リクエストのJSONから入力テキストを取り出す。見つからない場合はValueErrorを送出する。"""
+    for key in REQUEST_TEXT_KEYS[kind]:
+        text = payload.get(key) if isinstance(payload, dict) else None
+        if isinstance(text, str) and text.strip():
+            return text
+    raise ValueError(f"Request body must contain one of: {', '.join(REQUEST_TEXT_KEYS[kind])}")
+
+def _lambda_response(status: int, body: dict) -> dict:
+    return {
+        "statusCode": status,
+        "headers": {"Content-Type": "application/json; charset=utf-8"},
+        "body": json.dumps(body, ensure_ascii=False),
+    }
+
+def lambda_handler(event: dict, context=None) -> dict:
+    """
+    API Gateway (Lambdaプロキシ統合) のリクエストを処理する。
+    POST /generate は仕様書からリリースノートの雛形を生成し、POST /review はリリースノートをレビューする。
+    """
+    path = (event.get('path') or event.get('rawPath') or '').rstrip('/')
+    kind = path.rsplit('/', 1)[-1]
+    if kind not in REQUEST_TEXT_KEYS:
+        return _lambda_response(404, {"error": f"Unknown path: {path}"})
+    try:
+        body = event.get('body') or '{}'
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body).decode('utf-8')
+        text = request_text(kind, json.loads(body))
+    except ValueError as e:
+        return _lambda_response(400, {"error": str(e)})
+
+    try:
+        if kind == 'generate':
+            output = generate_release_note_draft(text)
+        else:
+            output = review_release_note(text)
+    except Exception as e:
+        # 設定の誤り (ValueError) やベクトルストア・Bedrockの障害も、Lambdaの実行エラーではなく 500 として返す
+        tracing.error(f"[ERROR] Failed to process {kind} request: {e}")
+        return _lambda_response(500, {"error": str(e)})
+    if output.startswith("[ERROR]"):
+        return _lambda_response(502, {"error": output})
+    return _lambda_response(200, {"output": output})
+
 if __name__ == '__main__':
     # --- テスト用の仕様書データ ---
     sample_design_doc = """
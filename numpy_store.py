@@ -0,0 +1,466 @@
+"""
+プロセス内のNumPy行列によるローカル用の軽量なベクトルストア (VECTOR_STORE_BACKEND=numpy)。
+
+ベクトルは正規化してメモリマップした .npy のスナップショットに保存し、検索はブロックごとの行列積で行う。
+スナップショットは世代ごとのディレクトリに書き出し、CURRENT ファイルを差し替えて切り替えるため、
+書き出し中も他のプロセスは元のスナップショットを読み続けられる。
+"""
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import config
+import tracing
+from vector_store import VectorStore
+
+
+def _where_mask(columns, where: dict, count: int):
+    """ChromaDB形式の条件から、各行が一致するかどうかのbool配列を作る。columnsは key -> (codes, vocab)。"""
+    mask = np.ones(count, dtype=bool)
+    for key, condition in (where or {}).items():
+        if isinstance(condition, dict):
+            (operator, value), = condition.items()
+        else:
+            operator, value = '$eq', condition
+        if operator == '$eq':
+            values = [value]
+        elif operator == '$in':
+            values = list(value)
+        else:
+            raise ValueError(f"Unsupported where operator: {operator}")
+        if key not in columns:
+            return np.zeros(count, dtype=bool)
+        codes, vocab = columns[key]
+        lookup = vocab.index
+        wanted = [lookup[v] for v in values if v in lookup]
+        mask &= np.isin(codes, np.asarray(wanted, dtype=np.int32))
+    return mask
+
+
+def _matches(metadata: dict, key: str, condition: dict) -> bool:
+    """1行のメタデータが、ChromaDB形式の1つの条件 ({'$eq': 値} または {'$in': [値, ...]}) に一致するかどうかを返す。"""
+    (operator, value), = condition.items()
+    if key not in metadata:
+        return False
+    return metadata[key] == value if operator == '$eq' else metadata[key] in value
+
+
+class _Vocabulary:
+    """
+    メタデータの列の値の一覧。スナップショットから開いた場合は、初めて参照された時点でファイルから読み込む
+    (content_hash のように値の種類が多い列があっても、開く時間が増えないようにするため)。
+    """
+
+    def __init__(self, values: list = None, path: str = None):
+        self._values = values
+        self._path = path
+        self._index = None
+
+    @property
+    def values(self) -> list:
+        if self._values is None:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                self._values = json.load(f)
+        return self._values
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            self._index = {value: code for code, value in enumerate(self.values)}
+        return self._index
+
+
+QUANTIZATION_MODES = ('none', 'int8', 'binary')
+
+
+def quantize(vectors, quantization: str):
+    """
+    正規化済みのベクトルの行列を量子化する。
+
+    - int8: 次元ごとに最大の絶対値が127になるよう縮尺して丸める (メモリ1/4)。
+    - binary: 各次元の符号だけを1ビットで持つ (メモリ1/32)。
+
+    Returns:
+        tuple: (コードの行列, int8の場合は次元ごとの縮尺。それ以外はNone)
+    """
+    if quantization == 'int8':
+        scale = np.abs(vectors).max(axis=0) / 127.0 if len(vectors) else np.ones(vectors.shape[1], dtype=np.float32)
+        scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+        return np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8), scale
+    if quantization == 'binary':
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unsupported quantization: {quantization}")
+
+
+class _Snapshot:
+    """
+    NumpyVectorStore の読み取り専用のデータ。
+
+    - vectors: 正規化済みのベクトルの行列 (N x 次元数。float32 または float16)
+    - codes / scale: 量子化したベクトル (quantization が 'int8' または 'binary' の場合)。
+      検索の一次選別はコードで行い、上位の候補だけを vectors で計算し直す。
+    - ids: idの配列
+    - documents: 本文をUTF-8で連結したバイト列と、各行の開始位置 (doc_offsets)
+    - columns: メタデータのキーごとの (コードの配列, 値の一覧)。値がない行のコードは -1。
+    """
+
+    def __init__(self, vectors, ids, doc_offsets, doc_blob, columns: dict,
+                 quantization: str = 'none', codes=None, scale=None):
+        self.vectors = vectors
+        self.ids = ids
+        self.doc_offsets = doc_offsets
+        self.doc_blob = doc_blob
+        self.columns = columns
+        self.quantization = quantization
+        self.codes = codes
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows: dict, dtype: str, quantization: str = 'none'):
+        """id -> (ベクトル, 本文, メタデータ) の辞書からスナップショットを作る。"""
+        ids = list(rows)
+        if ids:
+            vectors = np.stack([rows[item_id][0] for item_id in ids]).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        codes = scale = None
+        if quantization != 'none':
+            codes, scale = quantize(vectors, quantization)
+        encoded = [rows[item_id][1].encode('utf-8') for item_id in ids]
+        doc_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=doc_offsets[1:])
+        doc_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        keys = sorted({key for item_id in ids for key in rows[item_id][2]})
+        columns = {}
+        for key in keys:
+            vocab = {}
+            codes_column = np.full(len(ids), -1, dtype=np.int32)
+            for i, item_id in enumerate(ids):
+                metadata = rows[item_id][2]
+                if key in metadata:
+                    codes_column[i] = vocab.setdefault(metadata[key], len(vocab))
+            columns[key] = (codes_column, _Vocabulary(list(vocab)))
+        return cls(vectors.astype(dtype), np.array(ids, dtype=str), doc_offsets, doc_blob, columns,
+                   quantization, codes, scale)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'vectors.npy'), self.vectors)
+        if self.codes is not None:
+            np.save(os.path.join(directory, 'codes.npy'), self.codes)
+        if self.scale is not None:
+            np.save(os.path.join(directory, 'scale.npy'), self.scale)
+        np.save(os.path.join(directory, 'ids.npy'), self.ids)
+        np.save(os.path.join(directory, 'doc_offsets.npy'), self.doc_offsets)
+        np.save(os.path.join(directory, 'documents.npy'), self.doc_blob)
+        keys = list(self.columns)
+        for i, key in enumerate(keys):
+            codes, vocab = self.columns[key]
+            np.save(os.path.join(directory, f'column_{i}.npy'), codes)
+            with open(os.path.join(directory, f'column_{i}.json'), 'w', encoding='utf-8') as f:
+                json.dump(vocab.values, f, ensure_ascii=False)
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({"count": len(self), "columns": keys, "quantization": self.quantization}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str):
+        """スナップショットをメモリマップで開く。データは参照された時点でページ単位に読み込まれる。"""
+        def load_array(name):
+            return np.load(os.path.join(directory, name), mmap_mode='r')
+
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        columns = {}
+        for i, key in enumerate(meta['columns']):
+            columns[key] = (load_array(f'column_{i}.npy'), _Vocabulary(path=os.path.join(directory, f'column_{i}.json')))
+        quantization = meta.get('quantization', 'none')
+        codes = load_array('codes.npy') if quantization != 'none' else None
+        scale = np.load(os.path.join(directory, 'scale.npy')) if quantization == 'int8' else None
+        return cls(load_array('vectors.npy'), load_array('ids.npy'), load_array('doc_offsets.npy'),
+                   load_array('documents.npy'), columns, quantization, codes, scale)
+
+    def document(self, i: int) -> str:
+        return bytes(self.doc_blob[self.doc_offsets[i]:self.doc_offsets[i + 1]]).decode('utf-8')
+
+    def metadata(self, i: int) -> dict:
+        metadata = {}
+        for key, (codes, vocab) in self.columns.items():
+            code = codes[i]
+            if code >= 0:
+                metadata[key] = vocab.values[code]
+        return metadata
+
+    def mask(self, where: dict):
+        return _where_mask(self.columns, where, len(self))
+
+    def _score(self, queries, selection):
+        """selection (スライスまたは行番号の配列) の行とクエリの類似度を計算する。量子化されていればコードで近似する。"""
+        if self.quantization == 'int8':
+            return (queries * self.scale) @ self.codes[selection].astype(np.float32).T
+        if self.quantization == 'binary':
+            signs = np.unpackbits(self.codes[selection], axis=1, count=queries.shape[1]).astype(np.float32) * 2 - 1
+            return queries @ signs.T
+        return queries @ self.vectors[selection].astype(np.float32, copy=False).T
+
+    def search(self, query_embeddings, n_results: int, where: dict = None, block_size: int = 65536,
+               rerank_factor: int = None) -> list:
+        """
+        全クエリをまとめた行列積で類似度を計算し、クエリごとに上位n_results件の (行番号, コサイン距離) を返す。
+        whereの条件に一致しない行は計算の前に除く。
+        量子化されている場合は、コードで n_results * rerank_factor 件の候補を選び、
+        候補だけを元の精度のベクトルで計算し直して上位n_results件を返す。
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        if not len(self) or not len(queries):
+            return [[] for _ in range(len(queries))]
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12
+        rows = np.flatnonzero(self.mask(where)) if where else None
+        candidate_count = len(self) if rows is None else len(rows)
+        k = min(n_results, candidate_count)
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        quantized = self.quantization != 'none'
+        if quantized:
+            rerank_factor = config.QUANTIZATION_RERANK_FACTOR if rerank_factor is None else rerank_factor
+            first_k = min(k * max(rerank_factor, 1), candidate_count)
+            # コードはfloat32に展開してから計算するため、ブロックを小さくして一時メモリを抑える
+            block_size = min(block_size, 8192)
+        else:
+            first_k = k
+
+        # 大きな行列は行のブロックごとに計算し、各ブロックの上位first_k件だけを残す
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, candidate_count, block_size):
+            if rows is None:
+                block_rows = np.arange(start, min(start + block_size, candidate_count))
+                selection = slice(start, start + block_size)
+            else:
+                block_rows = selection = rows[start:start + block_size]
+            scores = np.concatenate([best_scores, self._score(queries, selection)], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block_rows, (len(queries), len(block_rows)))], axis=1)
+            if scores.shape[1] > first_k:
+                top = np.argpartition(-scores, first_k - 1, axis=1)[:, :first_k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                candidates = np.take_along_axis(candidates, top, axis=1)
+            best_scores, best_rows = scores, candidates
+
+        if quantized:
+            # 候補の行だけを元の精度で読み込み (メモリマップの場合、該当するページだけが読まれる)、計算し直す
+            unique_rows, inverse = np.unique(best_rows, return_inverse=True)
+            exact = self.vectors[unique_rows].astype(np.float32) @ queries.T
+            best_scores = exact[inverse.reshape(best_rows.shape), np.arange(len(queries))[:, None]]
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(int(row), float(1.0 - score)) for row, score in zip(query_rows, query_scores)]
+            for query_rows, query_scores in zip(best_rows, best_scores)
+        ]
+
+    def index_nbytes(self) -> int:
+        """一次選別で全件を走査するデータ (コード、量子化しない場合はベクトル) のバイト数。"""
+        return int((self.codes if self.codes is not None else self.vectors).nbytes)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    NumPyの行列によるプロセス内のベクトルストア。ローカル環境で、ChromaDBより軽量・高速に検索するために使う。
+
+    - ベクトルは正規化して連続したfloat32 (またはfloat16) の行列に格納し、類似度はコサイン類似度で計算する。
+    - メタデータ (content_type, ticket_id, context_line など) はキーごとのコードの配列として持ち、
+      whereの条件は行列積の前にbool配列で絞り込む。
+    - データは .npy のスナップショットとして保存し、メモリマップで開く (開くのは一瞬で、
+      複数のワーカープロセスから開いた場合もOSのページキャッシュが共有される)。
+    - upsert/delete はメモリ上で反映し、flush() で新しいスナップショットとして書き出す。
+      書き出しは世代ごとのディレクトリに行い、CURRENTファイルを置き換えて切り替えるため、
+      読み込み中の他のプロセスが壊れたデータを見ることはない。
+
+    Args:
+        path (str): スナップショットを保存するディレクトリ。
+        dtype (str): ベクトルの型 ('float32' または 'float16')。
+        quantization (str): 一次選別に使う量子化 ('none'、'int8' または 'binary')。
+            新しく書き出すスナップショットに適用する。既存のスナップショットは作成時の設定のまま読み込む。
+    """
+
+    def __init__(self, path: str = None, dtype: str = None, quantization: str = None):
+        self.path = path or config.NUMPY_INDEX_PATH
+        self.dtype = dtype or config.NUMPY_INDEX_DTYPE
+        self.quantization = quantization or config.VECTOR_QUANTIZATION
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization: {self.quantization}")
+        self._lock = threading.Lock()
+        # 変更中のデータ (id -> (ベクトル, 本文, メタデータ))。未変更の場合はNone
+        self._rows = None
+        # 変更中のデータのメタデータの索引 (キー -> 値 -> idの集合)。iter_metadata で絞り込んだキーだけを作る
+        self._row_index = {}
+        self._snapshot = self._load()
+
+    def _current_path(self) -> str:
+        return os.path.join(self.path, 'CURRENT')
+
+    def _load(self) -> _Snapshot:
+        if not os.path.exists(self._current_path()):
+            return _Snapshot.from_rows({}, self.dtype, self.quantization)
+        with open(self._current_path(), 'r', encoding='utf-8') as f:
+            generation = f.read().strip()
+        return _Snapshot.load(os.path.join(self.path, generation))
+
+    def _writable_rows(self) -> dict:
+        """変更用に、スナップショットの内容を id -> (ベクトル, 本文, メタデータ) の辞書に展開する。"""
+        if self._rows is None:
+            snapshot = self._snapshot
+            self._rows = {
+                str(snapshot.ids[i]): (np.asarray(snapshot.vectors[i], dtype=np.float32),
+                                       snapshot.document(i), snapshot.metadata(i))
+                for i in range(len(snapshot))
+            }
+        return self._rows
+
+    def _index_rows(self, item_id: str, metadata: dict, add: bool):
+        for key, values in self._row_index.items():
+            if key in metadata:
+                ids = values.setdefault(metadata[key], set())
+                if add:
+                    ids.add(item_id)
+                else:
+                    ids.discard(item_id)
+
+    def _dirty_rows(self, where: dict):
+        """
+        変更中でスナップショットを作り直していない場合は、whereに一致する (id, (ベクトル, 本文, メタデータ)) のリストを返す。
+        それ以外はNone。スナップショットを作り直すのは検索 (query) と flush の時だけにし、
+        インポートのバッチごとの差分確認 (iter_metadata) で全件を作り直さないようにする。
+        """
+        with self._lock:
+            if self._rows is None or self._snapshot is not None:
+                return None
+            conditions = [
+                (key, condition if isinstance(condition, dict) else {'$eq': condition})
+                for key, condition in (where or {}).items()
+            ]
+            for _, condition in conditions:
+                (operator, _), = condition.items()
+                if operator not in ('$eq', '$in'):
+                    raise ValueError(f"Unsupported where operator: {operator}")
+            if not conditions:
+                return list(self._rows.items())
+            # 最初の条件は索引で候補を絞り、残りの条件は候補ごとに確認する
+            key, condition = conditions[0]
+            if key not in self._row_index:
+                values = self._row_index[key] = {}
+                for item_id, (_, _, metadata) in self._rows.items():
+                    if key in metadata:
+                        values.setdefault(metadata[key], set()).add(item_id)
+            (operator, value), = condition.items()
+            wanted = [value] if operator == '$eq' else list(value)
+            candidates = set().union(*(self._row_index[key].get(v, ()) for v in wanted))
+            return [
+                (item_id, self._rows[item_id]) for item_id in sorted(candidates)
+                if all(_matches(self._rows[item_id][2], other, cond) for other, cond in conditions[1:])
+            ]
+
+    def _current(self) -> _Snapshot:
+        """検索用のスナップショットを返す。変更があれば、メモリ上で作り直す。"""
+        with self._lock:
+            if self._rows is not None and self._snapshot is None:
+                self._snapshot = _Snapshot.from_rows(self._rows, self.dtype, self.quantization)
+            return self._snapshot
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        with self._lock:
+            rows = self._writable_rows()
+            for item_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+                if item_id in rows:
+                    self._index_rows(item_id, rows[item_id][2], add=False)
+                rows[item_id] = (np.asarray(embedding, dtype=np.float32), document, dict(metadata))
+                self._index_rows(item_id, metadata, add=True)
+            self._snapshot = None
+
+    def delete(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            rows = self._writable_rows()
+            for item_id in ids:
+                row = rows.pop(item_id, None)
+                if row is not None:
+                    self._index_rows(item_id, row[2], add=False)
+            self._snapshot = None
+
+    def iter_metadata(self, where=None, batch_size=1000):
+        rows = self._dirty_rows(where)
+        if rows is not None:
+            for item_id, (_, _, metadata) in rows:
+                yield item_id, dict(metadata)
+            return
+        snapshot = self._current()
+        for i in np.flatnonzero(snapshot.mask(where)):
+            yield str(snapshot.ids[i]), snapshot.metadata(i)
+
+    def iter_items(self, where=None, batch_size=1000):
+        rows = self._dirty_rows(where)
+        if rows is not None:
+            for item_id, (vector, document, metadata) in rows:
+                # スナップショットと同じく正規化したベクトルを返す
+                yield item_id, vector / (np.linalg.norm(vector) + 1e-12), document, dict(metadata)
+            return
+        snapshot = self._current()
+        for i in np.flatnonzero(snapshot.mask(where)):
+            yield (str(snapshot.ids[i]), np.asarray(snapshot.vectors[i], dtype=np.float32),
+                   snapshot.document(i), snapshot.metadata(i))
+
+    def query(self, query_embeddings, n_results, where=None):
+        snapshot = self._current()
+        return [
+            [{"id": str(snapshot.ids[row]), "document": snapshot.document(row),
+              "metadata": snapshot.metadata(row), "distance": distance}
+             for row, distance in hits]
+            for hits in snapshot.search(query_embeddings, n_results, where)
+        ]
+
+    def count(self):
+        with self._lock:
+            if self._rows is not None and self._snapshot is None:
+                return len(self._rows)
+        return len(self._current())
+
+    def flush(self):
+        """変更を新しい世代のスナップショットとして書き出し、切り替える。"""
+        snapshot = self._current()
+        with self._lock:
+            if self._rows is None:
+                return
+            generation = 1
+            if os.path.exists(self._current_path()):
+                with open(self._current_path(), 'r', encoding='utf-8') as f:
+                    generation = int(f.read().strip().split('-')[-1]) + 1
+            name = f"gen-{generation:06d}"
+            snapshot.save(os.path.join(self.path, name))
+            tmp_path = self._current_path() + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(name)
+            os.replace(tmp_path, self._current_path())
+            # 古い世代を削除する (メモリマップ中のプロセスは、削除後も開いたファイルを読み続けられる)
+            for entry in os.listdir(self.path):
+                if entry.startswith('gen-') and entry != name:
+                    shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+            self._rows = None
+            self._row_index = {}
+            self._snapshot = _Snapshot.load(os.path.join(self.path, name))
+        tracing.info(f"[INFO] Saved vector index snapshot ({len(snapshot)} items) to {os.path.join(self.path, name)}")
+
+    def close(self):
+        self.flush()
+
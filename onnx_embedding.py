@@ -0,0 +1,126 @@
+"""
+ONNX Runtimeによるローカルの Embedding モデル (EMBEDDING_BACKEND=onnx)。
+
+SentenceTransformer と同じく、トークナイズ → Transformer → アテンションマスクを考慮した平均プーリング → L2正規化
+を行い、同じ encode(texts) のインターフェースでベクトルを返す。PyTorchを使わないため、読み込みが速く、
+Lambdaなどのパッケージも小さくなる。onnxruntime と tokenizers が必要 (int8量子化を行う場合は onnx も必要)。
+"""
+import os
+import numpy as np
+import config
+import tracing
+
+# Hugging Face Hub のモデルのリポジトリ内で、ONNXモデルとトークナイザーを探すパス
+_MODEL_FILES = ('model.onnx', 'onnx/model.onnx')
+_TOKENIZER_FILE = 'tokenizer.json'
+
+
+class OnnxEmbeddingModel:
+    """
+    ONNX Runtimeのセッションとトークナイザーで、テキストを正規化したベクトルに変換する。
+
+    Args:
+        session: onnxruntime.InferenceSession (run と get_inputs を持つオブジェクト)。
+        tokenizer: tokenizers.Tokenizer。
+        max_seq_length (int): 1件の入力の最大トークン数。超える部分は切り捨てる。
+    """
+
+    def __init__(self, session, tokenizer, max_seq_length: int = None):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length or config.EMBEDDING_MAX_SEQ_LENGTH
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding()  # バッチ内で最長の入力に合わせる
+        self._input_names = {model_input.name for model_input in session.get_inputs()}
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        """テキスト (またはテキストのリスト) をベクトル (ndarray) に変換する。"""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+        # SentenceTransformer と同じく、長さの近い入力をまとめてパディングを減らし、結果は元の順序で返す
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        vectors = np.zeros((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            batch = self._encode_batch([texts[i] for i in indexes])
+            if vectors.shape[1] == 0:
+                vectors = np.zeros((len(texts), batch.shape[1]), dtype=np.float32)
+            vectors[indexes] = batch
+        return vectors
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            'attention_mask': np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        outputs = self.session.run(None, {name: value for name, value in feeds.items() if name in self._input_names})
+        hidden = outputs[0]
+        if hidden.ndim == 3:
+            # パディングのトークンを除いて平均する
+            mask = feeds['attention_mask'][:, :, None].astype(np.float32)
+            hidden = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return hidden / np.maximum(np.linalg.norm(hidden, axis=1, keepdims=True), 1e-12)
+
+
+def _resolve_files(model_dir: str = None) -> tuple:
+    """(ONNXモデルのパス, tokenizer.json のパス) を返す。model_dir がない場合はHugging Face Hubから取得する。"""
+    if model_dir:
+        model_path = next((os.path.join(model_dir, name) for name in _MODEL_FILES
+                           if os.path.exists(os.path.join(model_dir, name))), None)
+        if model_path is None:
+            raise FileNotFoundError(f"No model.onnx found in ONNX_MODEL_DIR: {model_dir}")
+        return model_path, os.path.join(model_dir, _TOKENIZER_FILE)
+    from huggingface_hub import hf_hub_download
+    model_path = hf_hub_download(config.LOCAL_EMBEDDING_MODEL, 'onnx/model.onnx')
+    return model_path, hf_hub_download(config.LOCAL_EMBEDDING_MODEL, _TOKENIZER_FILE)
+
+
+def quantize_int8(model_path: str, cache_dir: str = None) -> str:
+    """
+    ONNXモデルの重みをint8に動的量子化し、量子化したモデルのパスを返す。
+    量子化したモデルは cache_dir に保存し、2回目以降はそれを使う。
+    """
+    cache_dir = cache_dir or config.ONNX_CACHE_DIR
+    stat = os.stat(model_path)
+    name = config.LOCAL_EMBEDDING_MODEL.replace('/', '__')
+    output_path = os.path.join(cache_dir, f"{name}.{stat.st_size}.int8.onnx")
+    if not os.path.exists(output_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        os.makedirs(cache_dir, exist_ok=True)
+        tracing.info(f"[INFO] Quantizing ONNX model to int8: {output_path}")
+        temporary_path = output_path + '.tmp'
+        quantize_dynamic(model_path, temporary_path, weight_type=QuantType.QInt8)
+        os.replace(temporary_path, output_path)
+    return output_path
+
+
+def load_onnx_model(model_dir: str = None, quantization: str = None, intra_op_threads: int = None,
+                    max_seq_length: int = None) -> OnnxEmbeddingModel:
+    """
+    config の設定 (引数で上書きできる) に従ってONNXモデルを読み込む。
+
+    Args:
+        model_dir (str): model.onnx と tokenizer.json を置いたディレクトリ。省略時は config.ONNX_MODEL_DIR。
+        quantization (str): 'none' または 'int8'。省略時は config.ONNX_QUANTIZATION。
+        intra_op_threads (int): 推論に使うスレッド数。0の場合はONNX Runtimeの既定値。
+        max_seq_length (int): 1件の入力の最大トークン数。
+    """
+    import onnxruntime
+    from tokenizers import Tokenizer
+
+    quantization = quantization or config.ONNX_QUANTIZATION
+    if quantization not in ('none', 'int8'):
+        raise ValueError(f"Invalid ONNX_QUANTIZATION setting: {quantization}")
+    intra_op_threads = config.ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+
+    model_path, tokenizer_path = _resolve_files(model_dir or config.ONNX_MODEL_DIR)
+    if quantization == 'int8':
+        model_path = quantize_int8(model_path)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+    return OnnxEmbeddingModel(session, Tokenizer.from_file(tokenizer_path), max_seq_length)
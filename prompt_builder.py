@@ -0,0 +1,132 @@
+"""
+MCPプロンプトを、LLMのトークン予算に収まるコンパクトな文字列に組み立てる。
+
+検索結果 (retrieved_context) は空の値を除いた1行のJSONにし、空・重複した項目は含めない。
+指示とユーザー入力を優先し、残りの予算に収まる分だけ検索結果を順位順に追加する。
+トークン数はモデルのトークナイザーを使わずに文字種から概算する
+(日本語の文字は1文字1トークン、それ以外は4文字1トークン)。
+"""
+import json
+import math
+import config
+import tracing
+
+_TRUNCATED_MARKER = "\n...(truncated)"
+_CLOSING = "Please generate the release note based on the above information."
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算する。ASCII以外の文字 (日本語など) は1文字1トークン、ASCIIは4文字1トークンとする。"""
+    ascii_count = sum(1 for ch in text if ch < '\x80')
+    return (len(text) - ascii_count) + math.ceil(ascii_count / 4)
+
+
+def token_budget(model_id: str) -> int:
+    """モデルのプロンプトに使えるトークン数 (コンテキスト長から出力用に確保する分を引いたもの) を返す。"""
+    if config.PROMPT_TOKEN_BUDGET > 0:
+        return config.PROMPT_TOKEN_BUDGET
+    context_length = config.PROMPT_CONTEXT_LENGTHS.get(model_id, config.PROMPT_DEFAULT_CONTEXT_LENGTH)
+    return max(context_length - config.PROMPT_RESERVED_OUTPUT_TOKENS, 0)
+
+
+def _prune(value):
+    """空の値 (None, 空文字列, 空のリスト・dict) を再帰的に取り除き、リスト内の重複を除く。"""
+    if isinstance(value, dict):
+        pruned = {key: _prune(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        items = []
+        for item in (_prune(item) for item in value):
+            if item not in (None, "", [], {}) and item not in items:
+                items.append(item)
+        return items
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def render_context(content) -> str:
+    """検索結果の1項目を、空の値を除いた1行のJSONにする。空になった場合は空文字列を返す。"""
+    pruned = _prune(content)
+    if pruned in (None, "", [], {}):
+        return ""
+    return json.dumps(pruned, ensure_ascii=False, separators=(',', ':'))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """テキストを max_tokens トークン以下に収まるよう末尾を切り詰める。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(_TRUNCATED_MARKER)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + _TRUNCATED_MARKER
+
+
+def build_prompt(prompt: dict, model_id: str = None) -> tuple:
+    """
+    MCPプロンプトを、モデルのトークン予算に収まる文字列に変換する。
+
+    Args:
+        prompt (dict): make_generate_prompt / make_review_prompt で構築したMCPプロンプト。
+        model_id (str): 予算を決めるLLMのモデルID。省略時は config.PROMPT_DEFAULT_CONTEXT_LENGTH を使う。
+
+    Returns:
+        tuple: (プロンプト文字列, サイズの情報のdict)。dictは 'chars', 'tokens', 'budget', 'context_items'
+            (含めた検索結果の数), 'dropped_items' (空・重複で除いた数), 'omitted_items' (予算超過で除いた数),
+            'truncated' (ユーザー入力を切り詰めたかどうか) を持つ。
+    """
+    context = prompt['context']
+    budget = token_budget(model_id)
+    header = f"Instructions: {context['instructions'].strip()}\n\n"
+    user_input = context['user_input']['content'].strip()
+
+    # 指示とユーザー入力は必ず含め、収まらない場合はユーザー入力を切り詰める
+    fixed_tokens = estimate_tokens(header + "User Input: \n\n" + _CLOSING)
+    truncated_input = _truncate(user_input, max(budget - fixed_tokens, 0))
+    if truncated_input != user_input:
+        tracing.warn(f"[WARN] User input exceeds the prompt budget ({budget} tokens) and was truncated.")
+    parts = [header, f"User Input: {truncated_input}\n\n"]
+    used_tokens = fixed_tokens + estimate_tokens(truncated_input)
+
+    # 検索結果は順位順に、空・重複を除いて予算に収まる分だけ追加する
+    seen = set()
+    dropped = omitted = 0
+    for item in context['retrieved_context']:
+        rendered = render_context(item['content'])
+        if not rendered or rendered in seen:
+            dropped += 1
+            continue
+        seen.add(rendered)
+        part = f"Retrieved Context {len(seen) - omitted}: {rendered}\n\n"
+        tokens = estimate_tokens(part)
+        if used_tokens + tokens > budget:
+            omitted += 1
+            continue
+        parts.append(part)
+        used_tokens += tokens
+    parts.append(_CLOSING)
+
+    prompt_string = "".join(parts)
+    stats = {
+        "chars": len(prompt_string),
+        "tokens": estimate_tokens(prompt_string),
+        "budget": budget,
+        "context_items": len(seen) - omitted,
+        "dropped_items": dropped,
+        "omitted_items": omitted,
+        "truncated": truncated_input != user_input,
+    }
+    return prompt_string, stats
+
+
+def format_stats(stats: dict) -> str:
+    """プロンプトのサイズの表示用の文字列を返す。"""
+    return (f"--- [INFO] Prompt size: {stats['chars']} chars, ~{stats['tokens']}/{stats['budget']} tokens, "
+            f"{stats['context_items']} context items "
+            f"({stats['dropped_items']} empty/duplicate dropped, {stats['omitted_items']} over budget) ---")
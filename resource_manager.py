@@ -0,0 +1,263 @@
+"""
+プロセス全体で共有する重いリソース（Embeddingモデル、DBクライアント/ベクトルストア、LLMクライアント）を管理する。
+
+各リソースは初回アクセス時に一度だけ生成され、以降の呼び出しでは同じインスタンスを返す。
+生成はスレッドセーフで、複数スレッドから同時にアクセスされても二重にロードされることはない。
+長時間動くプロセスでは warmup() で事前にロードし、終了時に shutdown() で解放する。
+"""
+import os
+import threading
+import config
+import tracing
+
+_lock = threading.RLock()
+_resources = {}
+
+
+def _get_or_create(key, factory):
+    """キーに対応するリソースを返す。未生成であればfactoryで生成して登録する。"""
+    resource = _resources.get(key)
+    if resource is not None:
+        return resource
+    with _lock:
+        # ロック取得待ちの間に他スレッドが生成済みの場合はそれを使う
+        resource = _resources.get(key)
+        if resource is None:
+            resource = factory()
+            _resources[key] = resource
+        return resource
+
+
+def get_embedding_model():
+    """Embeddingモデルを返す (config.EMBEDDING_BACKEND に応じて SentenceTransformer、ONNX Runtime または Bedrock)。"""
+    backend = config.EMBEDDING_BACKEND
+
+    def factory():
+        model_id = config.AWS_BEDROCK_EMBEDDING_MODEL_ID if backend == 'bedrock' else config.LOCAL_EMBEDDING_MODEL
+        tracing.info(f"[INFO] Loading embedding model: {model_id} (backend: {backend})")
+        with tracing.span('model_load', model=model_id, backend=backend):
+            return load()
+
+    def load():
+        if backend == 'onnx':
+            from onnx_embedding import load_onnx_model
+            return load_onnx_model()
+        if backend == 'bedrock':
+            from bedrock import BedrockEmbeddingModel
+            return BedrockEmbeddingModel(get_bedrock_client())
+        if backend == 'sentence_transformers':
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(config.LOCAL_EMBEDDING_MODEL, device='cpu')
+            model.max_seq_length = config.EMBEDDING_MAX_SEQ_LENGTH
+            return model
+        raise ValueError(f"Invalid EMBEDDING_BACKEND setting: {backend}")
+    return _get_or_create(('embedding_model', backend), factory)
+
+
+def get_embedding_scheduler(model=None):
+    """
+    Embeddingモデルのマイクロバッチ・スケジューラーを返す。複数スレッドからの同時の要求を1回の推論にまとめる。
+    スケジューラーはモデルごとに1つ作られる。
+
+    Args:
+        model: encode(texts) を持つEmbeddingモデル。省略時は get_embedding_model()。
+    """
+    if model is None:
+        model = get_embedding_model()
+
+    def factory():
+        from embedding_cache import encode_with_cache
+        from embedding_scheduler import EmbeddingScheduler
+        return EmbeddingScheduler(
+            lambda texts: encode_with_cache(texts, model.encode, config.EMBEDDING_MODEL_ID, get_embedding_cache())
+        )
+    return _get_or_create(('embedding_scheduler', id(model)), factory)
+
+
+def get_db_client():
+    """ローカルのChromaDBクライアントを返す。"""
+    def factory():
+        import chromadb
+        tracing.info(f"[INFO] Initializing ChromaDB at: {config.LOCAL_DB_PATH}")
+        return chromadb.PersistentClient(path=config.LOCAL_DB_PATH)
+    return _get_or_create('db_client', factory)
+
+
+def get_collection(name: str = None, create: bool = False):
+    """
+    ChromaDBのコレクションを返す。
+
+    Args:
+        name (str): コレクション名。省略時は config.LOCAL_DB_COLLECTION_NAME。
+        create (bool): Trueの場合、存在しなければ作成する。
+    """
+    name = name or config.LOCAL_DB_COLLECTION_NAME
+
+    def factory():
+        client = get_db_client()
+        if create:
+            return client.get_or_create_collection(name=name)
+        return client.get_collection(name=name)
+    return _get_or_create(('collection', name), factory)
+
+
+def get_vector_store(name: str = None, create: bool = False):
+    """
+    config.VECTOR_STORE_BACKEND に応じたベクトルストアを返す。
+    pgvectorのコネクションプールもここで保持されるため、Lambdaのウォームスタート時は接続を再利用する。
+
+    Args:
+        name (str): コレクション名 (chroma)、ディレクトリ (numpy) またはテーブル名 (pgvector)。
+        create (bool): Trueの場合、存在しなければ作成する (chroma)。pgvectorでは常に作成する。
+    """
+    backend = config.VECTOR_STORE_BACKEND
+
+    def factory():
+        from vector_store import ChromaVectorStore, PgVectorStore, resolve_pg_dsn
+        if backend == 'chroma':
+            return ChromaVectorStore(get_collection(name, create))
+        if backend == 'numpy':
+            from numpy_store import NumpyVectorStore
+            tracing.info(f"[INFO] Opening NumPy vector index at: {name or config.NUMPY_INDEX_PATH}")
+            return NumpyVectorStore(name)
+        if backend == 'pgvector':
+            tracing.info(f"[INFO] Connecting to PostgreSQL (pgvector) table: {name or config.PG_TABLE_NAME}")
+            return PgVectorStore(resolve_pg_dsn(), table=name)
+        raise ValueError(f"Invalid VECTOR_STORE_BACKEND setting: {backend}")
+    return _get_or_create(('vector_store', backend, name), factory)
+
+
+def review_comment_store_name() -> str:
+    """レビューコメント専用のインデックスの名前 (get_vector_store の name) を返す。"""
+    base = {
+        'chroma': config.LOCAL_DB_COLLECTION_NAME,
+        'numpy': config.NUMPY_INDEX_PATH,
+        'pgvector': config.PG_TABLE_NAME,
+    }.get(config.VECTOR_STORE_BACKEND)
+    if base is None:
+        raise ValueError(f"Invalid VECTOR_STORE_BACKEND setting: {config.VECTOR_STORE_BACKEND}")
+    return base.rstrip('/') + config.REVIEW_COMMENT_INDEX_SUFFIX
+
+
+def get_review_comment_store(create: bool = False):
+    """
+    レビューコメントだけを格納したベクトルストアを返す。無効化されている場合はNone。
+    create が False の場合、インデックスが存在しないか空であれば (db_importer で作成する前) Noneを返す。
+    空でないことを確認したストアは保持し、以降は確認しない。
+    """
+    if not config.REVIEW_COMMENT_INDEX_ENABLED:
+        return None
+    name = review_comment_store_name()
+    if create:
+        return get_vector_store(name, create=True)
+
+    def factory():
+        try:
+            store = get_vector_store(name)
+            if store.count():
+                return store
+        except Exception as e:
+            tracing.warn(f"[WARN] Failed to open the review comment index: {e}")
+        tracing.warn("[WARN] Review comment index is empty. Filtering the main index instead "
+              "(run db_importer.py to build it).")
+        return None
+    return _get_or_create(('review_comment_store', config.VECTOR_STORE_BACKEND, name), factory)
+
+
+def get_lexical_index():
+    """ハイブリッド検索用の文字n-gramの転置インデックスを返す。無効化されている場合はNone。"""
+    if not config.LEXICAL_INDEX_ENABLED:
+        return None
+
+    def factory():
+        from lexical_index import LexicalIndex
+        return LexicalIndex(config.LEXICAL_INDEX_PATH)
+    return _get_or_create('lexical_index', factory)
+
+
+def get_review_comment_lexical_index():
+    """
+    レビューコメント専用のインデックス (近似重複をまとめた代表) に対応する転置インデックスを返す。
+    レビューコメント専用のインデックスか転置インデックスが無効化されている場合はNone。
+    """
+    if not config.REVIEW_COMMENT_INDEX_ENABLED or not config.LEXICAL_INDEX_ENABLED:
+        return None
+
+    def factory():
+        from lexical_index import LexicalIndex
+        root, ext = os.path.splitext(config.LEXICAL_INDEX_PATH)
+        return LexicalIndex(root + config.REVIEW_COMMENT_INDEX_SUFFIX + ext)
+    return _get_or_create('review_comment_lexical_index', factory)
+
+
+def get_embedding_cache():
+    """Embeddingのディスクキャッシュを返す。無効化されている場合はNone。"""
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return None
+
+    def factory():
+        from embedding_cache import EmbeddingCache
+        return EmbeddingCache(config.EMBEDDING_CACHE_PATH, config.EMBEDDING_CACHE_MAX_ENTRIES)
+    return _get_or_create('embedding_cache', factory)
+
+
+def get_response_cache():
+    """LLMの応答キャッシュを返す。無効化されている場合はNone。"""
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+
+    def factory():
+        from response_cache import ResponseCache
+        return ResponseCache(config.RESPONSE_CACHE_PATH)
+    return _get_or_create('response_cache', factory)
+
+
+def get_bedrock_client():
+    """bedrock-runtime のクライアント (Embedding と LLM で共有する) を返す。"""
+    def factory():
+        from bedrock import make_client
+        tracing.info(f"[INFO] Creating Bedrock client (region: {config.AWS_REGION})")
+        return make_client()
+    return _get_or_create('bedrock_client', factory)
+
+
+def get_llm_client():
+    """環境設定に応じたLLMクライアントを返す。"""
+    def factory():
+        if config.LLM_STUB:
+            from stub_llm import StubLLMClient
+            tracing.info("[INFO] Using the stub LLM client (LLM_STUB=true)")
+            return StubLLMClient()
+        if config.ENVIRONMENT == 'aws':
+            return get_bedrock_client()
+        import ollama
+        return ollama.Client()
+    return _get_or_create(('llm_client', config.ENVIRONMENT, config.LLM_STUB), factory)
+
+
+def warmup():
+    """
+    リクエストを受け付ける前に重いリソースを事前にロードする。
+    長時間動くプロセスで、初回リクエストのコールドスタートを避けるために使う。
+    """
+    tracing.info(f"[INFO] Warming up resources (Environment: {config.ENVIRONMENT})")
+    get_embedding_model()
+    get_vector_store()
+    get_review_comment_store()
+    for lexical_index in (get_lexical_index(), get_review_comment_lexical_index()):
+        if lexical_index is not None:
+            lexical_index.load()
+    get_llm_client()
+
+
+def shutdown():
+    """保持しているリソースをすべて解放する。次回アクセス時には再度ロードされる。"""
+    with _lock:
+        for resource in _resources.values():
+            close = getattr(resource, 'close', None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as e:
+                    tracing.warn(f"[WARN] Failed to close resource: {e}")
+        _resources.clear()
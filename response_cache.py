@@ -0,0 +1,179 @@
+"""
+LLMの応答キャッシュ。
+
+2段階で検索する。
+- 完全一致: (処理の種類, モデルID, バージョン, 展開後のプロンプト全体) のハッシュが一致する応答を返す。
+- 意味的な一致: 入力テキストのEmbedding (検索のために計算済みのもの) とのコサイン類似度が
+  しきい値以上の過去の入力があれば、その応答を返す。
+
+エントリには有効期限 (TTL) と件数の上限があり、上限を超えた場合は最も長く参照されていないものから削除する (LRU)。
+バージョンタグ (config.RESPONSE_CACHE_VERSION) を変えると、それ以前のエントリは使われなくなる。
+"""
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import config
+
+
+def make_key(kind: str, model_id: str, version: str, prompt_string: str) -> str:
+    digest = hashlib.sha256()
+    for part in (kind, model_id, version, prompt_string):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLiteを使ったLLM応答キャッシュ。複数スレッドから共有できる。
+
+    Args:
+        path (str): キャッシュファイルのパス。
+        max_entries (int): 保持するエントリ数の上限。
+        ttl_seconds (float): エントリの有効期限 (秒)。
+        similarity_threshold (float): 意味的な一致とみなすコサイン類似度のしきい値。1より大きい値で無効。
+        version (str): プロンプトのテンプレートなどを変えたときに変更するバージョンタグ。
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None, ttl_seconds: float = None,
+                 similarity_threshold: float = None, version: str = None):
+        self.path = path or config.RESPONSE_CACHE_PATH
+        self.max_entries = config.RESPONSE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_seconds = config.RESPONSE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.similarity_threshold = (
+            config.RESPONSE_CACHE_SIMILARITY_THRESHOLD if similarity_threshold is None else similarity_threshold
+        )
+        self.version = version or config.RESPONSE_CACHE_VERSION
+        self._lock = threading.Lock()
+        # 意味的な検索用に、(kind, model_id) ごとのベクトル行列をメモリに保持する
+        self._semantic_index = {}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " model_id TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " query_vector BLOB,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, kind: str, model_id: str, prompt_string: str, query_vector=None):
+        """
+        キャッシュされた応答を返す。完全一致を優先し、なければ意味的に近い入力の応答を探す。
+
+        Returns:
+            tuple: (応答, 'exact' または 'semantic')。見つからない場合は (None, None)。
+        """
+        key = make_key(kind, model_id, self.version, prompt_string)
+        with self._lock:
+            response = self._get_by_key(key)
+            if response is not None:
+                return response, 'exact'
+            if query_vector is None or self.similarity_threshold > 1:
+                return None, None
+            for key in self._find_similar(kind, model_id, query_vector):
+                response = self._get_by_key(key)
+                if response is not None:
+                    return response, 'semantic'
+        return None, None
+
+    def put(self, kind: str, model_id: str, prompt_string: str, response: str, query_vector=None):
+        """応答を保存する。"""
+        key = make_key(kind, model_id, self.version, prompt_string)
+        blob = array.array('f', query_vector).tobytes() if query_vector is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, kind, model_id, version, query_vector, response, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, model_id, self.version, blob, response, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+            self._semantic_index.pop((kind, model_id), None)
+
+    def _get_by_key(self, key: str):
+        row = self._conn.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        now = time.time()
+        if now - created_at > self.ttl_seconds:
+            return None
+        self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return response
+
+    def _find_similar(self, kind: str, model_id: str, query_vector) -> list:
+        """
+        コサイン類似度がしきい値以上で、期限切れでないエントリのキーを近い順に返す。
+        メモリ上の行列は put するまで作り直さないため、期限切れになった行はここで取り除く。
+        """
+        import numpy as np  # 意味的キャッシュを使う場合だけ読み込む (起動を速くするため)
+        index = self._semantic_index.get((kind, model_id))
+        if index is None:
+            rows = self._conn.execute(
+                "SELECT key, query_vector, created_at FROM responses"
+                " WHERE kind = ? AND model_id = ? AND version = ? AND query_vector IS NOT NULL AND created_at >= ?",
+                (kind, model_id, self.version, time.time() - self.ttl_seconds)
+            ).fetchall()
+            if rows:
+                matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in rows])
+                matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            index = ([key for key, _, _ in rows], matrix, np.array([created_at for _, _, created_at in rows]))
+            self._semantic_index[(kind, model_id)] = index
+        keys, matrix, created_at = index
+        expired = created_at < time.time() - self.ttl_seconds
+        if expired.any():
+            keys = [key for key, is_expired in zip(keys, expired) if not is_expired]
+            matrix, created_at = matrix[~expired], created_at[~expired]
+            self._semantic_index[(kind, model_id)] = (keys, matrix, created_at)
+        if not keys:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != matrix.shape[1]:
+            return []
+        similarities = matrix @ (query / (np.linalg.norm(query) + 1e-12))
+        matches = np.flatnonzero(similarities >= self.similarity_threshold)
+        return [keys[i] for i in matches[np.argsort(-similarities[matches], kind='stable')]]
+
+    def _evict(self, now: float):
+        """期限切れのエントリと、上限を超えた分を最終参照時刻の古い順に削除する。"""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._semantic_index.clear()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
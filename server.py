@@ -0,0 +1,382 @@
+"""
+ローカル・オンプレミスで常駐させる非同期HTTPサーバー (cli.py serve)。
+
+Embeddingモデル・ベクトルストアなどは起動時にロードしてプロセス内に保持し、次のエンドポイントを提供する。
+- POST /generate : 仕様書からリリースノートの雛形を生成する
+- POST /review   : リリースノートをレビューする
+- GET  /stats    : エンドポイントごとのレイテンシのパーセンタイルと処理件数
+- GET  /healthz  : 死活監視
+
+リクエストボディはJSON ({"text": ..., "stream": false, "use_cache": true})。
+"stream": true の場合は、LLMの出力を chunked transfer encoding で届いた順に返す。
+
+- 同時に届いたリクエストのベクトル化は、EmbeddingScheduler で1回のencode呼び出しにまとめる。
+- 処理中のリクエストと同じ入力のリクエスト (ストリーミング以外) は、新たに処理せず同じ結果を返す。
+- LLMの同時呼び出し数を制限し、処理待ちのリクエストが上限を超えた場合は 503 を返す (バックプレッシャー)。
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+import config
+import main_logic
+import resource_manager
+import tracing
+from chunker import chunk_text
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+    500: 'Internal Server Error', 501: 'Not Implemented', 502: 'Bad Gateway', 503: 'Service Unavailable',
+}
+_TASK_ROUTES = ('/generate', '/review')
+# ストリーミングで、クライアントに送る前のLLMの出力を溜めておく最大のチャンク数
+STREAM_BUFFER_CHUNKS = 16
+
+
+class HttpError(Exception):
+    """HTTPのエラー応答として返す例外。"""
+
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """昇順にソート済みの値のパーセンタイル (nearest-rank法) を返す。"""
+    if not sorted_values:
+        return None
+    rank = max(int(-(-q * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+class LatencyStats:
+    """エンドポイントごとに直近 window 件のレイテンシを保持し、パーセンタイルを計算する。"""
+
+    def __init__(self, window: int = None):
+        self.window = window or config.SERVER_LATENCY_WINDOW
+        self._latencies = {}
+        self._counts = {}
+
+    def record(self, name: str, seconds: float, status: int):
+        self._latencies.setdefault(name, deque(maxlen=self.window)).append(seconds)
+        counts = self._counts.setdefault(name, {})
+        counts[status] = counts.get(status, 0) + 1
+
+    def summary(self) -> dict:
+        """エンドポイントごとの {count, status, p50, p90, p99, max} (レイテンシはミリ秒) を返す。"""
+        summary = {}
+        for name, latencies in self._latencies.items():
+            values = sorted(latencies)
+            summary[name] = {
+                "count": sum(self._counts[name].values()),
+                "status": {str(status): count for status, count in sorted(self._counts[name].items())},
+                **{f"p{q}": round(percentile(values, q) * 1000, 1) for q in (50, 90, 99)},
+                "max": round(values[-1] * 1000, 1),
+            }
+        return summary
+
+
+async def _iterate_in_thread(iterable, max_buffered: int = STREAM_BUFFER_CHUNKS):
+    """
+    同期的なイテレータをスレッドで読み進め、要素を順に返す非同期イテレータ。
+    スレッドは、まだ返していない要素が max_buffered 件溜まると、返すまで読み進めるのを待つ。
+    途中で閉じた (aclose) 場合はスレッドに読み進めるのをやめさせ、スレッドが終わるまで待つ。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_buffered)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        asyncio.run_coroutine_threadsafe(queue.put((item, error)), loop).result()
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if cancelled.is_set():
+                    break
+                put(item)
+            else:
+                put(done)
+        except Exception as e:
+            put(done, e)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        cancelled.set()
+        # 空きを待っているスレッドが止まらないよう、スレッドが終わるまでキューから取り出し続ける
+        while not producer.done():
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({producer, getter}, return_when=asyncio.FIRST_COMPLETED)
+            getter.cancel()
+
+
+class AssistantServer:
+    """
+    /generate と /review を提供する非同期HTTPサーバー。
+
+    Args:
+        host (str), port (int): 待ち受けるアドレス。port=0 の場合は空いているポートを使う。
+        llm_concurrency (int): LLMを同時に呼び出す最大数。
+        max_queue (int): LLMの順番待ちを許す最大のリクエスト数。
+    """
+
+    def __init__(self, host: str = None, port: int = None, llm_concurrency: int = None, max_queue: int = None):
+        self.host = host or config.SERVER_HOST
+        self.port = config.SERVER_PORT if port is None else port
+        self.llm_concurrency = llm_concurrency or config.SERVER_LLM_CONCURRENCY
+        self.max_queue = config.SERVER_MAX_QUEUE if max_queue is None else max_queue
+        self.stats = LatencyStats()
+        self.coalesced = 0
+        self.rejected = 0
+        self._admitted = 0
+        self._inflight = {}  # (kind, text, use_cache) -> 処理中のリクエストの asyncio.Future
+        self._llm_slots = None
+        self._store = None
+        self._scheduler = None
+        self._server = None
+
+    async def start(self):
+        """リソースをロードして待ち受けを開始する。"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, resource_manager.warmup)
+        self._store = resource_manager.get_vector_store()
+        self._scheduler = resource_manager.get_embedding_scheduler()
+        self._llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"[INFO] Serving on http://{self.host}:{self.port} "
+              f"(LLM concurrency: {self.llm_concurrency}, max queue: {self.max_queue})")
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # --- HTTP ---
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    await self._write_json(writer, e.status, {"error": e.message})
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                await self._dispatch(method, path, body, writer)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > config.SERVER_MAX_BODY_BYTES:
+            raise HttpError(413, f"Request body exceeds {config.SERVER_MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b''
+        return parts[0].upper(), parts[1], headers, body
+
+    @staticmethod
+    async def _write_json(writer, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                "Content-Type: application/json; charset=utf-8",
+                f"Content-Length: {len(data)}"]
+        head.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + data)
+        await writer.drain()
+
+    async def _dispatch(self, method: str, path: str, body: bytes, writer):
+        started_at = time.perf_counter()
+        route = path.split('?', 1)[0].rstrip('/') or '/'
+        status = 500
+        try:
+            if route == '/healthz' and method == 'GET':
+                status = 200
+                await self._write_json(writer, status, {"status": "ok"})
+            elif route == '/stats' and method == 'GET':
+                status = 200
+                await self._write_json(writer, status, self.snapshot())
+            elif route in _TASK_ROUTES:
+                if method != 'POST':
+                    raise HttpError(405, f"Use POST for {route}")
+                status = await self._handle_task(route[1:], body, writer)
+            else:
+                raise HttpError(404, f"Unknown path: {route}")
+        except HttpError as e:
+            status = e.status
+            await self._write_json(writer, e.status, {"error": e.message}, e.headers)
+        finally:
+            if route in _TASK_ROUTES:
+                self.stats.record(route, time.perf_counter() - started_at, status)
+
+    def snapshot(self) -> dict:
+        """/stats で返す統計情報。"""
+        return {
+            "latency_ms": self.stats.summary(),
+            "in_flight": self._admitted,
+            "llm_concurrency": self.llm_concurrency,
+            "max_queue": self.max_queue,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "embedding_batches": self._scheduler.batches if self._scheduler else 0,
+            "embedded_texts": self._scheduler.items if self._scheduler else 0,
+        }
+
+    # --- /generate, /review ---
+
+    def _admit(self):
+        """処理中のリクエストが上限に達している場合は 503 を返す。"""
+        if self._admitted >= self.llm_concurrency + self.max_queue:
+            self.rejected += 1
+            raise HttpError(503, "Server is busy. Retry later.", {"Retry-After": "1"})
+        self._admitted += 1
+
+    def _release(self, _=None):
+        self._admitted -= 1
+
+    async def _handle_task(self, kind: str, body: bytes, writer) -> int:
+        try:
+            payload = json.loads(body or b'{}')
+            text = main_logic.request_text(kind, payload)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        use_cache = payload.get('use_cache', True) is not False
+
+        if payload.get('stream'):
+            self._admit()
+            try:
+                await self._stream_task(kind, text, use_cache, writer)
+            finally:
+                self._release()
+            return 200
+
+        # 同じ入力のリクエストが処理中であれば、その結果を待つ
+        key = (kind, text, use_cache)
+        future = self._inflight.get(key)
+        coalesced = future is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self._admit()
+            future = asyncio.ensure_future(self._run_task(kind, text, use_cache))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            future.add_done_callback(self._release)
+        result = await asyncio.shield(future)
+        await self._write_json(writer, 200, dict(result, coalesced=coalesced))
+        return 200
+
+    async def _prepare(self, kind: str, text: str, use_cache: bool):
+        """入力をチャンクごとにベクトル化 (他のリクエストとまとめて) し、検索・プロンプト構築を行ってLLMの TokenStream を返す。"""
+        started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        # トレースは LLMの出力を返し終えた時点 (TokenStream) で終える。run_in_executor は実行中のトレースを
+        # 引き継がないため、tracing.bind で渡す
+        trace = tracing.start(kind, environment=config.ENVIRONMENT, server=True)
+        with tracing.activate(trace):
+            try:
+                chunks = chunk_text(text)
+                with tracing.span('embed', texts=1, chunks=len(chunks)):
+                    chunk_vectors = await self._scheduler.embed_many_async(chunks)
+                prompts = await loop.run_in_executor(None, tracing.bind(main_logic.build_prompts), kind, [text],
+                                                     [chunk_vectors], self._store)
+                return await loop.run_in_executor(
+                    None, tracing.bind(main_logic.invoke_llm_cached), kind, prompts[0],
+                    main_logic.mean_vector(chunk_vectors), started_at, use_cache, trace
+                )
+            except Exception as e:
+                tracing.error(f"[ERROR] Failed to prepare {kind} request: {e}")
+                trace.finish(error=type(e).__name__)
+                raise HttpError(500, str(e))
+
+    async def _run_task(self, kind: str, text: str, use_cache: bool) -> dict:
+        stream = await self._prepare(kind, text, use_cache)
+        async with self._llm_slots:
+            output = await asyncio.get_running_loop().run_in_executor(None, stream.text)
+        if output.startswith("[ERROR]"):
+            raise HttpError(502, output)
+        return {
+            "output": output,
+            "time_to_first_token": stream.time_to_first_token,
+            "llm_time": stream.total_time,
+            "prompt_tokens": stream.prompt_stats['tokens'] if stream.prompt_stats else None,
+        }
+
+    async def _stream_task(self, kind: str, text: str, use_cache: bool, writer):
+        stream = await self._prepare(kind, text, use_cache)
+        # LLMの出力を読み進めるスレッドが終わるまで、LLMの同時呼び出し数の枠を保持する
+        async with self._llm_slots:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+            chunks = _iterate_in_thread(stream)
+            try:
+                async for chunk in chunks:
+                    data = chunk.encode('utf-8')
+                    writer.write(f"{len(data):X}\r\n".encode('latin-1') + data + b"\r\n")
+                    await writer.drain()
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            except ConnectionError:
+                tracing.warn(f"[WARN] Client disconnected during {kind} stream.")
+                raise
+            except Exception as e:
+                # ヘッダーを送った後はエラーをJSONで返せないため、接続を閉じて応答が途中で終わったことを伝える
+                tracing.error(f"[ERROR] Failed to stream {kind} response: {e}")
+                raise ConnectionAbortedError(str(e)) from e
+            finally:
+                await chunks.aclose()
+
+
+def run_server(host: str = None, port: int = None, llm_concurrency: int = None, max_queue: int = None):
+    """サーバーを起動し、Ctrl+C で停止するまでリクエストを処理する。"""
+    async def serve():
+        server = AssistantServer(host, port, llm_concurrency, max_queue)
+        try:
+            await server.start()
+            await server.serve_forever()
+        finally:
+            await server.close()
+            resource_manager.shutdown()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("\n[INFO] Server stopped.")
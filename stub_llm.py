@@ -0,0 +1,39 @@
+"""
+LLMを使わずにサーバーや一括処理の動作・性能を確認するための、スタブのLLMクライアント。
+
+ollama.Client と同じ chat() を持ち、固定の応答を一定の間隔で数文字ずつ返す。
+config.LLM_STUB を有効にすると resource_manager.get_llm_client() がこのクライアントを返す。
+"""
+import time
+import config
+
+STUB_RESPONSE = "■ 機能系\n【機能概要】(stub) リリースノートの雛形です。\n【メリット】(stub) LLMを呼び出さずに生成しました。"
+
+
+class StubLLMClient:
+    """
+    固定の応答を返すLLMクライアント。
+
+    Args:
+        delay (float): 応答全体にかける秒数。チャンクごとに均等に待つ。省略時は config.LLM_STUB_DELAY_SECONDS。
+        chunk_size (int): 1チャンクの文字数。
+    """
+
+    def __init__(self, response: str = STUB_RESPONSE, delay: float = None, chunk_size: int = 8):
+        self.response = response
+        self.delay = config.LLM_STUB_DELAY_SECONDS if delay is None else delay
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        chunks = [self.response[i:i + self.chunk_size] for i in range(0, len(self.response), self.chunk_size)]
+        if not stream:
+            time.sleep(self.delay)
+            return {'message': {'content': self.response}}
+        return self._stream(chunks)
+
+    def _stream(self, chunks):
+        for chunk in chunks:
+            time.sleep(self.delay / len(chunks))
+            yield {'message': {'content': chunk}}
@@ -0,0 +1,153 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュール (config, db_importer など) をimportできるようにする
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class FakeCollection:
+    """ChromaDBのコレクションのうち、テストで使う操作だけを再現するフェイク。"""
+
+    def __init__(self):
+        self.items = {}
+
+    @staticmethod
+    def _match(metadata, where):
+        for key, condition in (where or {}).items():
+            if isinstance(condition, dict):
+                if '$in' in condition and metadata.get(key) not in condition['$in']:
+                    return False
+                if '$eq' in condition and metadata.get(key) != condition['$eq']:
+                    return False
+            elif metadata.get(key) != condition:
+                return False
+        return True
+
+    def get(self, ids=None, where=None, limit=None, offset=0, include=None):
+        keys = [
+            key for key in sorted(self.items)
+            if (ids is None or key in ids) and self._match(self.items[key]['metadata'], where)
+        ]
+        keys = keys[offset:offset + limit if limit else None]
+        return {
+            'ids': keys,
+            'documents': [self.items[key]['document'] for key in keys],
+            'metadatas': [self.items[key]['metadata'] for key in keys],
+            'embeddings': [self.items[key]['embedding'] for key in keys],
+        }
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for item_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.items[item_id] = {'embedding': embedding, 'document': document, 'metadata': dict(metadata)}
+
+    add = upsert
+
+    def delete(self, ids=None, where=None):
+        for key in list(self.items):
+            if (ids is not None and key in ids) or (where is not None and self._match(self.items[key]['metadata'], where)):
+                del self.items[key]
+
+    def count(self):
+        return len(self.items)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        """二乗ユークリッド距離の昇順で返す (ChromaDBのデフォルトと同じ)。"""
+        result = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for query in query_embeddings:
+            scored = sorted(
+                (sum((a - b) ** 2 for a, b in zip(query, item['embedding'])), key)
+                for key, item in self.items.items()
+                if self._match(item['metadata'], where)
+            )[:n_results]
+            result['ids'].append([key for _, key in scored])
+            result['documents'].append([self.items[key]['document'] for _, key in scored])
+            result['metadatas'].append([self.items[key]['metadata'] for _, key in scored])
+            result['distances'].append([distance for distance, _ in scored])
+        return result
+
+
+class FakeEncoder:
+    """テキスト長から決定的なベクトルを作るフェイクのEmbeddingモデル。encodeに渡された件数を記録する。"""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    @property
+    def encoded_count(self):
+        return sum(len(call) for call in self.calls)
+
+
+class FakeOllamaClient:
+    """ollama.Client のフェイク。プロンプトを記録し、固定の応答を数文字ずつストリーミングで返す。"""
+
+    def __init__(self, response="■ 機能系\n【機能概要】テスト", chunk_size=3):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.prompts = []
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.prompts.append(messages[-1]['content'])
+        if not stream:
+            return {'message': {'content': self.response}}
+        return (
+            {'message': {'content': self.response[i:i + self.chunk_size]}}
+            for i in range(0, len(self.response), self.chunk_size)
+        )
+
+
+@pytest.fixture(autouse=True)
+def disable_lexical_index(monkeypatch):
+    """テストがリポジトリ直下に転置インデックスを作らないよう、既定では無効にする。"""
+    import config
+    monkeypatch.setattr(config, 'LEXICAL_INDEX_ENABLED', False)
+
+
+@pytest.fixture(autouse=True)
+def disable_review_comment_index(monkeypatch):
+    """既定ではレビューコメント専用のインデックスを使わない (使うテストは comment_store フィクスチャで有効にする)。"""
+    import config
+    monkeypatch.setattr(config, 'REVIEW_COMMENT_INDEX_ENABLED', False)
+
+
+@pytest.fixture
+def fake_collection():
+    return FakeCollection()
+
+
+@pytest.fixture
+def fake_store(fake_collection):
+    from vector_store import ChromaVectorStore
+    return ChromaVectorStore(fake_collection)
+
+
+@pytest.fixture
+def fake_encoder():
+    return FakeEncoder()
+
+
+@pytest.fixture
+def fake_llm_client():
+    return FakeOllamaClient()
+
+
+@pytest.fixture
+def local_environment(monkeypatch, fake_collection, fake_store, fake_encoder, fake_llm_client):
+    """main_logic がフェイクのモデル・ベクトルストア・LLMを使うようにする。"""
+    import config
+    import resource_manager
+    monkeypatch.setattr(config, 'ENVIRONMENT', 'local')
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    monkeypatch.setattr(config, 'RESPONSE_CACHE_ENABLED', False)
+    monkeypatch.setattr(resource_manager, 'get_embedding_model', lambda: fake_encoder)
+    monkeypatch.setattr(resource_manager, 'get_collection', lambda name=None, create=False: fake_collection)
+    monkeypatch.setattr(resource_manager, 'get_vector_store', lambda name=None, create=False: fake_store)
+    monkeypatch.setattr(resource_manager, 'get_llm_client', lambda: fake_llm_client)
+    return fake_store
@@ -0,0 +1,104 @@
+"""テスト用のローカルBitbucket APIサーバー。"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class FakeBitbucket:
+    """
+    マージ済みPR一覧・コメント・ファイル内容を返すBitbucket APIのフェイク。
+    受け付けたリクエストのパスを requests に記録する。throttle_first_n件のリクエストには429を返す。
+    latency (秒) を指定すると、各リクエストに応答する前に待つ (ベンチマーク用)。
+    """
+
+    def __init__(self, pull_requests, page_size=2, throttle_first_n=0, latency=0.0):
+        self.pull_requests = pull_requests
+        self.page_size = page_size
+        self.throttle_remaining = throttle_first_n
+        self.latency = latency
+        self.requests = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/2.0/repositories/ws/repo"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _page(self, values, query, path):
+        page = int(query.get('page', ['1'])[0])
+        start = (page - 1) * self.page_size
+        body = {"values": values[start:start + self.page_size]}
+        if start + self.page_size < len(values):
+            params = {key: value[0] for key, value in query.items()}
+            params['page'] = str(page + 1)
+            body["next"] = f"{self.base_url}{path}?{urlencode(params)}"
+        return body
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                data = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path.split('/2.0/repositories/ws/repo', 1)[1]
+                query = parse_qs(url.query)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake._lock:
+                    fake.requests.append(path)
+                    if fake.throttle_remaining > 0:
+                        fake.throttle_remaining -= 1
+                        return self._send(429, {"error": "rate limited"}, headers={'Retry-After': '0'})
+
+                parts = path.strip('/').split('/')
+                if parts == ['pullrequests']:
+                    listing = [
+                        {
+                            "id": pr["id"],
+                            "title": pr["title"],
+                            "updated_on": pr.get("updated_on", "2024-01-01T00:00:00+00:00"),
+                            "source": {"commit": {"hash": pr["hash"]}},
+                        }
+                        for pr in fake.pull_requests
+                    ]
+                    since = re.search(r'updated_on >= "([^"]+)"', query.get('q', [''])[0])
+                    if since:
+                        listing = [pr for pr in listing if pr["updated_on"] >= since.group(1)]
+                    if query.get('sort') == ['updated_on']:
+                        listing.sort(key=lambda pr: pr["updated_on"])
+                    return self._send(200, fake._page(listing, query, path))
+                if len(parts) == 3 and parts[0] == 'pullrequests' and parts[2] == 'comments':
+                    pr = next(pr for pr in fake.pull_requests if str(pr["id"]) == parts[1])
+                    comments = [{"content": {"raw": text}} for text in pr.get("comments", [])]
+                    return self._send(200, fake._page(comments, query, path))
+                if parts[0] == 'src':
+                    commit_hash, file_path = parts[1], '/'.join(parts[2:])
+                    for pr in fake.pull_requests:
+                        if pr["hash"] == commit_hash and file_path in pr.get("files", {}):
+                            return self._send(200, pr["files"][file_path], content_type='text/plain')
+                    return self._send(404, {"error": "not found"})
+                return self._send(404, {"error": "not found"})
+
+        return Handler
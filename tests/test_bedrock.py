@@ -0,0 +1,180 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+botocore_exceptions = pytest.importorskip('botocore.exceptions')
+
+import bedrock  # noqa: E402
+import config  # noqa: E402
+import db_importer  # noqa: E402
+import main_logic  # noqa: E402
+import resource_manager  # noqa: E402
+
+
+def client_error(code: str, operation: str = 'InvokeModel'):
+    return botocore_exceptions.ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class FakeBedrockClient:
+    """
+    bedrock-runtime クライアントのフェイク。Titanの呼び出しにはテキスト長のベクトルを返し、
+    Claudeのストリーミングには固定の応答を数文字ずつイベントとして返す。
+    failures に例外を入れておくと、呼び出しごとに先頭から1つずつ送出する。
+    stream_failures の例外は、ストリーミングで最初のチャンクを返した後に送出する。
+    """
+
+    def __init__(self, response="■ 機能系\n【機能概要】Bedrockの応答", chunk_size=4, delay=0.0):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.failures = []
+        self.stream_failures = []
+        self.embedded = []
+        self.prompts = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None):
+        with self._lock:
+            self._maybe_fail()
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            text = json.loads(body)['inputText']
+            self.embedded.append(text)
+            return {'body': io.BytesIO(json.dumps({'embedding': [float(len(text)), 1.0, 0.5]}).encode())}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+        self._maybe_fail()
+        request = json.loads(body)
+        self.prompts.append(request['messages'][-1]['content'])
+
+        def events():
+            yield {'chunk': {'bytes': json.dumps({'type': 'message_start'}).encode()}}
+            for i in range(0, len(self.response), self.chunk_size):
+                delta = {'type': 'content_block_delta', 'delta': {'type': 'text_delta',
+                                                                  'text': self.response[i:i + self.chunk_size]}}
+                yield {'chunk': {'bytes': json.dumps(delta).encode()}}
+                if self.stream_failures:
+                    raise self.stream_failures.pop(0)
+            yield {'chunk': {'bytes': json.dumps({'type': 'message_stop'}).encode()}}
+        return {'body': events()}
+
+
+@pytest.fixture
+def no_backoff_delay(monkeypatch):
+    monkeypatch.setattr(config, 'BEDROCK_BACKOFF_BASE_SECONDS', 0.0)
+
+
+@pytest.fixture
+def aws_environment(monkeypatch, fake_store, no_backoff_delay):
+    """main_logic がフェイクのBedrockクライアントとベクトルストアを使うようにする。"""
+    client = FakeBedrockClient()
+    monkeypatch.setattr(config, 'ENVIRONMENT', 'aws')
+    monkeypatch.setattr(config, 'EMBEDDING_BACKEND', 'bedrock')
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    monkeypatch.setattr(config, 'RESPONSE_CACHE_ENABLED', False)
+    monkeypatch.setattr(config, 'LLM_STUB', False)
+    monkeypatch.setattr(resource_manager, '_resources', {})
+    monkeypatch.setattr(resource_manager, 'get_bedrock_client', lambda: client)
+    monkeypatch.setattr(resource_manager, 'get_vector_store', lambda name=None, create=False: fake_store)
+    return client
+
+
+def test_embeddings_are_requested_concurrently_in_input_order():
+    client = FakeBedrockClient(delay=0.05)
+    model = bedrock.BedrockEmbeddingModel(client, max_workers=4)
+
+    vectors = model.encode([f"text-{i}" * (i + 1) for i in range(8)])
+    model.close()
+
+    assert vectors == [[float(len(f"text-{i}" * (i + 1))), 1.0, 0.5] for i in range(8)]
+    assert client.max_active == 4
+
+
+def test_throttled_calls_are_retried_with_backoff(no_backoff_delay):
+    client = FakeBedrockClient()
+    client.failures = [client_error('ThrottlingException'), client_error('ThrottlingException')]
+    model = bedrock.BedrockEmbeddingModel(client)
+
+    assert model.encode("abc") == [3.0, 1.0, 0.5]
+    assert client.failures == []
+
+
+def test_other_errors_and_exhausted_retries_are_raised(no_backoff_delay, monkeypatch):
+    monkeypatch.setattr(config, 'BEDROCK_THROTTLE_RETRIES', 2)
+    client = FakeBedrockClient()
+    model = bedrock.BedrockEmbeddingModel(client)
+
+    client.failures = [client_error('ValidationException'), client_error('ThrottlingException')]
+    with pytest.raises(botocore_exceptions.ClientError, match='ValidationException'):
+        model.encode("abc")
+    assert len(client.failures) == 1
+
+    client.failures = [client_error('ThrottlingException')] * 3
+    with pytest.raises(botocore_exceptions.ClientError, match='ThrottlingException'):
+        model.encode("abc")
+    assert client.failures == []
+
+
+def test_backoff_delay_is_capped_full_jitter(monkeypatch):
+    monkeypatch.setattr(config, 'BEDROCK_BACKOFF_BASE_SECONDS', 1.0)
+    monkeypatch.setattr(config, 'BEDROCK_BACKOFF_MAX_SECONDS', 4.0)
+
+    delays = [bedrock.backoff_delay(attempt) for attempt in range(6) for _ in range(20)]
+
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert max(delays[:20]) <= 1.0
+
+
+def test_stream_is_retried_only_before_the_first_chunk(no_backoff_delay):
+    client = FakeBedrockClient()
+    client.failures = [client_error('ThrottlingException', 'InvokeModelWithResponseStream')]
+
+    assert "".join(bedrock.stream_text(client, "プロンプト")) == client.response
+    assert client.prompts == ["プロンプト"]
+
+    chunks = []
+    client.stream_failures = [client_error('throttlingException', 'InvokeModelWithResponseStream')]
+    with pytest.raises(botocore_exceptions.ClientError):
+        for chunk in bedrock.stream_text(client, "プロンプト"):
+            chunks.append(chunk)
+    assert chunks == [client.response[:client.chunk_size]]
+
+
+def test_generate_and_review_run_on_bedrock(aws_environment, fake_store):
+    tickets = [
+        {"ticket_id": "T-1", "final_release_note": "■ 機能系\n【機能概要】ログイン",
+         "review_comments": [{"comment_text": "表記を統一", "context_line": ""}]},
+    ]
+    db_importer.import_documents(tickets, fake_store, resource_manager.get_embedding_model())
+
+    stream = main_logic.generate_release_note_draft_stream("新しい仕様")
+    chunks = list(stream)
+    review = main_logic.lambda_handler({"path": "/review", "body": json.dumps({"text": "■ 機能系"})})
+
+    assert len(chunks) > 1 and "".join(chunks) == aws_environment.response
+    assert "ログイン" in aws_environment.prompts[0]
+    assert "表記を統一" in aws_environment.prompts[1]
+    assert review["statusCode"] == 200
+    assert "新しい仕様" in aws_environment.embedded
+
+
+def test_bedrock_errors_are_reported_as_error_output(aws_environment):
+    aws_environment.failures = [client_error('AccessDeniedException', 'InvokeModelWithResponseStream')]
+
+    output = main_logic.invoke_llm_aws("プロンプト")
+
+    assert output.startswith("[ERROR]")
@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import bitbucket_data_loader
+from bitbucket_data_loader import BitbucketClient, RateLimiter, load_bitbucket_data
+from fake_bitbucket import FakeBitbucket
+
+
+def make_pull_requests(count):
+    return [
+        {
+            "id": i,
+            "title": f"PR {i}",
+            "hash": f"c0ffee{i:04d}",
+            "files": {"10-release.txt": f"note {i}", "20-design.md": f"design {i}"} if i % 3 else {"10-release.txt": "only note"},
+            "comments": [f"comment {i}-{j}" for j in range(i % 4)],
+        }
+        for i in range(1, 11)
+    ][:count]
+
+
+def test_harvests_pull_requests_concurrently_in_listing_order():
+    with FakeBitbucket(make_pull_requests(10)) as fake:
+        client = BitbucketClient(('user', 'pass'), base_url=fake.base_url, max_workers=4, requests_per_second=1000)
+        data = load_bitbucket_data(client=client)
+
+    assert [record["ticket_id"] for record in data] == ["PR-1", "PR-2", "PR-4", "PR-5", "PR-7", "PR-8", "PR-10"]
+    assert data[1] == {
+        "ticket_id": "PR-2",
+        "final_release_note": "note 2",
+        "design_document": "design 2",
+        "review_comments": [
+            {"comment_text": "comment 2-0", "context_line": ""},
+            {"comment_text": "comment 2-1", "context_line": ""},
+        ],
+    }
+    # ソースコミットのハッシュは一覧から取得するため、PR詳細のAPIは呼ばれない
+    assert not [path for path in fake.requests if path.rstrip('/').split('/')[-1].isdigit()]
+
+
+def test_retries_after_429():
+    with FakeBitbucket(make_pull_requests(2), throttle_first_n=3) as fake:
+        client = BitbucketClient(('user', 'pass'), base_url=fake.base_url, max_workers=2, requests_per_second=1000)
+        data = load_bitbucket_data(client=client)
+
+    assert [record["ticket_id"] for record in data] == ["PR-1", "PR-2"]
+    assert fake.throttle_remaining == 0
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(BitbucketClient, '_backoff', staticmethod(lambda attempt: 0.0))
+    with FakeBitbucket(make_pull_requests(1), throttle_first_n=100) as fake:
+        client = BitbucketClient(('user', 'pass'), base_url=fake.base_url, requests_per_second=1000, max_retries=2)
+        with pytest.raises(bitbucket_data_loader.requests.HTTPError):
+            load_bitbucket_data(client=client)
+
+    assert len(fake.requests) == 3
+
+
+def test_rate_limiter_backs_off_and_recovers():
+    limiter = RateLimiter(rate=100)
+
+    limiter.on_throttled(0.0)
+    assert limiter.rate == 50
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.rate == 100
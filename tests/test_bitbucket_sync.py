@@ -0,0 +1,85 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from bitbucket_data_loader import BitbucketClient
+from bitbucket_sync import ResponseCache, SyncState, sync
+from fake_bitbucket import FakeBitbucket
+
+
+def make_pull_request(pr_id, updated_on, comments=()):
+    return {
+        "id": pr_id,
+        "title": f"PR {pr_id}",
+        "hash": f"abc{pr_id}",
+        "updated_on": updated_on,
+        "files": {"10-release.txt": f"note {pr_id}", "20-design.md": f"design {pr_id}"},
+        "comments": list(comments),
+    }
+
+
+@pytest.fixture
+def pull_requests():
+    return [
+        make_pull_request(1, "2024-01-01T00:00:00+00:00", ["c1"]),
+        make_pull_request(2, "2024-01-02T00:00:00+00:00"),
+        make_pull_request(3, "2024-01-02T00:00:00+00:00", ["c3"]),
+    ]
+
+
+def run_sync(fake, tmp_path, received):
+    client = BitbucketClient(('user', 'pass'), base_url=fake.base_url, max_workers=2, requests_per_second=1000)
+    state = SyncState(str(tmp_path / 'state.json'))
+    return sync(client, state, ResponseCache(str(tmp_path / 'cache')), on_records=received.append)
+
+
+def test_second_sync_fetches_only_updated_pull_requests(tmp_path, pull_requests):
+    received = []
+    with FakeBitbucket(pull_requests, page_size=50) as fake:
+        first = run_sync(fake, tmp_path, received)
+        first_requests = len(fake.requests)
+
+        pull_requests[0]["updated_on"] = "2024-01-03T00:00:00+00:00"
+        pull_requests[0]["comments"].append("c1-2")
+        second = run_sync(fake, tmp_path, received)
+        second_paths = fake.requests[first_requests:]
+
+    assert [record["ticket_id"] for record in first] == ["PR-1", "PR-2", "PR-3"]
+    assert [record["ticket_id"] for record in second] == ["PR-1"]
+    assert second[0]["review_comments"][-1]["comment_text"] == "c1-2"
+    assert len(received) == 2
+    # 一覧1回とコメント1回のみ。ファイル内容は同じコミットのためキャッシュから返す
+    assert [path for path in second_paths if path.startswith('/src/')] == []
+    assert len(second_paths) == 2
+
+
+def test_sync_without_changes_makes_one_call(tmp_path, pull_requests):
+    with FakeBitbucket(pull_requests, page_size=50) as fake:
+        run_sync(fake, tmp_path, [])
+        before = len(fake.requests)
+        records = run_sync(fake, tmp_path, [])
+
+    assert records == []
+    assert len(fake.requests) - before == 1
+
+
+def test_cursor_is_not_advanced_when_import_fails(tmp_path, pull_requests):
+    def failing_import(records):
+        raise RuntimeError("db is down")
+
+    with FakeBitbucket(pull_requests) as fake:
+        client = BitbucketClient(('user', 'pass'), base_url=fake.base_url, requests_per_second=1000)
+        state = SyncState(str(tmp_path / 'state.json'))
+        with pytest.raises(RuntimeError):
+            sync(client, state, ResponseCache(str(tmp_path / 'cache')), on_records=failing_import)
+
+    assert SyncState(str(tmp_path / 'state.json')).updated_on is None
+
+
+def test_response_cache_remembers_missing_files(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+
+    cache.put_file("abc", "20-design.md", None)
+
+    assert cache.get_file("abc", "20-design.md") == (True, None)
+    assert cache.get_file("abc", "10-release.txt") == (False, None)
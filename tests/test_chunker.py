@@ -0,0 +1,104 @@
+import db_importer
+import main_logic
+from chunker import chunk_text
+
+
+class TruncatingEncoder:
+    """先頭50文字だけを見るフェイクのEmbeddingモデル (入力長の上限を超えた部分は無視される)。"""
+
+    def encode(self, texts, **kwargs):
+        return [[float('認証' in text[:50]), float('画面' in text[:50]), 0.1] for text in texts]
+
+
+def test_short_text_is_not_split():
+    assert chunk_text("■ 機能系\n【機能概要】短い説明", max_chars=200) == ["■ 機能系\n【機能概要】短い説明"]
+
+
+def test_chunks_keep_heading_path_and_fit_limit():
+    text = "# 概要\n" + "概要の説明。" * 10 + "\n## 認証\n" + "認証の説明。" * 10 + "\n# 画面\n" + "画面の説明。" * 10
+
+    chunks = chunk_text(text, max_chars=80)
+
+    assert all(len(chunk) <= 80 for chunk in chunks)
+    assert any(chunk.startswith("# 概要 > ## 認証\n認証の説明") for chunk in chunks)
+    assert any(chunk.startswith("# 画面\n画面の説明") for chunk in chunks)
+    assert not any("# 概要" in chunk for chunk in chunks if "画面の説明" in chunk)
+
+
+def test_long_release_note_field_repeats_its_label():
+    text = "■ 不具合系\n【不具合概要】" + "ログインできない事象を修正しました。" * 8 + "\n【影響範囲】全ユーザー"
+
+    chunks = chunk_text(text, max_chars=80)
+
+    assert len(chunks) > 2
+    assert all(chunk.startswith("■ 不具合系\n") for chunk in chunks)
+    assert all("【不具合概要】" in chunk for chunk in chunks[:-1])
+    assert chunks[-1].endswith("【影響範囲】全ユーザー")
+
+
+def test_long_items_are_stored_as_chunks(monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'CHUNK_MAX_CHARS', 40)
+    note = "■ 機能系\n【機能概要】" + "一覧画面の表示を改善しました。" * 5
+    doc = {"ticket_id": "T-1", "final_release_note": note, "review_comments": [{"comment_text": "短い", "context_line": ""}]}
+
+    items = db_importer.build_items(doc)
+    note_items = [item for item in items if item[2]['content_type'] == 'release_note']
+
+    assert [item[0] for item in note_items[:2]] == ["T-1_note", "T-1_note_chunk_1"]
+    assert all(item[2]['parent_id'] == "T-1_note" for item in note_items)
+    # 全文は先頭のチャンクにだけ持たせる
+    assert [item[2].get('full_text') for item in note_items] == [note] + [None] * (len(note_items) - 1)
+    # 短いコメントは分割されず、idとメタデータも分割前と変わらない
+    assert items[-1][:2] == ("T-1_comment_0", "短い")
+    assert 'parent_id' not in items[-1][2]
+
+
+def test_full_text_is_resolved_when_a_later_chunk_matches(local_environment, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'CHUNK_MAX_CHARS', 40)
+    note = "■ 機能系\n【機能概要】" + "一覧画面の表示を改善しました。" * 3 + "二段階認証を追加しました。"
+    db_importer.import_documents([{"ticket_id": "T-1", "final_release_note": note, "review_comments": []}],
+                                 local_environment, TruncatingEncoder())
+
+    hits = local_environment.query([[1.0, 0.0, 0.1]], 1)[0]
+    docs = main_logic.query_db_batch([[1.0, 0.0, 0.1]], local_environment, n_results=1)
+
+    assert hits[0]['id'] != "T-1_note" and 'full_text' not in hits[0]['metadata']
+    assert docs[0][0]["final_release_note"] == note
+
+
+def test_late_section_of_long_design_doc_is_retrieved(local_environment, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'CHUNK_MAX_CHARS', 40)
+    encoder = TruncatingEncoder()
+    tickets = [
+        {"ticket_id": "T-1", "final_release_note": "二段階認証を追加", "review_comments": []},
+        {"ticket_id": "T-2", "final_release_note": "一覧画面を改善", "review_comments": []},
+        {"ticket_id": "T-3", "final_release_note": "ログ出力を変更", "review_comments": []},
+    ]
+    db_importer.import_documents(tickets, local_environment, encoder)
+    design = "# 背景\n" + "一覧画面の利用状況を調査した。" * 4 + "\n# 対応\n二段階認証を導入する。"
+
+    whole = main_logic.query_db_batch([main_logic.get_embeddings_local([design], encoder)[0]], local_environment)
+    chunked = main_logic.query_db_batch(main_logic.get_chunk_embeddings_local([design], encoder), local_environment)
+
+    # 文書全体のベクトルでは、先頭から外れた「対応」の節が検索に反映されない
+    assert "二段階認証を追加" not in [doc["final_release_note"] for doc in whole[0]]
+    assert sorted(doc["final_release_note"] for doc in chunked[0]) == ["一覧画面を改善", "二段階認証を追加"]
+
+
+def test_retrieval_returns_each_ticket_once(local_environment, fake_encoder, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'CHUNK_MAX_CHARS', 20)
+    tickets = [{"ticket_id": "T-1", "final_release_note": "■ 機能系\n【機能概要】" + "検索の改善。" * 6,
+                "review_comments": [{"comment_text": "表記を統一", "context_line": "検索"}]}]
+    db_importer.import_documents(tickets, local_environment, fake_encoder)
+
+    docs = main_logic.query_db_batch([[10.0, 1.0, 0.5]], local_environment, n_results=2)
+    comments = main_logic.query_review_comments_batch([[5.0, 1.0, 0.5]], local_environment)
+
+    assert len(docs[0]) == 1
+    assert docs[0][0]["final_release_note"] == tickets[0]["final_release_note"]
+    assert docs[0][0]["review_comments"] == [{"comment_text": "表記を統一", "context_line": "検索"}]
+    assert comments[0] == [{"comment_text": "表記を統一", "ticket_id": "T-1", "context_line": "検索", "frequency": 1}]
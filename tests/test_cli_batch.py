@@ -0,0 +1,72 @@
+import json
+import sys
+
+import pytest
+
+import cli
+import db_importer
+
+
+@pytest.fixture
+def imported(local_environment, fake_encoder):
+    tickets = [
+        {
+            "ticket_id": "T-1",
+            "final_release_note": "■ 機能系\n【機能概要】ログイン",
+            "review_comments": [{"comment_text": "具体的に", "context_line": ""}],
+        },
+    ]
+    db_importer.import_documents(tickets, local_environment, fake_encoder)
+    fake_encoder.calls.clear()
+    return local_environment
+
+
+def run_cli(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['cli.py', *argv])
+    cli.main()
+
+
+def test_batch_directory_embeds_in_one_call_and_writes_report(tmp_path, monkeypatch, imported, fake_encoder, fake_llm_client):
+    specs = tmp_path / 'specs'
+    specs.mkdir()
+    for i in range(3):
+        (specs / f"spec{i}.md").write_text(f"仕様 {i}", encoding='utf-8')
+    (specs / 'ignored.png').write_bytes(b'')
+    report = tmp_path / 'report.jsonl'
+
+    run_cli(monkeypatch, 'batch', 'generate', '--input', str(specs),
+            '--output-dir', str(tmp_path / 'out'), '--report', str(report))
+
+    assert fake_encoder.calls == [["仕様 0", "仕様 1", "仕様 2"]]
+    assert len(fake_llm_client.prompts) == 3
+    lines = [json.loads(line) for line in report.read_text(encoding='utf-8').splitlines()]
+    assert [line['input'].rsplit('/', 1)[-1] for line in lines] == ['spec0.md', 'spec1.md', 'spec2.md']
+    assert all(line['error'] is None and line['llm_time'] is not None for line in lines)
+    assert (tmp_path / 'out' / 'spec1.generate.md').read_text(encoding='utf-8') == fake_llm_client.response
+
+
+def test_batch_manifest(tmp_path):
+    (tmp_path / 'note.md').write_text("■ 機能系", encoding='utf-8')
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text(
+        json.dumps({"file": "note.md"}) + "\n" + json.dumps({"id": "inline", "text": "■ 改善系"}) + "\n",
+        encoding='utf-8'
+    )
+
+    inputs = cli.resolve_batch_inputs(str(manifest))
+
+    assert [name for name, _ in inputs] == [str(tmp_path / 'note.md'), 'inline']
+    assert [text for _, text in inputs] == ["■ 機能系", "■ 改善系"]
+
+
+def test_batch_output_names_do_not_collide(tmp_path, monkeypatch, imported, fake_llm_client):
+    for directory in ('a', 'b'):
+        (tmp_path / 'docs' / directory).mkdir(parents=True)
+        (tmp_path / 'docs' / directory / 'spec.md').write_text(f"仕様 {directory}", encoding='utf-8')
+
+    run_cli(monkeypatch, 'batch', 'generate', '--input', str(tmp_path / 'docs' / '*' / 'spec.md'),
+            '--output-dir', str(tmp_path / 'out'))
+
+    assert sorted(path.name for path in (tmp_path / 'out').iterdir()) == ['a_spec.generate.md', 'b_spec.generate.md']
+    assert cli.batch_output_names(['a/x', 'b/x', 'note.md', 'inline', 'inline'], 'review') == [
+        'a_x.review.md', 'b_x.review.md', 'note.review.md', 'inline.review.md', 'inline-5.review.md']
@@ -0,0 +1,94 @@
+import sys
+import threading
+
+import pytest
+
+import cli
+import cli_daemon
+import config
+import db_importer
+
+pytestmark = pytest.mark.skipif(not cli_daemon.is_supported(), reason="Unix domain sockets are not available")
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'd.sock')
+    monkeypatch.setattr(config, 'DAEMON_SOCKET_PATH', path)
+    monkeypatch.setattr(config, 'DAEMON_START_TIMEOUT_SECONDS', 0.2)
+    return path
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    """デーモンのプロセスを起動する代わりに、起動しようとしたことだけを記録する。"""
+    calls = []
+    monkeypatch.setattr(cli_daemon, '_spawn', calls.append)
+    return calls
+
+
+@pytest.fixture
+def daemon(local_environment, fake_encoder, socket_path):
+    tickets = [{"ticket_id": "T-1", "final_release_note": "■ 機能系\n【機能概要】ログイン", "review_comments": []}]
+    db_importer.import_documents(tickets, local_environment, fake_encoder)
+    fake_encoder.calls.clear()
+    warm = cli_daemon.WarmDaemon(socket_path, idle_timeout=0)
+    assert warm.bind()
+    thread = threading.Thread(target=warm.serve, daemon=True)
+    thread.start()
+    yield warm
+    warm.stop()
+    thread.join(timeout=5)
+
+
+def test_requests_are_streamed_from_the_daemon(daemon, fake_llm_client, spawned):
+    first = cli_daemon.request_stream('generate', "新しい仕様")
+    chunks = list(first)
+    second = cli_daemon.request_stream('generate', "別の仕様")
+
+    assert len(chunks) > 1 and "".join(chunks) == fake_llm_client.response
+    assert second.text() == fake_llm_client.response
+    assert first.timing_summary().startswith("--- [INFO] LLM time to first token")
+    assert daemon.requests == 2 and spawned == []
+
+
+def test_stale_daemon_is_stopped_and_replaced(daemon, socket_path, spawned):
+    daemon.fingerprint = "old"
+
+    stream = cli_daemon.request_stream('review', "■ 機能系")
+
+    assert stream is None  # 新しいデーモンが起動しないため、プロセス内で処理させる
+    assert spawned == [socket_path]
+    assert cli_daemon.send_command('status') is None
+
+
+def test_status_and_stop_commands(daemon):
+    status = cli_daemon.send_command('status')
+
+    assert status["fingerprint"] == cli_daemon.fingerprint() and status["stale"] is False
+    assert cli_daemon.send_command('stop') == {"stopped": True}
+    assert cli_daemon.send_command('status') is None
+
+
+def test_idle_daemon_shuts_down(socket_path):
+    warm = cli_daemon.WarmDaemon(socket_path, idle_timeout=0.3)
+    assert warm.bind()
+    thread = threading.Thread(target=warm.serve, daemon=True)
+    thread.start()
+
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert cli_daemon.send_command('status') is None
+
+
+def test_cli_falls_back_to_in_process_when_daemon_is_unavailable(tmp_path, monkeypatch, socket_path, spawned,
+                                                               local_environment, fake_llm_client, capsys):
+    spec = tmp_path / 'spec.md'
+    spec.write_text("新しい仕様", encoding='utf-8')
+    monkeypatch.setattr(sys, 'argv', ['cli.py', 'generate', '--file', str(spec), '--daemon'])
+
+    cli.main()
+
+    assert spawned == [socket_path]
+    assert fake_llm_client.response in capsys.readouterr().out
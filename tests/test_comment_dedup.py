@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+import config
+import db_importer
+import main_logic
+import resource_manager
+from comment_dedup import NearDuplicateIndex, collapse_review_comments
+from conftest import FakeCollection
+from vector_store import ChromaVectorStore
+
+
+def noisy_copies(count: int, copies: int, dim: int = 64, noise: float = 0.05, seed: int = 1):
+    """count 種類のランダムなベクトルと、それぞれに小さなノイズを加えた copies 件の複製を返す。"""
+    rng = np.random.default_rng(seed)
+    bases = rng.standard_normal((count, dim))
+    bases /= np.linalg.norm(bases, axis=1, keepdims=True)
+    vectors = []
+    for k in range(copies):
+        for i in range(count):
+            vectors.append((i, bases[i] + rng.standard_normal(dim) * noise / np.sqrt(dim)))
+    return vectors
+
+
+def test_near_duplicates_are_grouped_without_all_pairs_comparison():
+    vectors = noisy_copies(count=300, copies=4)
+    index = NearDuplicateIndex(threshold=0.95)
+
+    clusters = {}
+    for source, vector in vectors:
+        clusters.setdefault(index.add(vector), set()).add(source)
+
+    assert len(index) == 300
+    assert all(len(sources) == 1 for sources in clusters.values())
+    # 全ペア (約72万) ではなく、同じバケットの代表とだけ比較する
+    assert index.comparisons < len(vectors) * 5
+
+
+def test_threshold_above_one_keeps_every_comment():
+    index = NearDuplicateIndex(threshold=1.01)
+
+    assert [index.add([1.0, 0.0]) for _ in range(3)] == [0, 1, 2]
+
+
+def test_collapsed_comments_keep_frequency_and_ticket_ids():
+    items = [
+        ("T-1_comment_0", [1.0, 0.0, 0.0], "「メリット」の表現が弱い", {"ticket_id": "T-1"}),
+        ("T-2_comment_0", [0.0, 1.0, 0.0], "用語を統一", {"ticket_id": "T-2"}),
+        ("T-3_comment_0", [0.99, 0.05, 0.0], "「メリット」の表現が弱いです", {"ticket_id": "T-3"}),
+        ("T-3_comment_1", [1.0, 0.01, 0.0], "メリットの表現が弱い", {"ticket_id": "T-3"}),
+    ]
+
+    collapsed = collapse_review_comments(items, NearDuplicateIndex(threshold=0.95))
+
+    assert [(item_id, document) for item_id, _, document, _ in collapsed] == [
+        ("T-1_comment_0", "「メリット」の表現が弱い"), ("T-2_comment_0", "用語を統一")]
+    assert collapsed[0][3] == {"ticket_id": "T-1", "frequency": 3, "ticket_ids": "T-1,T-3"}
+    assert collapsed[1][3] == {"ticket_id": "T-2", "frequency": 1, "ticket_ids": "T-2"}
+
+
+class TopicEncoder:
+    """テキストに含まれる語句ごとに決まった方向のベクトルを返すEmbeddingモデルのフェイク。"""
+
+    TOPICS = ("メリット", "用語", "画像", "ログイン")
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        return [[1.0 if topic in text else 0.0 for topic in self.TOPICS] + [0.01] for text in texts]
+
+
+def ticket(ticket_id: str, note: str, comments: list) -> dict:
+    return {"ticket_id": ticket_id, "final_release_note": note,
+            "review_comments": [{"comment_text": text, "context_line": ""} for text in comments]}
+
+
+@pytest.fixture
+def comment_store(local_environment, monkeypatch):
+    store = ChromaVectorStore(FakeCollection())
+    monkeypatch.setattr(config, 'REVIEW_COMMENT_INDEX_ENABLED', True)
+    monkeypatch.setattr(resource_manager, '_resources', {})
+    monkeypatch.setattr(resource_manager, 'get_vector_store',
+                        lambda name=None, create=False: store if name else local_environment)
+    monkeypatch.setattr(resource_manager, 'get_embedding_model', lambda: TopicEncoder())
+    return store
+
+
+def test_import_collapses_repeated_comments_and_review_ranks_by_frequency(local_environment, comment_store,
+                                                                          fake_llm_client, monkeypatch):
+    tickets = [
+        ticket("T-1", "■ 機能系\n【機能概要】ログイン", ["「メリット」の表現が弱い", "用語を統一"]),
+        ticket("T-2", "■ 機能系\n【機能概要】画像", ["「メリット」の表現が弱いです"]),
+        ticket("T-3", "■ 不具合系\n【不具合概要】画像", ["メリットの表現が弱い", "ログインの用語"]),
+    ]
+    db_importer.import_documents(tickets, local_environment, TopicEncoder(), incremental=True,
+                                 comment_store=comment_store)
+
+    stored = dict(comment_store.iter_metadata())
+    assert stored["T-1_comment_0"]["frequency"] == 3
+    assert stored["T-1_comment_0"]["ticket_ids"] == "T-1,T-2,T-3"
+    assert sorted(stored) == ["T-1_comment_0", "T-1_comment_1", "T-3_comment_1"]
+    assert local_environment.count() == 8
+
+    monkeypatch.setattr(config, 'REVIEW_COMMENT_RANK_BY', 'frequency')
+    comments = main_logic.query_review_comments_batch([[0.0, 1.0, 0.0, 0.0, 0.01]], local_environment,
+                                                      n_results=2)[0]
+    assert [comment['frequency'] for comment in comments] == [3, 1]
+
+    # 繰り返された指摘は回数とともにプロンプトに含める
+    main_logic.review_release_note("■ 機能系\n【メリット】便利になります。")
+    assert '"times_pointed_out":3' in fake_llm_client.prompts[0]
+
+    # 指摘が消えると、まとめた件数も減る
+    tickets[1] = ticket("T-2", "■ 機能系\n【機能概要】画像", [])
+    db_importer.import_documents(tickets, local_environment, TopicEncoder(), incremental=True,
+                                 comment_store=comment_store)
+    assert dict(comment_store.iter_metadata())["T-1_comment_0"]["ticket_ids"] == "T-1,T-3"
+
+
+def test_lexical_search_only_returns_representatives(local_environment, comment_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LEXICAL_INDEX_ENABLED', True)
+    monkeypatch.setattr(config, 'LEXICAL_INDEX_PATH', str(tmp_path / 'lexical' / 'index.sqlite3'))
+    tickets = [
+        ticket("T-1", "■ 機能系\n【機能概要】ログイン", ["「メリット」の表現が弱い"]),
+        ticket("T-2", "■ 機能系\n【機能概要】画像", ["「メリット」の表現が弱い"]),
+        ticket("T-3", "■ 不具合系\n【不具合概要】画像", ["「メリット」の表現が弱い", "用語を統一"]),
+    ]
+    db_importer.import_documents(tickets, local_environment, TopicEncoder(), incremental=True,
+                                 comment_store=comment_store)
+
+    text = "「メリット」の表現が弱い"
+    comments = main_logic.query_review_comments_batch([TopicEncoder().encode(text)], local_environment,
+                                                      n_results=3, texts=[text])[0]
+
+    # まとめた重複が語句の一致で frequency 1 のコメントとして再び現れない
+    assert sorted((comment['comment_text'], comment['frequency']) for comment in comments) == [
+        ("「メリット」の表現が弱い", 3), ("用語を統一", 1)]
+    assert len(resource_manager.get_review_comment_lexical_index()) == 2
+
+    tickets[2] = ticket("T-3", "■ 不具合系\n【不具合概要】画像", ["「メリット」の表現が弱い"])
+    db_importer.import_documents(tickets, local_environment, TopicEncoder(), incremental=True,
+                                 comment_store=comment_store)
+    assert len(resource_manager.get_review_comment_lexical_index()) == 1
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+import data_loader
+from data_loader import iter_records
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # 要素がチャンクの境界をまたぐように、読み込みサイズを極端に小さくする
+    monkeypatch.setattr(data_loader, 'READ_CHUNK_SIZE', 3)
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_json_array_across_chunk_boundaries(tmp_path, small_chunks):
+    records = [
+        {"ticket_id": "T-1", "final_release_note": "■ 機能系\n【機能概要】ログイン", "review_comments": []},
+        {"ticket_id": "T-2", "final_release_note": "x" * 100, "review_comments": [{"comment_text": "]", "context_line": ","}]},
+    ]
+    path = write(tmp_path, 'data.json', ' \n' + json.dumps(records, ensure_ascii=False, indent=2) + '\n')
+
+    assert list(iter_records(path)) == records
+
+
+def test_scalars_are_not_split_at_chunk_boundaries(tmp_path, small_chunks):
+    path = write(tmp_path, 'data.json', '[12345678, "abc]def" , true]')
+
+    assert list(iter_records(path)) == [12345678, "abc]def", True]
+
+
+def test_empty_array(tmp_path, small_chunks):
+    path = write(tmp_path, 'data.json', '[ ]')
+
+    assert list(iter_records(path)) == []
+
+
+@pytest.mark.parametrize('text', [
+    '[{"a": 1} {"b": 2}]',
+    '[,,{}]',
+    '[{}, , {}]',
+    '[{}, ]',
+    '[{}',
+    '[{"a": 1}, {"b":',
+    '[{}] extra',
+])
+def test_malformed_arrays_are_rejected(tmp_path, small_chunks, text):
+    path = write(tmp_path, 'data.json', text)
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_records(path))
+
+
+def test_jsonl(tmp_path):
+    records = [{"ticket_id": "T-1"}, {"ticket_id": "T-2"}]
+    path = write(tmp_path, 'data.jsonl', '\n'.join(json.dumps(r) for r in records) + '\n\n')
+
+    assert list(iter_records(path)) == records
+
+
+def test_large_record_read_size_grows(tmp_path, monkeypatch):
+    reads = []
+    original_open = open
+
+    class CountingFile:
+        def __init__(self, f):
+            self._f = f
+
+        def read(self, size=-1):
+            reads.append(size)
+            return self._f.read(size)
+
+        def __getattr__(self, name):
+            return getattr(self._f, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self._f.close()
+
+    monkeypatch.setattr(data_loader, 'READ_CHUNK_SIZE', 16)
+    monkeypatch.setattr('builtins.open', lambda *a, **kw: CountingFile(original_open(*a, **kw)))
+    path = write(tmp_path, 'data.json', json.dumps([{"text": "x" * 10000}]))
+
+    assert list(iter_records(path)) == [{"text": "x" * 10000}]
+    assert len(reads) < 20
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+import config
+import db_importer
+from data_loader import iter_records
+
+
+@pytest.fixture(autouse=True)
+def disable_embedding_cache(monkeypatch):
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+
+
+def make_ticket(ticket_id, note, comments=()):
+    return {
+        "ticket_id": ticket_id,
+        "final_release_note": note,
+        "review_comments": [{"comment_text": text, "context_line": ""} for text in comments],
+    }
+
+
+def test_incremental_import_counts(fake_collection, fake_store, fake_encoder):
+    tickets = [make_ticket("T-1", "note 1", ["c1", "c2"]), make_ticket("T-2", "note 2")]
+
+    first = db_importer.import_documents(tickets, fake_store, fake_encoder, incremental=True, batch_size=2)
+    second = db_importer.import_documents(tickets, fake_store, fake_encoder, incremental=True, batch_size=2)
+
+    assert first == {"tickets": 2, "upserted": 4, "unchanged": 0, "deleted": 0}
+    assert second == {"tickets": 2, "upserted": 0, "unchanged": 4, "deleted": 0}
+    assert fake_encoder.encoded_count == 4
+    assert fake_collection.items["T-1_note"]["metadata"]["content_hash"]
+
+
+def test_incremental_import_updates_and_deletes(fake_collection, fake_store, fake_encoder):
+    db_importer.import_documents(
+        [make_ticket("T-1", "note 1", ["c1", "c2"]), make_ticket("T-2", "note 2")],
+        fake_store, fake_encoder, incremental=True
+    )
+
+    stats = db_importer.import_documents(
+        [make_ticket("T-1", "note 1 (edited)", ["c1"])],
+        fake_store, fake_encoder, incremental=True
+    )
+
+    assert stats == {"tickets": 1, "upserted": 1, "unchanged": 1, "deleted": 2}
+    assert sorted(fake_collection.items) == ["T-1_comment_0", "T-1_note"]
+
+
+def test_incremental_import_without_prune_keeps_other_tickets(fake_collection, fake_store, fake_encoder):
+    db_importer.import_documents(
+        [make_ticket("T-1", "note 1", ["c1", "c2"]), make_ticket("T-2", "note 2")],
+        fake_store, fake_encoder, incremental=True
+    )
+
+    stats = db_importer.import_documents(
+        [make_ticket("T-1", "note 1", ["c1"])],
+        fake_store, fake_encoder, incremental=True, prune=False
+    )
+
+    assert stats["deleted"] == 1
+    assert sorted(fake_collection.items) == ["T-1_comment_0", "T-1_note", "T-2_note"]
+
+
+def test_empty_input_does_not_prune(tmp_path, fake_collection, fake_store, fake_encoder):
+    db_importer.import_documents([make_ticket("T-1", "note 1")], fake_store, fake_encoder, incremental=True)
+    empty = tmp_path / "empty.jsonl"
+    empty.write_text("", encoding="utf-8")
+
+    stats = db_importer.import_documents(iter_records(str(empty)), fake_store, fake_encoder, incremental=True)
+
+    assert stats["tickets"] == 0
+    assert stats["deleted"] == 0
+    assert fake_collection.count() == 1
+
+
+def test_duplicate_ticket_ids_are_rejected(fake_collection, fake_store, fake_encoder):
+    db_importer.import_documents([make_ticket("T-1", "note 1", ["c1"])], fake_store, fake_encoder, incremental=True)
+    tickets = [make_ticket("T-1", "note 1", ["c1"]), make_ticket("T-1", "note 1")]
+
+    with pytest.raises(ValueError):
+        db_importer.import_documents(tickets, fake_store, fake_encoder, incremental=True, batch_size=1)
+    assert "T-1_comment_0" in fake_collection.items
+
+
+def test_invalid_input_stops_before_pruning(tmp_path, fake_collection, fake_store, fake_encoder):
+    db_importer.import_documents(
+        [make_ticket("T-1", "note 1"), make_ticket("T-2", "note 2")],
+        fake_store, fake_encoder, incremental=True
+    )
+    broken = tmp_path / "broken.jsonl"
+    broken.write_text(json.dumps(make_ticket("T-1", "note 1")) + "\n{broken\n", encoding="utf-8")
+
+    with pytest.raises(json.JSONDecodeError):
+        db_importer.import_documents(iter_records(str(broken)), fake_store, fake_encoder, incremental=True)
+    assert "T-2_note" in fake_collection.items
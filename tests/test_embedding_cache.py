@@ -0,0 +1,63 @@
+import config
+from embedding_cache import EmbeddingCache, encode_with_cache, make_key
+
+
+def test_miss_then_hit(tmp_path, fake_encoder):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=10)
+
+    first = encode_with_cache(['abc', 'de'], fake_encoder.encode, 'model', cache)
+    second = encode_with_cache(['abc', 'de'], fake_encoder.encode, 'model', cache)
+
+    assert first == second == [[3.0, 1.0, 0.5], [2.0, 1.0, 0.5]]
+    assert fake_encoder.calls == [['abc', 'de']]
+    assert len(cache) == 2
+
+
+def test_duplicates_are_encoded_once(tmp_path, fake_encoder):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=10)
+
+    vectors = encode_with_cache(['x', 'yy', 'x'], fake_encoder.encode, 'model', cache)
+
+    assert vectors == [[1.0, 1.0, 0.5], [2.0, 1.0, 0.5], [1.0, 1.0, 0.5]]
+    assert fake_encoder.calls == [['x', 'yy']]
+
+
+def test_whitespace_is_normalized_only_for_opted_in_models(tmp_path, fake_encoder):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=10)
+    local_model = config.LOCAL_EMBEDDING_MODEL
+
+    assert make_key(local_model, 'a  b\n') == make_key(local_model, 'a b')
+    assert make_key('other-model', 'a  b\n') != make_key('other-model', 'a b')
+
+    encode_with_cache(['a b', 'a\nb'], fake_encoder.encode, local_model, cache)
+    encode_with_cache(['a b', 'a\nb'], fake_encoder.encode, 'other-model', cache)
+    assert fake_encoder.calls == [['a b'], ['a b', 'a\nb']]
+
+
+def test_model_id_is_part_of_the_key(tmp_path, fake_encoder):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=10)
+
+    encode_with_cache(['abc'], fake_encoder.encode, 'model-a', cache)
+    encode_with_cache(['abc'], fake_encoder.encode, 'model-b', cache)
+
+    assert fake_encoder.encoded_count == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=2)
+
+    cache.put_many('model', ['a'], [[1.0]])
+    cache.put_many('model', ['b'], [[2.0]])
+    cache.get_many('model', ['a'])  # 'a' を最近参照したことにする
+    cache.put_many('model', ['c'], [[3.0]])
+
+    assert len(cache) == 2
+    assert cache.get_many('model', ['a', 'b', 'c']) == [[1.0], None, [3.0]]
+
+
+def test_zero_max_entries_keeps_nothing(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=0)
+
+    cache.put_many('model', ['a'], [[1.0]])
+
+    assert len(cache) == 0
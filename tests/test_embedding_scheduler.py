@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from embedding_scheduler import EmbeddingScheduler
+
+
+class RecordingEncoder:
+    """呼び出しごとの入力を記録し、テキスト長をベクトルにするフェイク。"""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        if self.delay:
+            threading.Event().wait(self.delay)
+        return [[float(len(text))] for text in texts]
+
+
+def test_concurrent_callers_share_one_batch_sorted_by_length():
+    encoder = RecordingEncoder()
+    scheduler = EmbeddingScheduler(encoder, max_batch_size=16, max_wait_ms=200, length_ratio=0)
+    texts = ["とても長いテキスト", "短い", "中くらいの", "a"]
+    results = {}
+
+    def call(text):
+        results[text] = scheduler.embed(text)
+
+    threads = [threading.Thread(target=call, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.close()
+
+    assert encoder.calls == [sorted(texts, key=len)]
+    assert results == {text: [float(len(text))] for text in texts}
+    assert scheduler.batches == 1 and scheduler.items == 4
+
+
+def test_inputs_of_very_different_lengths_are_encoded_separately():
+    encoder = RecordingEncoder()
+    scheduler = EmbeddingScheduler(encoder, max_batch_size=16, max_wait_ms=100, length_ratio=2)
+    texts = ["x" * 200, "x" * 10, "x" * 150, "x" * 12, "x" * 19]
+
+    vectors = scheduler.embed_many(texts)
+    scheduler.close()
+
+    assert vectors == [[float(len(text))] for text in texts]
+    assert [[len(text) for text in call] for call in encoder.calls] == [[10, 12, 19], [150, 200]]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    encoder = RecordingEncoder()
+    scheduler = EmbeddingScheduler(encoder, max_batch_size=3, max_wait_ms=50)
+
+    vectors = scheduler.embed_many([f"t{i}" for i in range(7)])
+    scheduler.close()
+
+    assert vectors == [[2.0]] * 7
+    assert [len(call) for call in encoder.calls] == [3, 3, 1]
+
+
+def test_requests_arriving_during_inference_form_the_next_batch():
+    encoder = RecordingEncoder(delay=0.2)
+    scheduler = EmbeddingScheduler(encoder, max_batch_size=16, max_wait_ms=0)
+
+    first = scheduler.submit("first")
+    threading.Event().wait(0.05)  # 1件目の推論中に届く
+    rest = [scheduler.submit(f"next{i}") for i in range(5)]
+    [future.result() for future in [first] + rest]
+    scheduler.close()
+
+    assert [len(call) for call in encoder.calls] == [1, 5]
+
+
+def test_async_interface_batches_tasks():
+    encoder = RecordingEncoder()
+    scheduler = EmbeddingScheduler(encoder, max_batch_size=16, max_wait_ms=100, length_ratio=0)
+
+    async def run():
+        single = asyncio.create_task(scheduler.embed_async("x"))
+        many = await scheduler.embed_many_async(["yy", "zzz"])
+        return await single, many
+
+    single, many = asyncio.run(run())
+    scheduler.close()
+
+    assert single == [1.0] and many == [[2.0], [3.0]]
+    assert len(encoder.calls) == 1
+
+
+def test_errors_are_raised_to_every_caller_and_closed_scheduler_rejects():
+    def broken(texts):
+        raise RuntimeError("model failed")
+    scheduler = EmbeddingScheduler(broken, max_wait_ms=50)
+
+    futures = [scheduler.submit("a"), scheduler.submit("b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result()
+    scheduler.close()
+
+    with pytest.raises(RuntimeError, match="closed"):
+        scheduler.submit("c")
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# 起動時に読み込んではいけない (実際に使う時に resource_manager などから読み込む) 重い依存ライブラリ
+HEAVY_MODULES = ('numpy', 'torch', 'sentence_transformers', 'chromadb', 'ollama', 'boto3', 'psycopg')
+# 'import cli' の累計のimport時間の上限 (遅いCI向けに IMPORT_TIME_BUDGET_MS で変更できる)
+IMPORT_TIME_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', '300'))
+
+
+def run_python(*args, env=None):
+    result = subprocess.run(
+        [sys.executable, *args], cwd=REPO_ROOT, capture_output=True, text=True,
+        env={**os.environ, **(env or {})}, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+@pytest.mark.parametrize('environment', ['local', 'aws'])
+def test_entry_points_do_not_import_heavy_dependencies(environment):
+    code = (
+        "import sys, cli, main_logic, db_importer\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+
+    result = run_python('-c', code, env={'ENV': environment})
+
+    assert result.stdout.strip() == ""
+
+
+def test_cli_help_does_not_import_main_logic():
+    code = (
+        "import runpy, sys\n"
+        "sys.argv = ['cli.py', '--help']\n"
+        "try:\n"
+        "    runpy.run_path('cli.py', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print('main_logic' in sys.modules, file=sys.stderr)"
+    )
+
+    result = run_python('-c', code)
+
+    assert "generate" in result.stdout
+    assert result.stderr.strip().splitlines()[-1] == "False"
+
+
+def test_cli_import_time_is_within_budget():
+    result = run_python('-X', 'importtime', '-c', 'import cli')
+
+    # 出力の形式: "import time: self [us] | cumulative | imported package"
+    cumulative_us = next(
+        int(line.split('|')[1]) for line in reversed(result.stderr.splitlines())
+        if line.split('|')[-1].strip() == 'cli'
+    )
+    assert cumulative_us / 1000 < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,92 @@
+import pytest
+
+import db_importer
+import main_logic
+import resource_manager
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+
+@pytest.fixture
+def lexical_index(tmp_path, monkeypatch):
+    index = LexicalIndex(str(tmp_path / 'index.sqlite3'), n=2)
+    monkeypatch.setattr(resource_manager, 'get_lexical_index', lambda: index)
+    yield index
+    index.close()
+
+
+def test_tokenize_makes_character_bigrams():
+    assert tokenize("【不具合】 ＡＢ x", n=2) == ["【不", "不具", "具合", "合】", "ab", "x"]
+
+
+def test_search_ranks_exact_term_matches(lexical_index):
+    lexical_index.upsert(
+        ['a', 'b', 'c'],
+        ['■ 機能系 【機能概要】ダッシュボード', '■ 不具合系 【不具合概要】パスワード再設定', 'レビュー: パスワードの表記'],
+        [{'content_type': 'release_note'}, {'content_type': 'release_note'}, {'content_type': 'review_comment'}]
+    )
+
+    hits = lexical_index.search("パスワード再設定の不具合", 5)
+    comments = lexical_index.search("パスワード再設定の不具合", 5, where={'content_type': 'review_comment'})
+
+    assert [hit['id'] for hit in hits] == ['b', 'c', 'a']
+    assert [hit['id'] for hit in comments] == ['c']
+    assert comments[0]['document'] == 'レビュー: パスワードの表記'
+
+
+def test_updates_and_deletes_are_persisted(lexical_index, tmp_path):
+    lexical_index.upsert(['a', 'b'], ['ログイン画面', '画像のアップロード'], [{}, {}])
+    assert [hit['id'] for hit in lexical_index.search("ログイン", 5)] == ['a']
+
+    lexical_index.upsert(['a'], ['検索機能'], [{}])
+    lexical_index.delete(['b'])
+    reopened = LexicalIndex(str(tmp_path / 'index.sqlite3'), n=2)
+
+    for index in (lexical_index, reopened):
+        assert index.search("ログイン", 5) == []
+        assert [hit['id'] for hit in index.search("検索", 5)] == ['a']
+        assert index.search("画像", 5) == []
+    assert lexical_index.missing_ids(['a', 'b']) == ['b']
+
+
+def test_reciprocal_rank_fusion_prefers_items_ranked_by_both():
+    vector_hits = [{'id': 'x'}, {'id': 'y'}, {'id': 'z'}]
+    lexical_hits = [{'id': 'y'}]
+
+    fused = reciprocal_rank_fusion([vector_hits, lexical_hits], 2, k=60)
+
+    assert [hit['id'] for hit in fused] == ['y', 'x']
+    assert fused[0]['rrf_score'] == pytest.approx(1 / 62 + 1 / 61)
+
+
+def test_import_keeps_lexical_index_in_sync(lexical_index, fake_store, fake_encoder, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    ticket = {"ticket_id": "T-1", "final_release_note": "ログイン",
+              "review_comments": [{"comment_text": "表記ゆれ", "context_line": ""}]}
+    monkeypatch.setattr(resource_manager, 'get_lexical_index', lambda: None)
+    db_importer.import_documents([ticket], fake_store, fake_encoder, incremental=True)
+    monkeypatch.setattr(resource_manager, 'get_lexical_index', lambda: lexical_index)
+
+    # 転置インデックスを後から有効にした場合、変更のないアイテムも登録される
+    db_importer.import_documents([ticket], fake_store, fake_encoder, incremental=True)
+    assert len(lexical_index) == 2
+
+    ticket["review_comments"] = []
+    db_importer.import_documents([ticket], fake_store, fake_encoder, incremental=True)
+    assert lexical_index.missing_ids(["T-1_note", "T-1_comment_0"]) == ["T-1_comment_0"]
+
+
+def test_hybrid_retrieval_finds_exact_term_match(local_environment, lexical_index, fake_encoder):
+    tickets = [
+        {"ticket_id": "T-1", "final_release_note": "■ 機能系 【機能概要】一覧画面の表示を改善", "review_comments": []},
+        {"ticket_id": "T-2", "final_release_note": "■ 不具合系 【不具合概要】二段階認証", "review_comments": []},
+    ]
+    db_importer.import_documents(tickets, local_environment, fake_encoder)
+    query = "二段階認証の設定に進めず困っているので直したい"  # 文字数はT-1に近いが、語句はT-2と一致する
+    vector = main_logic.get_embeddings_local([query], fake_encoder)[0]
+
+    vector_only = main_logic.query_db_batch([vector], local_environment, n_results=1)
+    hybrid = main_logic.query_db_batch([vector], local_environment, n_results=1, texts=[query])
+
+    assert "一覧画面" in vector_only[0][0]["final_release_note"]
+    assert "二段階認証" in hybrid[0][0]["final_release_note"]
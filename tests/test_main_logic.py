@@ -0,0 +1,111 @@
+import pytest
+
+import db_importer
+import main_logic
+
+
+@pytest.fixture
+def imported(local_environment, fake_encoder):
+    tickets = [
+        {
+            "ticket_id": "T-1",
+            "final_release_note": "■ 機能系\n【機能概要】ログイン",
+            "review_comments": [{"comment_text": "「メリット」の表現が弱い", "context_line": "【メリット】"}],
+        },
+        {"ticket_id": "T-2", "final_release_note": "■ 不具合系\n【不具合概要】画像", "review_comments": []},
+    ]
+    db_importer.import_documents(tickets, local_environment, fake_encoder)
+    return local_environment
+
+
+def test_generate_stream_yields_chunks_and_records_timing(imported, fake_llm_client):
+    stream = main_logic.generate_release_note_draft_stream("新しいログイン画面を作る")
+
+    chunks = list(stream)
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == fake_llm_client.response
+    assert stream.time_to_first_token is not None
+    assert stream.total_time >= stream.time_to_first_token
+    assert "新しいログイン画面を作る" in fake_llm_client.prompts[0]
+
+
+def test_generate_returns_full_text(imported, fake_llm_client):
+    assert main_logic.generate_release_note_draft("仕様") == fake_llm_client.response
+
+
+def test_review_uses_only_review_comments(imported, fake_llm_client):
+    result = main_logic.review_release_note("■ 機能系\n【メリット】便利になります。")
+
+    assert result == fake_llm_client.response
+    assert "「メリット」の表現が弱い" in fake_llm_client.prompts[0]
+    assert "【不具合概要】" not in fake_llm_client.prompts[0]
+
+
+def test_llm_failure_is_reported_in_the_stream(imported, fake_llm_client, monkeypatch):
+    def broken_chat(**kwargs):
+        raise ConnectionError("connection refused")
+    monkeypatch.setattr(fake_llm_client, 'chat', broken_chat)
+
+    assert main_logic.generate_release_note_draft("仕様").startswith("[ERROR]")
+
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    from response_cache import ResponseCache
+    import resource_manager
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite3'), max_entries=10, ttl_seconds=60,
+                          similarity_threshold=0.99, version="test")
+    monkeypatch.setattr(resource_manager, 'get_response_cache', lambda: cache)
+    return cache
+
+
+def test_repeated_request_is_served_from_response_cache(imported, fake_llm_client, response_cache):
+    first = main_logic.generate_release_note_draft("仕様")
+    second = main_logic.generate_release_note_draft("仕様")
+
+    assert first == second == fake_llm_client.response
+    assert len(fake_llm_client.prompts) == 1
+
+
+def test_bypass_flag_skips_response_cache(imported, fake_llm_client, response_cache):
+    main_logic.generate_release_note_draft("仕様")
+    main_logic.generate_release_note_draft("仕様", use_cache=False)
+
+    assert len(fake_llm_client.prompts) == 2
+
+
+def test_errors_are_not_cached(imported, fake_llm_client, response_cache, monkeypatch):
+    def broken_chat(**kwargs):
+        raise ConnectionError("connection refused")
+    monkeypatch.setattr(fake_llm_client, 'chat', broken_chat)
+
+    main_logic.generate_release_note_draft("仕様")
+
+    assert len(response_cache) == 0
+
+
+def test_lambda_handler_routes_api_gateway_events(imported, fake_llm_client):
+    import base64
+    import json
+    generate = main_logic.lambda_handler({"path": "/generate", "body": json.dumps({"design_doc": "仕様"})}, None)
+    review = main_logic.lambda_handler({"path": "/prod/review/", "isBase64Encoded": True,
+                                        "body": base64.b64encode(json.dumps({"text": "ノート"}).encode()).decode()}, None)
+
+    assert generate["statusCode"] == 200
+    assert json.loads(generate["body"]) == {"output": fake_llm_client.response}
+    assert review["statusCode"] == 200
+    assert main_logic.lambda_handler({"path": "/generate", "body": "{}"}, None)["statusCode"] == 400
+    assert main_logic.lambda_handler({"path": "/generate", "body": "not json"}, None)["statusCode"] == 400
+    assert main_logic.lambda_handler({"path": "/other"}, None)["statusCode"] == 404
+
+
+def test_lambda_handler_returns_500_when_processing_fails(imported, monkeypatch):
+    import json
+    import config
+    monkeypatch.setattr(config, 'ENVIRONMENT', 'unknown')
+
+    response = main_logic.lambda_handler({"path": "/review", "body": json.dumps({"text": "ノート"})}, None)
+
+    assert response["statusCode"] == 500
+    assert "Invalid ENVIRONMENT setting" in json.loads(response["body"])["error"]
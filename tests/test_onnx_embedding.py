@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import config
+
+tokenizers = pytest.importorskip('tokenizers')
+
+from onnx_embedding import OnnxEmbeddingModel  # noqa: E402
+
+PARITY_TEXTS = [
+    "ログイン画面にパスワードの表示切り替えボタンを追加しました。",
+    "■ 機能系\n【機能概要】CSVエクスポートの文字コードをUTF-8に統一",
+    "Fixed a crash when the export file name contains spaces.",
+    "短い",
+]
+
+
+class FakeSession:
+    """各トークンの隠れ状態を [トークンID, 1] とするONNX Runtimeのセッションのフェイク。"""
+
+    def __init__(self, input_names=('input_ids', 'attention_mask', 'token_type_ids')):
+        self.input_names = input_names
+        self.feeds = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name=name) for name in self.input_names]
+
+    def run(self, output_names, feeds):
+        self.feeds.append(feeds)
+        ids = feeds['input_ids'].astype(np.float32)
+        return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+
+def make_tokenizer():
+    vocab = {"[PAD]": 0, "[UNK]": 1, "a": 2, "b": 3, "c": 4}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    return tokenizer
+
+
+def test_mean_pooling_ignores_padding_and_keeps_input_order():
+    session = FakeSession(input_names=('input_ids', 'attention_mask'))
+    model = OnnxEmbeddingModel(session, make_tokenizer(), max_seq_length=8)
+
+    vectors = model.encode(["a", "c c b", "b"], batch_size=2)
+
+    expected = np.array([[2.0, 1.0], [(4 + 4 + 3) / 3, 1.0], [3.0, 1.0]])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(vectors, expected, rtol=1e-6)
+    # 長い順に並べてバッチにし、モデルが受け付ける入力だけを渡す
+    assert [feeds['input_ids'].shape for feeds in session.feeds] == [(2, 3), (1, 1)]
+    assert all(set(feeds) == {'input_ids', 'attention_mask'} for feeds in session.feeds)
+
+
+def test_inputs_are_truncated_to_max_seq_length():
+    session = FakeSession()
+    model = OnnxEmbeddingModel(session, make_tokenizer(), max_seq_length=4)
+
+    vector = model.encode("a b c a b c a b c")
+
+    assert session.feeds[0]['input_ids'].shape == (1, 4)
+    assert vector.shape == (2,)
+    assert np.linalg.norm(vector) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('quantization, min_similarity', [('none', 0.999), ('int8', 0.98)])
+def test_onnx_output_agrees_with_sentence_transformers(quantization, min_similarity):
+    sentence_transformers = pytest.importorskip('sentence_transformers')
+    pytest.importorskip('onnxruntime')
+    if quantization == 'int8':
+        pytest.importorskip('onnx')
+    from onnx_embedding import load_onnx_model
+    try:
+        reference = sentence_transformers.SentenceTransformer(config.LOCAL_EMBEDDING_MODEL, device='cpu')
+        model = load_onnx_model(quantization=quantization)
+    except OSError as e:
+        pytest.skip(f"Model files are not available: {e}")
+
+    expected = reference.encode(PARITY_TEXTS, normalize_embeddings=True)
+    actual = model.encode(PARITY_TEXTS)
+
+    similarities = (expected * actual).sum(axis=1)
+    assert similarities.min() >= min_similarity
@@ -0,0 +1,68 @@
+import pytest
+
+import main_logic
+from prompt_builder import build_prompt, estimate_tokens, render_context
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    import config
+
+    def set_budget(tokens):
+        monkeypatch.setattr(config, 'PROMPT_TOKEN_BUDGET', tokens)
+    return set_budget
+
+
+def test_estimate_tokens_counts_japanese_per_character():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("ログイン画面 ok") == 6 + 1
+
+
+def test_render_context_is_compact_and_drops_empty_values():
+    content = {"retrieved_release_note": "■ 機能系\n", "retrieved_review_comments": [
+        {"comment_text": "表記", "context_line": ""}, {"comment_text": "表記", "context_line": ""}]}
+
+    assert render_context(content) == '{"retrieved_release_note":"■ 機能系","retrieved_review_comments":[{"comment_text":"表記"}]}'
+    assert render_context({"retrieved_release_note": "", "retrieved_review_comments": []}) == ""
+
+
+def test_empty_and_duplicate_context_is_dropped(budget):
+    budget(1000)
+    prompt = main_logic.make_generate_prompt("仕様", [
+        {"final_release_note": "ノートA", "review_comments": []},
+        {"final_release_note": "", "review_comments": []},
+        {"final_release_note": "ノートA", "review_comments": []},
+        {"final_release_note": "ノートB", "review_comments": []},
+    ])
+
+    prompt_string, stats = build_prompt(prompt)
+
+    assert prompt_string.count("ノートA") == 1
+    assert "Retrieved Context 2: {\"retrieved_release_note\":\"ノートB\"}" in prompt_string
+    assert stats["context_items"] == 2 and stats["dropped_items"] == 2 and stats["omitted_items"] == 0
+    assert stats["tokens"] == estimate_tokens(prompt_string) <= 1000
+
+
+def test_context_is_added_in_rank_order_within_budget(budget):
+    docs = [{"final_release_note": f"過去のノート{i}" * 20, "review_comments": []} for i in range(5)]
+    prompt = main_logic.make_generate_prompt("仕様", docs)
+    budget(build_prompt(prompt)[1]["tokens"] - 100)  # 1項目は約150トークン
+
+    prompt_string, stats = build_prompt(prompt)
+
+    assert stats["tokens"] <= stats["budget"]
+    assert stats["context_items"] == 4 and stats["omitted_items"] == 1
+    assert "過去のノート0" in prompt_string and "過去のノート4" not in prompt_string
+
+
+def test_user_input_is_truncated_when_it_exceeds_budget(budget):
+    budget(300)
+    prompt = main_logic.make_review_prompt("長い" * 500, [
+        {"comment_text": "表記", "ticket_id": "T-1", "context_line": ""}])
+
+    prompt_string, stats = build_prompt(prompt)
+
+    assert stats["truncated"] and stats["context_items"] == 0 and stats["omitted_items"] == 1
+    assert stats["tokens"] <= 300
+    assert "...(truncated)" in prompt_string
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+import resource_manager
+
+
+class FakeDbClient:
+    def __init__(self):
+        self.get_calls = 0
+        self.closed = False
+
+    def get_collection(self, name):
+        self.get_calls += 1
+        return ('collection', name)
+
+    def get_or_create_collection(self, name):
+        return self.get_collection(name)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_db_client(monkeypatch):
+    resource_manager.shutdown()
+    client = FakeDbClient()
+    monkeypatch.setattr(resource_manager, 'get_db_client', lambda: client)
+    yield client
+    resource_manager.shutdown()
+
+
+def test_collection_is_created_once_across_threads(fake_db_client):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(resource_manager.get_collection('docs')))
+        for _ in range(16)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [('collection', 'docs')] * 16
+    assert fake_db_client.get_calls == 1
+
+
+def test_shutdown_closes_and_releases_resources(fake_db_client, monkeypatch):
+    monkeypatch.setattr(resource_manager, '_resources', {'db_client': fake_db_client})
+
+    resource_manager.shutdown()
+
+    assert fake_db_client.closed
+    assert resource_manager._resources == {}
+
+
+def test_embedding_cache_disabled_returns_none(monkeypatch):
+    monkeypatch.setattr(resource_manager.config, 'EMBEDDING_CACHE_ENABLED', False)
+
+    assert resource_manager.get_embedding_cache() is None
@@ -0,0 +1,72 @@
+import time
+
+from response_cache import ResponseCache
+
+
+def make_cache(tmp_path, **kwargs):
+    options = dict(max_entries=10, ttl_seconds=60, similarity_threshold=0.95, version="1")
+    options.update(kwargs)
+    return ResponseCache(str(tmp_path / 'responses.sqlite3'), **options)
+
+
+def test_exact_hit_requires_same_kind_model_and_prompt(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('generate', 'llama3', 'prompt', 'answer')
+
+    assert cache.get('generate', 'llama3', 'prompt') == ('answer', 'exact')
+    assert cache.get('review', 'llama3', 'prompt') == (None, None)
+    assert cache.get('generate', 'other-model', 'prompt') == (None, None)
+    assert cache.get('generate', 'llama3', 'prompt!') == (None, None)
+
+
+def test_semantic_hit_uses_similarity_threshold(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('generate', 'llama3', 'prompt a', 'answer a', [1.0, 0.0, 0.0])
+
+    assert cache.get('generate', 'llama3', 'prompt b', [0.99, 0.05, 0.0]) == ('answer a', 'semantic')
+    assert cache.get('generate', 'llama3', 'prompt b', [0.5, 0.5, 0.0]) == (None, None)
+    assert cache.get('review', 'llama3', 'prompt b', [1.0, 0.0, 0.0]) == (None, None)
+
+
+def test_version_tag_invalidates_entries(tmp_path):
+    make_cache(tmp_path, version="1").put('generate', 'llama3', 'prompt', 'old', [1.0, 0.0])
+
+    cache = make_cache(tmp_path, version="2")
+
+    assert cache.get('generate', 'llama3', 'prompt', [1.0, 0.0]) == (None, None)
+
+
+def test_expired_entries_are_ignored(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, ttl_seconds=10)
+    cache.put('generate', 'llama3', 'prompt', 'answer', [1.0, 0.0])
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+
+    assert cache.get('generate', 'llama3', 'prompt', [1.0, 0.0]) == (None, None)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.put('generate', 'm', 'a', 'A')
+    cache.put('generate', 'm', 'b', 'B')
+    cache.get('generate', 'm', 'a')
+    cache.put('generate', 'm', 'c', 'C')
+
+    assert len(cache) == 2
+    assert cache.get('generate', 'm', 'b') == (None, None)
+    assert cache.get('generate', 'm', 'a') == ('A', 'exact')
+
+
+def test_semantic_lookup_skips_an_expired_best_match(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, ttl_seconds=10)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    cache.put('generate', 'llama3', 'prompt old', 'old', [1.0, 0.0])
+    monkeypatch.setattr(time, 'time', lambda: now + 5)
+    cache.put('generate', 'llama3', 'prompt new', 'new', [0.98, 0.1])
+    assert cache.get('generate', 'llama3', 'prompt b', [1.0, 0.0]) == ('old', 'semantic')
+
+    # 最も近いエントリが期限切れになっても、有効な次の候補を返す
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('generate', 'llama3', 'prompt b', [1.0, 0.0]) == ('new', 'semantic')
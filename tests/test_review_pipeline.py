@@ -0,0 +1,158 @@
+import threading
+
+import pytest
+
+import config
+import db_importer
+import main_logic
+import resource_manager
+from conftest import FakeCollection
+from vector_store import ChromaVectorStore
+
+TICKETS = [
+    {
+        "ticket_id": "T-1",
+        "final_release_note": "■ 機能系\n【機能概要】ログイン",
+        "review_comments": [{"comment_text": "「メリット」の表現が弱い", "context_line": "【メリット】"},
+                            {"comment_text": "用語を統一", "context_line": ""}],
+    },
+    {"ticket_id": "T-2", "final_release_note": "■ 不具合系\n【不具合概要】画像", "review_comments": []},
+]
+
+
+class RecordingCollection(FakeCollection):
+    """queryに渡されたwhereを記録するコレクション。"""
+
+    def __init__(self):
+        super().__init__()
+        self.wheres = []
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        self.wheres.append(where)
+        return super().query(query_embeddings, n_results, where, include)
+
+
+@pytest.fixture
+def comment_store(local_environment, monkeypatch):
+    """レビューコメント専用のインデックスを有効にし、全アイテムのストアとは別のフェイクを使う。"""
+    store = ChromaVectorStore(RecordingCollection())
+    monkeypatch.setattr(config, 'REVIEW_COMMENT_INDEX_ENABLED', True)
+    # フェイクのEmbeddingはテキスト長からベクトルを作るため、近似重複はまとめない
+    monkeypatch.setattr(config, 'REVIEW_COMMENT_DEDUP_THRESHOLD', 1.01)
+    monkeypatch.setattr(resource_manager, '_resources', {})
+    monkeypatch.setattr(resource_manager, 'get_vector_store',
+                        lambda name=None, create=False: store if name else local_environment)
+    return store
+
+
+def test_importer_populates_the_review_comment_index(local_environment, comment_store, fake_encoder):
+    db_importer.import_documents(TICKETS, local_environment, fake_encoder, incremental=True,
+                                 comment_store=comment_store)
+
+    assert sorted(item_id for item_id, _ in comment_store.iter_metadata()) == ["T-1_comment_0", "T-1_comment_1"]
+    assert local_environment.count() == 4
+    # 専用のインデックスは格納済みのベクトルから作るため、再ベクトル化しない
+    assert fake_encoder.encoded_count == 4
+
+    changed = [dict(TICKETS[0], review_comments=TICKETS[0]['review_comments'][:1]), TICKETS[1]]
+    db_importer.import_documents(changed, local_environment, fake_encoder, incremental=True,
+                                 comment_store=comment_store)
+    assert [item_id for item_id, _ in comment_store.iter_metadata()] == ["T-1_comment_0"]
+
+    db_importer.import_documents([TICKETS[1]], local_environment, fake_encoder, incremental=True,
+                                 comment_store=comment_store)
+    assert comment_store.count() == 0
+
+
+def test_comment_index_is_rebuilt_only_when_comments_change(local_environment, comment_store, fake_encoder,
+                                                             monkeypatch):
+    rebuilds = []
+    original_rebuild = db_importer.rebuild_review_comment_index
+
+    def rebuild(store, comment_store, index=None):
+        rebuilds.append(store)
+        return original_rebuild(store, comment_store, index)
+    monkeypatch.setattr(db_importer, 'rebuild_review_comment_index', rebuild)
+
+    def run(tickets, prune=True):
+        db_importer.import_documents(tickets, local_environment, fake_encoder, incremental=True, prune=prune,
+                                     comment_store=comment_store)
+        return len(rebuilds)
+
+    assert run(TICKETS) == 1
+    # 変更がない場合や、リリースノートだけが変わった場合は作り直さない
+    assert run(TICKETS) == 1
+    assert run([dict(TICKETS[0], final_release_note="■ 機能系\n【機能概要】ログイン画面"), TICKETS[1]]) == 1
+    assert run([TICKETS[1]], prune=False) == 1
+    # コメントの変更と、チケットごとの削除 (prune) では作り直す
+    changed = dict(TICKETS[0], review_comments=TICKETS[0]['review_comments'][:1])
+    assert run([changed, TICKETS[1]]) == 2
+    assert run([TICKETS[1]]) == 3
+    assert comment_store.count() == 0
+
+
+def test_review_queries_the_comment_index_without_filtering(local_environment, comment_store, fake_encoder,
+                                                           fake_llm_client):
+    db_importer.import_documents(TICKETS, local_environment, fake_encoder, comment_store=comment_store)
+
+    main_logic.review_release_note("■ 機能系\n【メリット】便利になります。")
+
+    assert comment_store.collection.wheres == [None]
+    assert "「メリット」の表現が弱い" in fake_llm_client.prompts[0]
+    assert "【不具合概要】" not in fake_llm_client.prompts[0]
+
+
+def test_review_falls_back_to_the_main_store_when_the_index_is_empty(local_environment, comment_store,
+                                                                     fake_encoder, fake_llm_client):
+    db_importer.import_documents(TICKETS, local_environment, fake_encoder)
+
+    main_logic.review_release_note("■ 機能系\n【メリット】便利になります。")
+
+    assert comment_store.collection.wheres == []
+    assert "「メリット」の表現が弱い" in fake_llm_client.prompts[0]
+    assert "【不具合概要】" not in fake_llm_client.prompts[0]
+
+
+def test_pipeline_retrieves_comments_while_the_draft_is_generated(local_environment, fake_encoder,
+                                                                 fake_llm_client, monkeypatch):
+    db_importer.import_documents(TICKETS, local_environment, fake_encoder)
+    draft_started = threading.Event()
+    retrieved_during_draft = []
+    original_query = main_logic.query_review_comments_batch
+
+    def query_review_comments_batch(*args, **kwargs):
+        retrieved_during_draft.append(draft_started.wait(timeout=5))
+        return original_query(*args, **kwargs)
+    monkeypatch.setattr(main_logic, 'query_review_comments_batch', query_review_comments_batch)
+    original_chat = fake_llm_client.chat
+
+    def chat(**kwargs):
+        draft_started.set()
+        return original_chat(**kwargs)
+    monkeypatch.setattr(fake_llm_client, 'chat', chat)
+
+    stages = []
+    for kind, stream in main_logic.generate_then_review_stream("新しいログイン画面のメリット"):
+        stages.append((kind, stream.text()))
+
+    assert stages == [('generate', fake_llm_client.response), ('review', fake_llm_client.response)]
+    assert retrieved_during_draft == [True]
+    # 仕様書のベクトル化は1回だけで、雛形は再ベクトル化しない
+    assert fake_encoder.calls[-1] == ["新しいログイン画面のメリット"]
+    assert len(fake_encoder.calls) == 2
+    assert fake_llm_client.response in fake_llm_client.prompts[1]
+    assert "「メリット」の表現が弱い" in fake_llm_client.prompts[1]
+
+
+def test_pipeline_skips_review_when_the_draft_fails(local_environment, fake_encoder, fake_llm_client,
+                                                    monkeypatch):
+    db_importer.import_documents(TICKETS, local_environment, fake_encoder)
+
+    def broken_chat(**kwargs):
+        raise ConnectionError("connection refused")
+    monkeypatch.setattr(fake_llm_client, 'chat', broken_chat)
+
+    stages = [(kind, stream.text()) for kind, stream in main_logic.generate_then_review_stream("仕様")]
+
+    assert [kind for kind, _ in stages] == ['generate']
+    assert stages[0][1].startswith("[ERROR]")
@@ -0,0 +1,218 @@
+import asyncio
+import json
+
+import pytest
+
+import db_importer
+import resource_manager
+from server import AssistantServer, HttpError, percentile
+from stub_llm import StubLLMClient
+
+
+@pytest.fixture
+def stub_llm(local_environment, fake_encoder, monkeypatch):
+    tickets = [
+        {"ticket_id": "T-1", "final_release_note": "■ 機能系\n【機能概要】ログイン",
+         "review_comments": [{"comment_text": "表記を統一", "context_line": ""}]},
+    ]
+    db_importer.import_documents(tickets, local_environment, fake_encoder)
+    fake_encoder.calls.clear()
+    client = StubLLMClient(response="■ 機能系\n【機能概要】スタブの応答", delay=0.2, chunk_size=4)
+    monkeypatch.setattr(resource_manager, 'get_llm_client', lambda: client)
+    return client
+
+
+async def request(port, method, path, body=None):
+    """1回のリクエストを送り、(ステータス, JSONの応答またはストリーミングのチャンクのリスト) を返す。"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n"
+                 f"Connection: close\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"Transfer-Encoding: chunked" not in head:
+        return status, json.loads(payload)
+    chunks = []
+    while True:
+        size, _, payload = payload.partition(b"\r\n")
+        if int(size, 16) == 0:
+            return status, chunks
+        chunks.append(payload[:int(size, 16)].decode('utf-8'))
+        payload = payload[int(size, 16) + 2:]
+
+
+def serve(scenario, **kwargs):
+    """サーバーを空いているポートで起動し、scenario(server) を実行する。"""
+    async def run():
+        server = AssistantServer(host='127.0.0.1', port=0, **kwargs)
+        await server.start()
+        try:
+            return await scenario(server)
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+def test_percentile_uses_nearest_rank():
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+    assert [percentile(values, q) for q in (50, 90, 99)] == [5, 9, 10]
+    assert percentile([], 50) is None
+
+
+def test_concurrent_requests_share_one_encode_call(stub_llm, fake_encoder, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'EMBEDDING_BATCH_MAX_WAIT_MS', 100)
+
+    async def scenario(server):
+        return await asyncio.gather(*(
+            request(server.port, 'POST', '/generate', {"text": f"仕様{i}"}) for i in range(6)
+        ))
+
+    responses = serve(scenario, llm_concurrency=6)
+
+    assert [status for status, _ in responses] == [200] * 6
+    assert all(body["output"] == stub_llm.response for _, body in responses)
+    assert len(fake_encoder.calls) == 1
+    assert sorted(fake_encoder.calls[0]) == sorted(f"仕様{i}" for i in range(6))
+
+
+def test_identical_in_flight_requests_are_coalesced(stub_llm):
+    async def scenario(server):
+        responses = await asyncio.gather(*(
+            request(server.port, 'POST', '/review', {"release_note": "同じリリースノート"}) for _ in range(5)
+        ))
+        return responses, server.snapshot()
+
+    responses, stats = serve(scenario)
+
+    assert stub_llm.calls == 1
+    assert sorted(body["coalesced"] for _, body in responses) == [False, True, True, True, True]
+    assert stats["coalesced"] == 4 and stats["in_flight"] == 0
+
+
+def test_requests_beyond_the_queue_are_rejected(stub_llm):
+    async def scenario(server):
+        return await asyncio.gather(*(
+            request(server.port, 'POST', '/generate', {"text": f"仕様{i}"}) for i in range(4)
+        ))
+
+    responses = serve(scenario, llm_concurrency=1, max_queue=1)
+
+    assert sorted(status for status, _ in responses) == [200, 200, 503, 503]
+    assert stub_llm.calls == 2
+
+
+def test_streaming_response_is_sent_in_chunks(stub_llm):
+    async def scenario(server):
+        return await request(server.port, 'POST', '/generate', {"text": "仕様", "stream": True})
+
+    status, chunks = serve(scenario)
+
+    assert status == 200
+    assert len(chunks) > 1
+    assert "".join(chunks) == stub_llm.response
+
+
+def test_stats_report_latency_percentiles(stub_llm):
+    async def scenario(server):
+        await request(server.port, 'POST', '/generate', {"text": "仕様"})
+        await request(server.port, 'POST', '/generate', {})
+        return await request(server.port, 'GET', '/stats')
+
+    status, stats = serve(scenario)
+
+    latency = stats["latency_ms"]["/generate"]
+    assert status == 200
+    assert latency["count"] == 2 and latency["status"] == {"200": 1, "400": 1}
+    assert latency["p50"] <= latency["p99"] <= latency["max"]
+    assert stats["embedding_batches"] == 1
+
+
+def test_invalid_requests_are_rejected(stub_llm):
+    async def scenario(server):
+        return [
+            await request(server.port, 'POST', '/generate', {"stream": True}),
+            await request(server.port, 'GET', '/review'),
+            await request(server.port, 'GET', '/unknown'),
+            await request(server.port, 'GET', '/healthz'),
+        ]
+
+    statuses = [status for status, _ in serve(scenario)]
+
+    assert statuses == [400, 405, 404, 200]
+
+
+class TrackingLLMClient(StubLLMClient):
+    """ストリーミングで返したチャンク数と、ストリームが閉じられたかどうかを記録するスタブ。"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.streamed = 0
+        self.closed = False
+
+    def _stream(self, chunks):
+        try:
+            for chunk in super()._stream(chunks):
+                self.streamed += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_disconnected_stream_stops_reading_the_llm_and_holds_the_slot_until_then(stub_llm, monkeypatch):
+    client = TrackingLLMClient(response="あ" * 400, delay=2.0, chunk_size=4)
+    monkeypatch.setattr(resource_manager, 'get_llm_client', lambda: client)
+
+    async def scenario(server):
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        data = json.dumps({"text": "仕様", "stream": True}).encode('utf-8')
+        writer.write(f"POST /generate HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+        await reader.readuntil(b"\r\n\r\n")
+        await reader.readuntil(b"\r\n")
+        writer.close()
+        slots = []
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            slots.append((server._admitted, server._llm_slots.locked(), client.closed))
+            if server._admitted == 0:
+                break
+        return slots
+
+    slots = serve(scenario, llm_concurrency=1)
+
+    # 枠は、LLMの出力を読むスレッドがストリームを閉じてから解放される
+    assert slots[-1] == (0, False, True)
+    assert all(closed for admitted, _, closed in slots if admitted == 0)
+    assert client.streamed < 100
+
+
+def test_stream_failure_after_headers_closes_the_connection(stub_llm, monkeypatch):
+    class BrokenStream:
+        def __iter__(self):
+            yield "途中まで"
+            raise HttpError(502, "stream broken")
+
+    async def prepare(kind, text, use_cache):
+        return BrokenStream()
+
+    async def scenario(server):
+        monkeypatch.setattr(server, '_prepare', prepare)
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        data = json.dumps({"text": "仕様", "stream": True}).encode('utf-8')
+        writer.write(f"POST /generate HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+        raw = await reader.read()
+        writer.close()
+        return raw, server.snapshot()
+
+    raw, stats = serve(scenario)
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    # チャンクの途中で接続を閉じ、終端のチャンクやJSONのエラーは書き込まない
+    assert "途中まで".encode('utf-8') in body
+    assert b"error" not in body and not body.endswith(b"0\r\n\r\n")
+    assert stats["in_flight"] == 0
@@ -0,0 +1,194 @@
+import json
+import threading
+
+import pytest
+
+import config
+import main_logic
+import tracing
+
+
+@pytest.fixture
+def traces():
+    """終わったトレースを記録するエクスポーターを登録する。"""
+    finished = []
+    tracing.add_exporter(finished.append)
+    yield finished
+    tracing.remove_exporter(finished.append)
+
+
+def span_names(trace) -> list:
+    return [span['name'] for span in trace.to_dict()['spans']]
+
+
+def test_spans_are_not_recorded_without_exporters(monkeypatch):
+    monkeypatch.setattr(config, 'TRACE_EXPORTERS', [])
+
+    with tracing.trace('generate') as trace:
+        with tracing.span('embed', texts=1) as span:
+            span.set(chunks=2)
+
+    assert tracing.start('generate') is trace is span
+    assert tracing.current() is trace
+
+
+def test_trace_records_nested_spans_and_attributes(traces):
+    with tracing.trace('import', incremental=True) as trace:
+        with tracing.span('embed', items=3) as outer:
+            outer.set(chunks=4)
+            with tracing.span('store_upsert'):
+                pass
+        trace.set(upserted=3)
+
+    assert traces == [trace]
+    record = trace.to_dict()
+    assert record['name'] == 'import'
+    assert record['attributes'] == {'incremental': True, 'upserted': 3}
+    embed, upsert = record['spans']
+    assert embed['name'] == 'embed' and embed['parent_id'] is None
+    assert embed['attributes'] == {'items': 3, 'chunks': 4}
+    assert upsert['name'] == 'store_upsert' and upsert['parent_id'] == embed['span_id']
+    assert embed['duration_ms'] >= upsert['duration_ms'] >= 0
+
+
+def test_nested_trace_is_recorded_as_a_span(traces):
+    with tracing.trace('bitbucket_sync'):
+        with tracing.trace('import', incremental=True):
+            pass
+
+    assert [trace.name for trace in traces] == ['bitbucket_sync']
+    assert traces[0].to_dict()['spans'][0]['name'] == 'import'
+
+
+def test_bind_propagates_the_trace_to_worker_threads(traces):
+    with tracing.trace('bitbucket_harvest'):
+        with tracing.span('harvest_pull_request') as parent:
+            def fetch():
+                with tracing.span('http_fetch'):
+                    pass
+            worker = threading.Thread(target=tracing.bind(fetch))
+            worker.start()
+            worker.join()
+
+    spans = {span['name']: span for span in traces[0].to_dict()['spans']}
+    assert spans['http_fetch']['parent_id'] == parent.span_id
+
+
+def test_failed_exporter_does_not_break_the_request(traces):
+    def broken(trace):
+        raise OSError("disk full")
+    tracing.add_exporter(broken)
+    try:
+        with tracing.trace('review'):
+            pass
+    finally:
+        tracing.remove_exporter(broken)
+
+    assert len(traces) == 1
+
+
+def test_generate_stream_records_each_stage(local_environment, traces):
+    stream = main_logic.generate_release_note_draft_stream("# 仕様\nログイン機能を追加する。")
+    assert traces == []  # LLMの出力を返し終えるまでは終わらない
+
+    stream.text()
+
+    assert len(traces) == 1
+    record = traces[0].to_dict()
+    assert record['name'] == 'generate'
+    assert ['embed', 'vector_query', 'prompt_build', 'llm'] == [
+        name for name in span_names(traces[0]) if name in ('embed', 'vector_query', 'prompt_build', 'llm')
+    ]
+    spans = {span['name']: span for span in record['spans']}
+    assert spans['embed']['attributes'] == {'texts': 1, 'chunks': 1}
+    assert spans['prompt_build']['attributes']['tokens'] == stream.prompt_stats['tokens']
+    assert spans['llm']['attributes']['output_chars'] == len(stream.text())
+    assert spans['llm']['attributes']['time_to_first_token_ms'] is not None
+    assert record['attributes']['time_to_first_token_ms'] == round(stream.time_to_first_token * 1000, 3)
+
+
+def test_generate_then_review_records_one_trace(local_environment, traces):
+    streams = dict(main_logic.generate_then_review_stream("# 仕様\nログイン機能を追加する。"))
+    streams['review'].text()
+
+    assert [trace.name for trace in traces] == ['generate_review']
+    assert span_names(traces[0]).count('llm') == 2
+
+
+def test_jsonl_exporter_writes_one_line_per_request(monkeypatch, tmp_path, local_environment):
+    path = tmp_path / 'traces' / 'traces.jsonl'
+    monkeypatch.setattr(config, 'TRACE_EXPORTERS', ['jsonl'])
+    monkeypatch.setattr(config, 'TRACE_LOG_PATH', str(path))
+
+    main_logic.generate_release_note_draft("# 仕様\nログイン機能を追加する。")
+    main_logic.review_release_note("■ 機能系\n【機能概要】ログイン機能を追加しました。")
+
+    records = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [record['name'] for record in records] == ['generate', 'review']
+    assert all(record['duration_ms'] > 0 and record['spans'] for record in records)
+
+
+def test_opentelemetry_exporter_converts_spans(traces):
+    pytest.importorskip('opentelemetry.sdk')
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    memory = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(memory))
+
+    with tracing.trace('generate', environment='local'):
+        with tracing.span('embed', texts=1, skipped=None):
+            pass
+    tracing.OpenTelemetryExporter(provider)(traces[0])
+
+    spans = {span.name: span for span in memory.get_finished_spans()}
+    assert spans['embed'].parent.span_id == spans['generate'].context.span_id
+    assert dict(spans['embed'].attributes) == {'texts': 1}
+    assert spans['generate'].attributes['environment'] == 'local'
+
+
+def test_log_level_filters_messages(monkeypatch, capsys):
+    monkeypatch.setattr(config, 'LOG_LEVEL', 'warn')
+    tracing.info("[INFO] hidden")
+    tracing.warn("[WARN] shown")
+    monkeypatch.setattr(config, 'LOG_LEVEL', 'debug')
+    tracing.debug("Fetching: shown")
+
+    assert capsys.readouterr().out == "[WARN] shown\nFetching: shown\n"
+
+
+def test_import_records_batches(fake_store, fake_encoder, traces, monkeypatch):
+    import db_importer
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    documents = [
+        {"ticket_id": f"T-{i}", "final_release_note": f"note {i}", "review_comments": []} for i in range(3)
+    ]
+
+    db_importer.import_documents(documents, fake_store, fake_encoder, incremental=True, batch_size=2)
+
+    record = traces[0].to_dict()
+    assert record['name'] == 'import'
+    assert record['attributes']['upserted'] == 3
+    assert [span['attributes']['items'] for span in record['spans'] if span['name'] == 'embed'] == [2, 1]
+    assert 'prune' in span_names(traces[0])
+
+
+def test_bitbucket_harvest_records_http_fetches(traces):
+    pytest.importorskip('requests')
+    from bitbucket_data_loader import BitbucketClient, load_bitbucket_data
+    from fake_bitbucket import FakeBitbucket
+    pull_requests = [{"id": 1, "title": "PR 1", "hash": "c0ffee0001",
+                      "files": {"10-release.txt": "note", "20-design.md": "design"}, "comments": ["ok"]}]
+    with FakeBitbucket(pull_requests) as fake:
+        client = BitbucketClient(('user', 'pass'), base_url=fake.base_url, requests_per_second=1000)
+        load_bitbucket_data(client=client)
+
+    record = traces[0].to_dict()
+    spans = {span['span_id']: span for span in record['spans']}
+    fetches = [span for span in record['spans'] if span['name'] == 'http_fetch']
+    assert record['attributes'] == {'pull_requests': 1, 'harvested': 1}
+    assert len(fetches) == len(fake.requests)
+    assert all(span['attributes']['status'] == 200 for span in fetches)
+    # PRごとの取得はワーカースレッドで行うが、PRの span の下に記録される
+    assert {spans[span['parent_id']]['name'] for span in fetches} == {'list_pull_requests', 'harvest_pull_request'}
@@ -0,0 +1,222 @@
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+import db_importer
+from numpy_store import NumpyVectorStore
+from vector_store import PgVectorStore, _where_to_sql
+
+
+def add_items(store):
+    store.upsert(
+        ['T-1_note', 'T-1_comment_0', 'T-2_note'],
+        [[1.0, 0.0, 0.0], [0.9, 0.1, 0.0], [0.0, 1.0, 0.0]],
+        ['note 1', 'comment 1', 'note 2'],
+        [
+            {'ticket_id': 'T-1', 'content_type': 'release_note'},
+            {'ticket_id': 'T-1', 'content_type': 'review_comment', 'context_line': 'line'},
+            {'ticket_id': 'T-2', 'content_type': 'release_note'},
+        ]
+    )
+
+
+def test_chroma_store_query_returns_hits(fake_store):
+    add_items(fake_store)
+
+    hits = fake_store.query([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], n_results=2)
+
+    assert [hit['id'] for hit in hits[0]] == ['T-1_note', 'T-1_comment_0']
+    assert hits[1][0]['document'] == 'note 2'
+    assert hits[1][0]['metadata']['ticket_id'] == 'T-2'
+    assert hits[0][0]['distance'] == 0
+
+
+def test_chroma_store_query_filters_by_metadata(fake_store):
+    add_items(fake_store)
+
+    hits = fake_store.query([[0.0, 1.0, 0.0]], n_results=5, where={'content_type': 'review_comment'})
+
+    assert [hit['id'] for hit in hits[0]] == ['T-1_comment_0']
+
+
+def test_chroma_store_iter_metadata_pages(fake_store):
+    add_items(fake_store)
+
+    items = dict(fake_store.iter_metadata(batch_size=2))
+    filtered = dict(fake_store.iter_metadata(where={'ticket_id': {'$in': ['T-2']}}, batch_size=2))
+
+    assert sorted(items) == ['T-1_comment_0', 'T-1_note', 'T-2_note']
+    assert list(filtered) == ['T-2_note']
+
+
+def test_where_to_sql_uses_columns_for_indexed_keys():
+    sql, params = _where_to_sql({'content_type': 'review_comment', 'ticket_id': {'$in': ['T-1', 'T-2']},
+                                 'context_line': {'$eq': 'x'}})
+
+    assert sql == " WHERE content_type = %s AND ticket_id = ANY(%s) AND metadata ->> %s = %s"
+    assert params == ['review_comment', ['T-1', 'T-2'], 'context_line', 'x']
+
+
+def test_where_to_sql_rejects_unknown_operator():
+    with pytest.raises(ValueError):
+        _where_to_sql({'ticket_id': {'$ne': 'T-1'}})
+
+
+@pytest.fixture
+def pg_store():
+    """PG_TEST_DSN (pgvector拡張が使えるPostgreSQL) が設定されている場合のみ実行する。"""
+    dsn = os.getenv('PG_TEST_DSN')
+    if not dsn:
+        pytest.skip("PG_TEST_DSN is not set")
+    pytest.importorskip('psycopg_pool')
+    store = PgVectorStore(dsn, table=f"test_documents_{uuid.uuid4().hex[:8]}", dim=3)
+    yield store
+    with store.pool.connection() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {store.table}")
+    store.close()
+
+
+def test_pg_store_round_trip(pg_store):
+    add_items(pg_store)
+    add_items(pg_store)  # 同じidは上書きされる
+
+    hits = pg_store.query([[1.0, 0.0, 0.0]], n_results=2)
+    comments = pg_store.query([[0.0, 1.0, 0.0]], n_results=5, where={'content_type': 'review_comment'})
+    pg_store.delete(['T-2_note'])
+
+    assert pg_store.count() == 2
+    assert [hit['id'] for hit in hits[0]] == ['T-1_note', 'T-1_comment_0']
+    assert [hit['id'] for hit in comments[0]] == ['T-1_comment_0']
+    assert comments[0][0]['metadata']['context_line'] == 'line'
+    assert sorted(dict(pg_store.iter_metadata(batch_size=1))) == ['T-1_comment_0', 'T-1_note']
+
+
+def test_pg_store_incremental_import(pg_store, fake_encoder, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    tickets = [{"ticket_id": "T-1", "final_release_note": "note",
+                "review_comments": [{"comment_text": "c1", "context_line": ""}]}]
+
+    first = db_importer.import_documents(tickets, pg_store, fake_encoder, incremental=True)
+    second = db_importer.import_documents(tickets, pg_store, fake_encoder, incremental=True)
+
+    assert first['upserted'] == 2
+    assert second == {"tickets": 1, "upserted": 0, "unchanged": 2, "deleted": 0}
+
+
+def test_numpy_store_query_and_filter(tmp_path):
+    store = NumpyVectorStore(str(tmp_path))
+    add_items(store)
+
+    hits = store.query([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], n_results=2)
+    comments = store.query([[0.0, 1.0, 0.0]], n_results=5, where={'content_type': 'review_comment'})
+    none = store.query([[0.0, 1.0, 0.0]], n_results=5, where={'ticket_id': {'$in': ['T-9']}})
+
+    assert [hit['id'] for hit in hits[0]] == ['T-1_note', 'T-1_comment_0']
+    assert hits[0][0]['distance'] == pytest.approx(0.0, abs=1e-6)
+    assert hits[1][0]['document'] == 'note 2'
+    assert [hit['id'] for hit in comments[0]] == ['T-1_comment_0']
+    assert comments[0][0]['metadata'] == {'ticket_id': 'T-1', 'content_type': 'review_comment', 'context_line': 'line'}
+    assert none == [[]]
+
+
+def test_numpy_store_flush_and_reopen(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), dtype='float16')
+    add_items(store)
+    store.flush()
+    reader = NumpyVectorStore(str(tmp_path))
+
+    store.delete(['T-2_note'])
+    store.upsert(['T-3_note'], [[0.0, 0.0, 1.0]], ['ノート 3'], [{'ticket_id': 'T-3', 'content_type': 'release_note'}])
+    store.flush()
+    reopened = NumpyVectorStore(str(tmp_path))
+
+    assert isinstance(reader._snapshot.vectors, np.memmap)
+    assert reader._snapshot.vectors.dtype == np.float16
+    # 書き出し前に開いたストアは、元のスナップショットを読み続けられる
+    assert reader.count() == 3
+    assert sorted(dict(reopened.iter_metadata())) == ['T-1_comment_0', 'T-1_note', 'T-3_note']
+    assert reopened.query([[0.0, 0.0, 1.0]], n_results=1)[0][0]['document'] == 'ノート 3'
+    assert len([entry for entry in os.listdir(tmp_path) if entry.startswith('gen-')]) == 1
+
+
+def test_numpy_store_blocked_search_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 8)).astype(np.float32)
+    store = NumpyVectorStore(str(tmp_path))
+    store.upsert([f"id-{i}" for i in range(300)], vectors.tolist(), [str(i) for i in range(300)],
+                 [{'content_type': 'even' if i % 2 == 0 else 'odd'} for i in range(300)])
+    queries = rng.normal(size=(4, 8)).astype(np.float32)
+
+    found = store._current().search(queries, 5, where={'content_type': 'odd'}, block_size=16)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for query, hits in zip(queries, found):
+        scores = normalized @ (query / np.linalg.norm(query))
+        scores[0::2] = -np.inf
+        assert [row for row, _ in hits] == list(np.argsort(-scores)[:5])
+
+
+def test_numpy_store_incremental_import(tmp_path, fake_encoder, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    tickets = [{"ticket_id": "T-1", "final_release_note": "note",
+                "review_comments": [{"comment_text": "c1", "context_line": ""}]}]
+
+    db_importer.import_documents(tickets, NumpyVectorStore(str(tmp_path)), fake_encoder, incremental=True)
+    stats = db_importer.import_documents(tickets, NumpyVectorStore(str(tmp_path)), fake_encoder, incremental=True)
+
+    assert stats == {"tickets": 1, "upserted": 0, "unchanged": 2, "deleted": 0}
+
+
+def test_numpy_store_incremental_import_does_not_rebuild_per_batch(tmp_path, fake_encoder, monkeypatch):
+    import config
+    from numpy_store import _Snapshot
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ENABLED', False)
+    tickets = [{"ticket_id": f"T-{i}", "final_release_note": f"note {i}",
+                "review_comments": [{"comment_text": f"c{i}", "context_line": ""}]} for i in range(50)]
+    builds = []
+    original = _Snapshot.from_rows.__func__
+    monkeypatch.setattr(_Snapshot, 'from_rows', classmethod(lambda cls, *args: builds.append(1) or original(cls, *args)))
+    store = NumpyVectorStore(str(tmp_path))
+
+    db_importer.import_documents(tickets, store, fake_encoder, incremental=True, batch_size=4)
+    changed = [dict(ticket, final_release_note="changed") if ticket['ticket_id'] == "T-3" else ticket
+               for ticket in tickets[:49]]
+    stats = db_importer.import_documents(changed, store, fake_encoder, incremental=True, batch_size=4)
+
+    # 変更中の差分確認はスナップショットを作り直さず、flush の時だけ作る
+    assert len(builds) == 3  # 空のストア + 2回の flush
+    assert stats == {"tickets": 49, "upserted": 1, "unchanged": 97, "deleted": 2}
+    assert dict(store.iter_metadata(where={'ticket_id': 'T-3', 'content_type': 'release_note'}))[
+        'T-3_note']['ticket_id'] == 'T-3'
+    assert store.count() == 98
+
+
+@pytest.mark.parametrize("quantization", ['int8', 'binary'])
+def test_numpy_store_quantized_search_reranks_with_full_vectors(tmp_path, quantization):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(500, 32)).astype(np.float32)
+    store = NumpyVectorStore(str(tmp_path), quantization=quantization)
+    store.upsert([f"id-{i}" for i in range(500)], vectors, [""] * 500, [{'content_type': 'note'}] * 500)
+    store.flush()
+    reopened = NumpyVectorStore(str(tmp_path), quantization='none')
+
+    # 全件を候補に残せば、元の精度で並べ替えた結果は量子化しない場合と一致する
+    hits = reopened._current().search(vectors[:3], 5, rerank_factor=100)
+    exact = NumpyVectorStore(str(tmp_path / 'exact'))
+    exact.upsert([f"id-{i}" for i in range(500)], vectors, [""] * 500, [{'content_type': 'note'}] * 500)
+
+    assert reopened._current().quantization == quantization
+    expected = exact._current().search(vectors[:3], 5)
+    assert [[row for row, _ in query_hits] for query_hits in hits] == [[row for row, _ in query_hits] for query_hits in expected]
+    assert [distance for _, distance in hits[1]] == pytest.approx([distance for _, distance in expected[1]], abs=1e-5)
+    assert [row for row, _ in hits[0]][0] == 0
+    assert reopened._current().index_nbytes() < exact._current().index_nbytes() / 3
+
+
+def test_numpy_store_rejects_unknown_quantization(tmp_path):
+    with pytest.raises(ValueError):
+        NumpyVectorStore(str(tmp_path), quantization='pq')
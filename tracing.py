@@ -0,0 +1,363 @@
+"""
+処理の段階ごと (モデルのロード、ベクトル化、検索、プロンプト構築、LLM、HTTPの取得など) の所要時間と件数を計測する。
+
+- trace(name, **attributes): 1リクエスト分 (generate, review, import など) のトレースをwith文で囲んで記録する。
+  トレースの実行中に trace を呼んだ場合は、新しいトレースではなくその中の1段階 (span) として記録する。
+- span(name, **attributes): with文で囲んだ段階の所要時間と属性 (件数、トークン数など) を、実行中のトレースに記録する。
+- start / activate: LLMの出力のように、関数から戻った後に終わる処理のトレースに使う (main_logic.TokenStream を参照)。
+- bind(fn): 実行中のトレースをワーカースレッドに引き継ぐ。
+
+終わったトレースはエクスポーター (config.TRACE_EXPORTERS の 'jsonl' と 'otel'、add_exporter で登録した関数) に渡す。
+エクスポーターがない場合、trace と span は何も記録しないオブジェクトを返すため、計測のコストはほぼかからない。
+
+debug / info / warn / error は、config.LOG_LEVEL 以上のレベルのメッセージだけを表示する。
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import config
+
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warn': 30, 'error': 40, 'quiet': 100}
+
+
+def enabled_for(level: str) -> bool:
+    """level のメッセージを表示するかどうかを返す。"""
+    return LOG_LEVELS[level] >= LOG_LEVELS.get(config.LOG_LEVEL, LOG_LEVELS['warn'])
+
+
+def log(level: str, message: str):
+    """config.LOG_LEVEL 以上のレベルであれば、メッセージをそのまま表示する。"""
+    if enabled_for(level):
+        print(message)
+
+
+def debug(message: str):
+    log('debug', message)
+
+
+def info(message: str):
+    log('info', message)
+
+
+def warn(message: str):
+    log('warn', message)
+
+
+def error(message: str):
+    log('error', message)
+
+
+class _Noop:
+    """トレースが無効な場合に trace / span / start が返す、何も記録しないオブジェクト。"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def span(self, name: str, attributes: dict):
+        return self
+
+    def record(self, name: str, started_at: float, ended_at: float, attributes: dict = None, parent: int = None):
+        pass
+
+    def finish(self, **attributes):
+        pass
+
+
+_NOOP = _Noop()
+_current_trace = contextvars.ContextVar('tracing_trace', default=_NOOP)
+_current_span = contextvars.ContextVar('tracing_span', default=None)
+
+
+class Span:
+    """トレースの中の1段階。with文を抜けたときに所要時間をトレースに記録する。"""
+
+    __slots__ = ('trace', 'name', 'attributes', 'span_id', 'parent_id', 'started_at', '_token')
+
+    def __init__(self, trace, name: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """属性 (件数など) を追加する。"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.span_id = self.trace.next_span_id()
+        self.parent_id = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended_at = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.add(self.name, self.started_at, ended_at, self.attributes, self.parent_id, self.span_id)
+        return False
+
+
+class Trace:
+    """
+    1リクエスト分のトレース。段階ごとの span を集め、finish() でエクスポーターに渡す。
+    span は複数のスレッドから記録してよい。
+    """
+
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = os.urandom(16).hex()
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.perf_counter()
+        self.start_time_ns = time.time_ns()
+        self.duration = None
+        self.spans = []
+        self._span_ids = 0
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        """トレース全体の属性を追加する。"""
+        self.attributes.update(attributes)
+
+    def span(self, name: str, attributes: dict) -> Span:
+        return Span(self, name, attributes)
+
+    def next_span_id(self) -> int:
+        with self._lock:
+            self._span_ids += 1
+            return self._span_ids
+
+    def add(self, name: str, started_at: float, ended_at: float, attributes: dict, parent_id, span_id: int):
+        with self._lock:
+            self.spans.append({
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": name,
+                "start_ms": round((started_at - self.started_at) * 1000, 3),
+                "duration_ms": round((ended_at - started_at) * 1000, 3),
+                "attributes": attributes,
+            })
+
+    def record(self, name: str, started_at: float, ended_at: float, attributes: dict = None, parent: int = None):
+        """with文で囲めない段階 (ストリーミングの出力など) の所要時間を記録する。"""
+        self.add(name, started_at, ended_at, attributes or {}, parent, self.next_span_id())
+
+    def finish(self, **attributes):
+        """トレースを終え、エクスポーターに渡す。2回目以降の呼び出しでは何もしない。"""
+        with self._lock:
+            if self.duration is not None:
+                return
+            self.duration = time.perf_counter() - self.started_at
+        self.attributes.update(attributes)
+        _export(self)
+
+    def to_dict(self) -> dict:
+        """JSONに書き出す形式に変換する。span は開始順に並べる。"""
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.start_time_ns / 1e9))
+                         + f".{self.start_time_ns // 1_000_000 % 1000:03d}Z",
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "attributes": self.attributes,
+            "spans": sorted(self.spans, key=lambda span: (span['start_ms'], span['span_id'])),
+        }
+
+
+def current():
+    """実行中のトレースを返す (ない場合は何も記録しないオブジェクト)。"""
+    return _current_trace.get()
+
+
+def span(name: str, **attributes):
+    """
+    with文で囲んだ段階の所要時間を、実行中のトレースに記録する。
+    トレースの実行中でなければ何も記録しない (属性の計算に時間がかかる場合は、with文の中で set() する)。
+    """
+    return _current_trace.get().span(name, attributes)
+
+
+def start(name: str, **attributes):
+    """
+    トレースを開始して返す (実行中のトレースにはしない。activate を参照)。
+    エクスポーターがない場合は何も記録しないオブジェクトを返す。
+    """
+    if not _exporters and not config.TRACE_EXPORTERS:
+        return _NOOP
+    return Trace(name, attributes)
+
+
+class activate:
+    """with文の間、trace を実行中のトレースにする。"""
+
+    __slots__ = ('trace', '_tokens')
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self._tokens = (_current_trace.set(self.trace), _current_span.set(None))
+        return self.trace
+
+    def __exit__(self, *args):
+        _current_trace.reset(self._tokens[0])
+        _current_span.reset(self._tokens[1])
+        return False
+
+
+class _TraceScope(activate):
+    """with文を抜けるときにトレースを終える activate。"""
+
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self.trace.finish(**({'error': exc_type.__name__} if exc_type is not None else {}))
+        return False
+
+
+def trace(name: str, **attributes):
+    """
+    with文で囲んだ処理を1リクエスト分のトレースとして記録し、終わったらエクスポーターに渡す。
+    すでにトレースの実行中であれば、その中の span として記録する。
+    """
+    parent = _current_trace.get()
+    if parent is not _NOOP:
+        return parent.span(name, attributes)
+    new_trace = start(name, **attributes)
+    if new_trace is _NOOP:
+        return _NOOP
+    return _TraceScope(new_trace)
+
+
+def bind(fn):
+    """実行中のトレースと span を引き継いで fn を呼び出す関数を返す (ThreadPoolExecutor に渡す関数に使う)。"""
+    trace = _current_trace.get()
+    if trace is _NOOP:
+        return fn
+    parent_id = _current_span.get()
+
+    def wrapper(*args, **kwargs):
+        tokens = (_current_trace.set(trace), _current_span.set(parent_id))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(tokens[0])
+            _current_span.reset(tokens[1])
+    return wrapper
+
+
+# --- エクスポーター ---
+
+_exporters = []
+_configured = {}
+
+
+def add_exporter(exporter):
+    """終わったトレース (Trace) を受け取る関数を登録する。"""
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    _exporters.remove(exporter)
+
+
+class JsonlExporter:
+    """トレースを1行のJSONとしてファイル (path が '-' の場合は標準エラー出力) に追記する。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != '-':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __call__(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self.path == '-':
+                sys.stderr.write(line)
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class OpenTelemetryExporter:
+    """
+    トレースを OpenTelemetry のスパン (ルートのスパンと、段階ごとの子スパン) に変換して記録する。
+    送信先は、アプリケーション側で設定した OpenTelemetry SDK の TracerProvider に従う。
+    opentelemetry-api がインストールされていない場合は何もしない。
+
+    Args:
+        tracer_provider: スパンを記録する TracerProvider。省略時はグローバルに設定されたもの。
+    """
+
+    def __init__(self, tracer_provider=None):
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError:
+            warn("[WARN] TRACE_EXPORTERS contains 'otel' but opentelemetry-api is not installed. "
+                 "Skipping OpenTelemetry export.")
+            self._otel = None
+            return
+        self._otel = otel_trace
+        self._tracer = otel_trace.get_tracer('doc-sage', tracer_provider=tracer_provider)
+
+    @staticmethod
+    def _attributes(attributes: dict) -> dict:
+        # OpenTelemetryの属性は文字列・数値・真偽値だけを受け付ける
+        return {
+            key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in attributes.items() if value is not None
+        }
+
+    def __call__(self, trace: Trace):
+        if self._otel is None:
+            return
+        record = trace.to_dict()
+        start_ns = trace.start_time_ns
+        root = self._tracer.start_span(trace.name, start_time=start_ns,
+                                       attributes=self._attributes(dict(record['attributes'], trace_id=trace.trace_id)))
+        otel_spans = {}
+        for item in record['spans']:
+            parent = otel_spans.get(item['parent_id'], root)
+            span_start = start_ns + int(item['start_ms'] * 1_000_000)
+            otel_span = self._tracer.start_span(item['name'], context=self._otel.set_span_in_context(parent),
+                                                start_time=span_start, attributes=self._attributes(item['attributes']))
+            otel_span.end(end_time=span_start + int(item['duration_ms'] * 1_000_000))
+            otel_spans[item['span_id']] = otel_span
+        root.end(end_time=start_ns + int(record['duration_ms'] * 1_000_000))
+
+
+def _configured_exporters() -> list:
+    """config.TRACE_EXPORTERS の設定からエクスポーターを作る (設定ごとに一度だけ作る)。"""
+    key = (tuple(config.TRACE_EXPORTERS), config.TRACE_LOG_PATH)
+    exporters = _configured.get(key)
+    if exporters is None:
+        exporters = []
+        for name in config.TRACE_EXPORTERS:
+            if name == 'jsonl':
+                exporters.append(JsonlExporter(config.TRACE_LOG_PATH))
+            elif name == 'otel':
+                exporters.append(OpenTelemetryExporter())
+            else:
+                warn(f"[WARN] Unknown trace exporter: {name}")
+        _configured[key] = exporters
+    return exporters
+
+
+def _export(trace: Trace):
+    for exporter in _configured_exporters() + _exporters:
+        try:
+            exporter(trace)
+        except Exception as e:
+            # 計測の失敗でリクエストを失敗させない
+            warn(f"[WARN] Failed to export trace '{trace.name}': {e}")
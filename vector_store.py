@@ -0,0 +1,337 @@
+"""
+ベクトルストアの共通インターフェースと実装。
+
+main_logic (検索) と db_importer (格納) は、このモジュールの VectorStore を通してデータベースにアクセスする。
+- ChromaVectorStore: ローカル環境のChromaDB
+- PgVectorStore: PostgreSQL + pgvector (AWS環境のRDS、またはローカルのPostgreSQL)
+- NumpyVectorStore (numpy_store.py): プロセス内のNumPy行列 (メモリマップしたスナップショット) によるローカル用の軽量なインデックス
+
+NumpyVectorStore は numpy を使うため別モジュールにし、PgVectorStore (AWS環境) の起動時に読み込まないようにしている。
+NumpyVectorStore と PgVectorStore は、量子化したベクトル (config.VECTOR_QUANTIZATION) で候補を選び、
+上位の候補だけを元の精度のベクトルで並べ替える検索に対応する。
+
+検索結果は、バックエンドによらず次の形式のdictのリスト (クエリごと) で返す。
+    {"id": str, "document": str, "metadata": dict, "distance": float}
+"""
+import json
+import config
+
+# 専用の列に格納し、SQLで直接絞り込むメタデータのキー
+PG_INDEXED_METADATA_KEYS = ('ticket_id', 'content_type')
+
+
+class VectorStore:
+    """ベクトルストアの基底クラス。"""
+
+    def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        """アイテムを追加する。同じidのアイテムがあれば上書きする。"""
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        """指定したidのアイテムを削除する。"""
+        raise NotImplementedError
+
+    def iter_metadata(self, where: dict = None, batch_size: int = 1000):
+        """条件に一致するアイテムの (id, metadata) を順に返す。"""
+        raise NotImplementedError
+
+    def iter_items(self, where: dict = None, batch_size: int = 1000):
+        """条件に一致するアイテムの (id, ベクトル, 本文, metadata) を順に返す。"""
+        raise NotImplementedError
+
+    def query(self, query_embeddings: list, n_results: int, where: dict = None) -> list:
+        """クエリベクトルごとに、類似するアイテムを近い順に最大n_results件返す。"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def flush(self):
+        """変更を永続化する。変更を逐次反映するバックエンドでは何もしない。"""
+        pass
+
+    def close(self):
+        pass
+
+
+class ChromaVectorStore(VectorStore):
+    """ChromaDBのコレクションをラップするベクトルストア。"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def _iter_pages(self, where, batch_size, include):
+        offset = 0
+        while True:
+            kwargs = {'include': include, 'limit': batch_size, 'offset': offset}
+            if where:
+                kwargs['where'] = where
+            page = self.collection.get(**kwargs)
+            yield page
+            if len(page['ids']) < batch_size:
+                return
+            offset += batch_size
+
+    def iter_metadata(self, where=None, batch_size=1000):
+        for page in self._iter_pages(where, batch_size, ['metadatas']):
+            for item_id, metadata in zip(page['ids'], page['metadatas']):
+                yield item_id, metadata or {}
+
+    def iter_items(self, where=None, batch_size=1000):
+        for page in self._iter_pages(where, batch_size, ['embeddings', 'documents', 'metadatas']):
+            for item_id, embedding, document, metadata in zip(
+                    page['ids'], page['embeddings'], page['documents'], page['metadatas']):
+                yield item_id, embedding, document, metadata or {}
+
+    def query(self, query_embeddings, n_results, where=None):
+        kwargs = {'query_embeddings': query_embeddings, 'n_results': n_results}
+        if where:
+            kwargs['where'] = where
+        results = self.collection.query(**kwargs)
+        hits = []
+        for i in range(len(query_embeddings)):
+            distances = (results.get('distances') or [[]] * len(query_embeddings))[i] or []
+            hits.append([
+                {"id": item_id, "document": document, "metadata": metadata or {},
+                 "distance": distances[j] if j < len(distances) else None}
+                for j, (item_id, document, metadata) in enumerate(
+                    zip(results['ids'][i], results['documents'][i], results['metadatas'][i])
+                )
+            ])
+        return hits
+
+    def count(self):
+        return self.collection.count()
+
+
+def _vector_literal(vector) -> str:
+    """pgvectorのテキスト表現 '[0.1,0.2,...]' に変換する。"""
+    return "[" + ",".join(repr(float(value)) for value in vector) + "]"
+
+
+def _where_to_sql(where: dict):
+    """
+    ChromaDB形式の条件 ({"key": value} / {"key": {"$eq": v}} / {"key": {"$in": [...]}}) をSQLに変換する。
+    ticket_id と content_type は専用の列 (インデックス付き) で、それ以外は metadata (JSONB) で比較する。
+    """
+    clauses = []
+    params = []
+    for key, condition in (where or {}).items():
+        column = key if key in PG_INDEXED_METADATA_KEYS else None
+        if isinstance(condition, dict):
+            (operator, value), = condition.items()
+        else:
+            operator, value = '$eq', condition
+        if operator == '$eq':
+            if column:
+                clauses.append(f"{column} = %s")
+            else:
+                clauses.append("metadata ->> %s = %s")
+                params.append(key)
+            params.append(str(value))
+        elif operator == '$in':
+            if column:
+                clauses.append(f"{column} = ANY(%s)")
+            else:
+                clauses.append("metadata ->> %s = ANY(%s)")
+                params.append(key)
+            params.append([str(v) for v in value])
+        else:
+            raise ValueError(f"Unsupported where operator: {operator}")
+    sql = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return sql, params
+
+
+class PgVectorStore(VectorStore):
+    """
+    PostgreSQL + pgvector のベクトルストア。
+
+    - 類似検索はコサイン距離のHNSWインデックスを使う。
+    - ticket_id と content_type は専用の列に格納し、SQLで絞り込む。
+    - 接続はコネクションプールで保持する。Lambdaではモジュールレベルで共有されるため、
+      ウォームスタート時は接続を再利用する (resource_manager.get_vector_store 経由で取得すること)。
+    - 大量の追加はCOPYでステージングテーブルに流し込み、1回のINSERT ... ON CONFLICTで反映する。
+    - quantization='binary' の場合、HNSWインデックスは binary_quantize したビット列 (ハミング距離) に作成し、
+      インデックスで選んだ候補を元のベクトルのコサイン距離で並べ替える (インデックスのサイズは約1/32)。
+
+    Args:
+        dsn (str): PostgreSQLの接続文字列。
+        table (str): テーブル名。
+        dim (int): ベクトルの次元数。省略時は環境設定のEmbeddingモデルの次元数。
+        quantization (str): 'none' または 'binary'。
+    """
+
+    def __init__(self, dsn: str, table: str = None, dim: int = None, min_size: int = None, max_size: int = None,
+                 quantization: str = None):
+        from psycopg_pool import ConnectionPool
+        self.table = table or config.PG_TABLE_NAME
+        self.dim = dim or (config.EMBEDDING_DIM if config.ENVIRONMENT == 'local' else config.AWS_EMBEDDING_DIM)
+        self.quantization = quantization or config.VECTOR_QUANTIZATION
+        if self.quantization not in ('none', 'binary'):
+            raise ValueError(f"The pgvector backend supports 'none' or 'binary' quantization, not: {self.quantization}")
+        self.pool = ConnectionPool(
+            dsn,
+            min_size=config.PG_POOL_MIN_SIZE if min_size is None else min_size,
+            max_size=config.PG_POOL_MAX_SIZE if max_size is None else max_size,
+            kwargs={'autocommit': True},
+            open=True
+        )
+        self.create_schema()
+
+    def create_schema(self):
+        """テーブルとインデックスがなければ作成する。"""
+        with self.pool.connection() as conn:
+            conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " id TEXT PRIMARY KEY,"
+                " ticket_id TEXT,"
+                " content_type TEXT,"
+                " document TEXT NOT NULL,"
+                " metadata JSONB NOT NULL,"
+                f" embedding vector({self.dim}) NOT NULL)"
+            )
+            index_options = f"WITH (m = {int(config.PG_HNSW_M)}, ef_construction = {int(config.PG_HNSW_EF_CONSTRUCTION)})"
+            if self.quantization == 'binary':
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.table}_embedding_bq_hnsw ON {self.table}"
+                    f" USING hnsw ((binary_quantize(embedding)::bit({self.dim})) bit_hamming_ops) {index_options}"
+                )
+            else:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.table}_embedding_hnsw ON {self.table}"
+                    f" USING hnsw (embedding vector_cosine_ops) {index_options}"
+                )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_content_type ON {self.table} (content_type)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_ticket_id ON {self.table} (ticket_id)")
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        with self.pool.connection() as conn:
+            with conn.transaction():
+                conn.execute(
+                    f"CREATE TEMP TABLE IF NOT EXISTS {self.table}_staging"
+                    f" (LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                )
+                with conn.cursor() as cur:
+                    with cur.copy(
+                        f"COPY {self.table}_staging (id, ticket_id, content_type, document, metadata, embedding)"
+                        " FROM STDIN"
+                    ) as copy:
+                        for item_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+                            copy.write_row((
+                                item_id,
+                                metadata.get('ticket_id'),
+                                metadata.get('content_type'),
+                                document,
+                                json.dumps(metadata, ensure_ascii=False),
+                                _vector_literal(embedding),
+                            ))
+                conn.execute(
+                    f"INSERT INTO {self.table} SELECT * FROM {self.table}_staging"
+                    " ON CONFLICT (id) DO UPDATE SET"
+                    " ticket_id = EXCLUDED.ticket_id, content_type = EXCLUDED.content_type,"
+                    " document = EXCLUDED.document, metadata = EXCLUDED.metadata, embedding = EXCLUDED.embedding"
+                )
+
+    def delete(self, ids):
+        if not ids:
+            return
+        with self.pool.connection() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE id = ANY(%s)", (list(ids),))
+
+    def iter_metadata(self, where=None, batch_size=1000):
+        yield from self._iter_rows("id, metadata", where, batch_size)
+
+    def iter_items(self, where=None, batch_size=1000):
+        for item_id, embedding, document, metadata in self._iter_rows(
+                "id, embedding::text, document, metadata", where, batch_size):
+            yield item_id, json.loads(embedding), document, metadata
+
+    def _iter_rows(self, columns: str, where, batch_size):
+        where_sql, params = _where_to_sql(where)
+        last_id = None
+        while True:
+            # idのキーセットページネーション (OFFSETより安定して速い)
+            sql = f"SELECT {columns} FROM {self.table}{where_sql}"
+            page_params = list(params)
+            if last_id is not None:
+                sql += (" AND" if where_sql else " WHERE") + " id > %s"
+                page_params.append(last_id)
+            sql += " ORDER BY id LIMIT %s"
+            page_params.append(batch_size)
+            with self.pool.connection() as conn:
+                rows = conn.execute(sql, page_params).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def query(self, query_embeddings, n_results, where=None):
+        where_sql, params = _where_to_sql(where)
+        if self.quantization == 'binary':
+            # ビット列のインデックスで候補を選び、候補だけを元のベクトルで並べ替える
+            first_k = n_results * max(config.QUANTIZATION_RERANK_FACTOR, 1)
+            sql = (
+                "SELECT id, document, metadata, embedding <=> %s::vector AS distance FROM ("
+                f" SELECT id, document, metadata, embedding FROM {self.table}{where_sql}"
+                f" ORDER BY binary_quantize(embedding)::bit({self.dim}) <~> binary_quantize(%s::vector) LIMIT %s"
+                ") candidates ORDER BY distance LIMIT %s"
+            )
+        else:
+            first_k = n_results
+            sql = (
+                f"SELECT id, document, metadata, embedding <=> %s::vector AS distance FROM {self.table}{where_sql}"
+                " ORDER BY embedding <=> %s::vector LIMIT %s"
+            )
+        hits = []
+        with self.pool.connection() as conn:
+            with conn.transaction():
+                conn.execute(f"SET LOCAL hnsw.ef_search = {int(max(config.PG_HNSW_EF_SEARCH, first_k))}")
+                for vector in query_embeddings:
+                    literal = _vector_literal(vector)
+                    query_params = [literal, *params, literal, first_k]
+                    if self.quantization == 'binary':
+                        query_params.append(n_results)
+                    rows = conn.execute(sql, query_params).fetchall()
+                    hits.append([
+                        {"id": item_id, "document": document, "metadata": metadata, "distance": distance}
+                        for item_id, document, metadata, distance in rows
+                    ])
+        return hits
+
+    def count(self):
+        with self.pool.connection() as conn:
+            (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return count
+
+    def close(self):
+        self.pool.close()
+
+
+def resolve_pg_dsn() -> str:
+    """
+    PostgreSQLの接続文字列を返す。
+    環境変数 PG_DSN があればそれを、なければ DB_SECRET_ARN のSecrets Managerのシークレット (RDSが自動生成するもの) から組み立てる。
+    """
+    if config.PG_DSN:
+        return config.PG_DSN
+    if not config.DB_SECRET_ARN:
+        raise ValueError("PG_DSN or DB_SECRET_ARN must be set to use the pgvector backend.")
+    import boto3
+    secret = json.loads(
+        boto3.client('secretsmanager', region_name=config.AWS_REGION)
+        .get_secret_value(SecretId=config.DB_SECRET_ARN)['SecretString']
+    )
+    return (
+        f"host={secret['host']} port={secret.get('port', 5432)} dbname={secret.get('dbname', 'doc_sage_db')}"
+        f" user={secret['username']} password={secret['password']}"
+    )